@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand
+
+from cart.storage import get_cart_store
+
+
+class Command(BaseCommand):
+    help = 'Persist carts idle in the hot cart store to the database and evict them.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--max-idle-minutes', type=int, default=30,
+            help='Evict carts not modified for this many minutes (default: 30).'
+        )
+
+    def handle(self, *args, **options):
+        store = get_cart_store()
+        if not store.keeps_carts_hot:
+            self.stdout.write('Cart store keeps carts in the database; nothing to flush.')
+            return
+
+        evicted = len(store.evict_idle(options['max_idle_minutes'] * 60))
+        self.stdout.write(self.style.SUCCESS(f'Flushed {evicted} idle carts.'))
@@ -0,0 +1,40 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+
+from cart.services import sweep_stale_carts
+
+
+class Command(BaseCommand):
+    help = 'Deactivate or delete carts that have been idle longer than a TTL.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--ttl-hours', type=float, default=24,
+            help='Carts not modified for this many hours are swept (default: 24).'
+        )
+        parser.add_argument(
+            '--batch-size', type=int, default=1000,
+            help='Width of each id range processed in one transaction (default: 1000).'
+        )
+        parser.add_argument(
+            '--delete', action='store_true',
+            help='Delete idle carts instead of deactivating them.'
+        )
+
+    def handle(self, *args, **options):
+        verb = 'Deleted' if options['delete'] else 'Deactivated'
+
+        def report(processed, seconds):
+            if processed:
+                self.stdout.write(
+                    f'{verb} {processed} carts ({processed / max(seconds, 1e-6):.0f} rows/s)'
+                )
+
+        total = sweep_stale_carts(
+            ttl=timedelta(hours=options['ttl_hours']),
+            batch_size=options['batch_size'],
+            delete=options['delete'],
+            on_batch=report,
+        )
+        self.stdout.write(self.style.SUCCESS(f'{verb} {total} carts in total.'))
@@ -0,0 +1,28 @@
+# Generated by Django 6.0 on 2026-10-17 22:27
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cart', '0001_initial'),
+        ('restaurant', '0001_initial'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AlterModelOptions(
+            name='cart',
+            options={},
+        ),
+        migrations.AlterUniqueTogether(
+            name='cart',
+            unique_together=set(),
+        ),
+        migrations.AddConstraint(
+            model_name='cart',
+            constraint=models.UniqueConstraint(condition=models.Q(('is_active', True)), fields=('customer', 'restaurant'), name='unique_active_cart_per_customer_per_restaurant'),
+        ),
+    ]
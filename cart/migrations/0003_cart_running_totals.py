@@ -0,0 +1,73 @@
+# Generated by Django 6.0 on 2026-10-17 22:32
+
+from django.db import migrations, models
+from django.db.models import DecimalField, ExpressionWrapper, F, IntegerField, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+
+
+def backfill_running_totals(apps, schema_editor):
+    Cart = apps.get_model('cart', 'Cart')
+    CartItem = apps.get_model('cart', 'CartItem')
+    CartAddOn = apps.get_model('cart', 'CartAddOn')
+
+    add_ons_total = CartAddOn.objects.filter(
+        cart_item=OuterRef('pk')
+    ).values('cart_item').annotate(
+        total=Sum(ExpressionWrapper(
+            F('quantity') * F('add_on__price'), output_field=DecimalField()
+        ))
+    ).values('total')
+
+    menu_item_price = CartItem.objects.filter(
+        pk=OuterRef('pk')
+    ).values('menu_item__price')
+
+    CartItem.objects.update(
+        subtotal=ExpressionWrapper(
+            F('quantity') * Subquery(menu_item_price)
+            + Coalesce(Subquery(add_ons_total), Value(0), output_field=DecimalField()),
+            output_field=DecimalField()
+        )
+    )
+
+    cart_items = CartItem.objects.filter(
+        cart=OuterRef('pk')
+    ).values('cart')
+    Cart.objects.update(
+        subtotal=Coalesce(
+            Subquery(cart_items.annotate(total=Sum('subtotal')).values('total')),
+            Value(0),
+            output_field=DecimalField()
+        ),
+        items_count=Coalesce(
+            Subquery(cart_items.annotate(total=Sum('quantity')).values('total')),
+            Value(0),
+            output_field=IntegerField()
+        )
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cart', '0002_cart_active_constraint'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='cart',
+            name='items_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='cart',
+            name='subtotal',
+            field=models.DecimalField(decimal_places=2, default=0, max_digits=10),
+        ),
+        migrations.AddField(
+            model_name='cartitem',
+            name='subtotal',
+            field=models.DecimalField(decimal_places=2, default=0, max_digits=10),
+        ),
+        migrations.RunPython(backfill_running_totals, migrations.RunPython.noop),
+    ]
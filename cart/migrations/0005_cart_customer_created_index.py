@@ -0,0 +1,20 @@
+# Generated by Django 6.0 on 2026-10-17 22:38
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cart', '0004_cart_version'),
+        ('restaurant', '0001_initial'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='cart',
+            index=models.Index(fields=['customer', 'created_at'], name='cart_customer_created_idx'),
+        ),
+    ]
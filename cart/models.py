@@ -1,8 +1,13 @@
 from django.db import models, transaction
 from hungryBird.baseModels import TimeStampedModel
 from django.core.exceptions import ValidationError
-from django.db.models import Q, UniqueConstraint, Sum, F, DecimalField, ExpressionWrapper
-from order.models import Order, OrderItem, OrderAddOn
+from django.utils import timezone
+from django.db.models import Q, UniqueConstraint, Sum, F, DecimalField, ExpressionWrapper, Prefetch, \
+    OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+from order.kitchen import KitchenQueue
+from order.rollups import SalesRollup
+from order.models import Order, OrderItem, OrderAddOn, OrderStatusEvent
 
 class Cart(TimeStampedModel):
     """
@@ -19,6 +24,11 @@ class Cart(TimeStampedModel):
         on_delete=models.CASCADE, 
         related_name='carts'
     )
+    # Running totals, kept in step by every write path so reads are a single row
+    subtotal = models.DecimalField(max_digits=10, decimal_places=2, default=0)
+    items_count = models.PositiveIntegerField(default=0)
+    # Bumped on every change; served as the cart's ETag
+    version = models.PositiveIntegerField(default=0)
 
     class Meta:
         constraints = [
@@ -28,48 +38,116 @@ class Cart(TimeStampedModel):
                 name = 'unique_active_cart_per_customer_per_restaurant'
             )
         ]
+        indexes = [
+            models.Index(
+                fields = ['customer', 'created_at'],
+                name = 'cart_customer_created_idx'
+            )
+        ]
 
     def save(self, *args, **kwargs):
         self.full_clean()
+        bump = not self._state.adding
+        if bump:
+            # Bumped in the UPDATE so a concurrent F() bump is not overwritten
+            self.version = F('version') + 1
+            if kwargs.get('update_fields') is not None:
+                kwargs['update_fields'] = {*kwargs['update_fields'], 'version'}
         super().save(*args, **kwargs)
+        if bump:
+            self.refresh_from_db(fields=['version'])
 
 
+    @classmethod
+    def snapshot_queryset(cls):
+        """
+        Carts with customer, restaurant, items and add-ons loaded up front,
+        so a full cart snapshot costs the same number of queries at any size.
+        """
+        return cls.objects.select_related(
+            'customer', 'restaurant'
+        ).prefetch_related(
+            Prefetch(
+                'cart_items',
+                CartItem.objects.select_related('menu_item').prefetch_related(
+                    Prefetch(
+                        'cart_add_ons',
+                        CartAddOn.objects.select_related('add_on')
+                    )
+                )
+            )
+        )
+
     def get_total_price(self):
-        """Calculate total cart price including items and add-ons"""
-        items_total = self.cart_items.aggregate(
-            total = Sum(
-                F("quantity") * F("menu_item__price"),
-                output_field=DecimalField()
-            ))["total"] or 0
+        """Total cart price including items and add-ons"""
+        return self.subtotal
 
-        addons_total = CartAddOn.objects.filter(
-                cart_item__cart=self
-            ).aggregate(
-                total = Sum(
-                    F("quantity") * F("add_on__price"),
-                    output_field=DecimalField()
-                )
-            )["total"] or 0
-        
-        return items_total + addons_total
-    
 
-    def add_item(self, menu_item, quantity):
-        if menu_item.restaurant_id != self.restaurant_id:
-            raise ValidationError(
-                "Menu item does not belong to the cart's restaurant."
-            )
-        
-        item, created = CartItem.objects.get_or_create(
-            cart = self,
-            menu_item = menu_item,
-            defaults = {'quantity': quantity}
+    def refresh_totals(self):
+        """
+        Re-sum the running totals from the cart's lines in the same UPDATE,
+        so saves that overlap cannot leave them out of step with the lines.
+        Also stamps updated_at, which is what idle carts are swept by.
+        """
+        lines = CartItem.objects.filter(cart=OuterRef('pk')).values('cart')
+        Cart.objects.filter(pk=self.pk).update(
+            subtotal = Coalesce(
+                Subquery(lines.annotate(total=Sum('subtotal')).values('total')),
+                Value(0),
+                output_field=DecimalField()
+            ),
+            items_count = Coalesce(
+                Subquery(lines.annotate(total=Sum('quantity')).values('total')),
+                Value(0)
+            ),
+            version = F('version') + 1,
+            updated_at = timezone.now()
         )
 
-        if not created:
-            item.quantity += quantity
-            item.save()
 
+    @classmethod
+    def reprice(cls, menu_item_id=None, price_change=0, add_on_id=None):
+        """
+        Apply a menu item or add-on price change to every active cart that
+        holds it: line subtotals shift by quantity * price_change and the
+        affected carts' subtotals are re-summed, all as bulk UPDATEs.
+        """
+        items = CartItem.objects.filter(cart__is_active=True)
+        if menu_item_id is not None:
+            items = items.filter(menu_item_id=menu_item_id)
+            line_change = F('quantity') * Value(price_change)
+        else:
+            items = items.filter(cart_add_ons__add_on_id=add_on_id)
+            line_change = Subquery(
+                CartAddOn.objects.filter(
+                    cart_item=OuterRef('pk'), add_on_id=add_on_id
+                ).values('quantity')[:1]
+            ) * Value(price_change)
+
+        with transaction.atomic():
+            cart_ids = list(items.values_list('cart_id', flat=True))
+            if not cart_ids:
+                return
+            CartItem.objects.filter(
+                pk__in=items.values('pk')
+            ).update(subtotal=F('subtotal') + ExpressionWrapper(
+                line_change, output_field=DecimalField()
+            ))
+
+            cls.objects.filter(id__in=cart_ids).update(
+                version=F('version') + 1,
+                subtotal=Coalesce(
+                    Subquery(
+                        CartItem.objects.filter(cart=OuterRef('pk'))
+                        .values('cart')
+                        .annotate(total=Sum('subtotal'))
+                        .values('total')
+                    ),
+                    Value(0),
+                    output_field=DecimalField()
+                )
+            )
+    
 
     def confirm(self, delivery_address):
         """
@@ -78,40 +156,73 @@ class Cart(TimeStampedModel):
         2. Clone CartItems to OrderItems
         3. Clone CartAddOns to OrderAddOns
         4. Deactivate the cart
+
+        Items and add-ons are loaded once and written with bulk inserts,
+        so the statement count does not grow with the size of the cart.
         """
         if not self.is_active:
             raise ValidationError("Cannot confirm an inactive cart.")
-        if not self.cart_items.exists():
+
+        cart_items = list(
+            self.cart_items.select_related('menu_item').prefetch_related(
+                Prefetch(
+                    'cart_add_ons',
+                    CartAddOn.objects.select_related('add_on')
+                )
+            )
+        )
+        if not cart_items:
             raise ValidationError("Cannot confirm an empty cart.")
-        
+
+        line_totals = [
+            cart_item.get_item_total() + sum(
+                addon.get_add_on_total()
+                for addon in cart_item.cart_add_ons.all()
+            )
+            for cart_item in cart_items
+        ]
+        total_price = sum(line_totals)
 
         with transaction.atomic():
             order = Order.objects.create(
-                customer = self.customer,
-                restaurant = self.restaurant,
+                customer_id = self.customer_id,
+                restaurant_id = self.restaurant_id,
                 delivery_address = delivery_address,
-                total_price = self.get_total_price()
+                total_price = total_price
             )
 
-            for cart_item in self.cart_items.select_related("menu_item"):
-                order_item = OrderItem.objects.create(
+            order_items = OrderItem.objects.bulk_create([
+                OrderItem(
                     order = order,
-                    menu_item = cart_item.menu_item,
-                    quantity = cart_item.quantity
+                    menu_item_id = cart_item.menu_item_id,
+                    quantity = cart_item.quantity,
+                    unit_price = cart_item.menu_item.price,
+                    line_total = line_total
                 )
+                for cart_item, line_total in zip(cart_items, line_totals)
+            ])
+
+            OrderAddOn.objects.bulk_create([
+                OrderAddOn(
+                    order_item = order_item,
+                    add_on_id = addon.add_on_id,
+                    quantity = addon.quantity,
+                    unit_price = addon.add_on.price,
+                    line_total = addon.get_add_on_total()
+                )
+                for cart_item, order_item in zip(cart_items, order_items)
+                for addon in cart_item.cart_add_ons.all()
+            ])
 
-
-                OrderAddOn.objects.bulk_create([
-                    OrderAddOn(
-                        order_item = order_item,
-                        add_on = addon.add_on,
-                        quantity = addon.quantity
-                    )
-                    for addon in cart_item.cart_add_ons.all()
-                ])
-
+            Cart.objects.filter(pk=self.pk).update(
+                is_active=False, version=F('version') + 1
+            )
             self.is_active = False
-            self.save(update_fields=['is_active'])
+            OrderStatusEvent.placed(order).save()
+            rollup = SalesRollup()
+            rollup.placed(order, order_items)
+            rollup.save()
+            KitchenQueue.record([order])
         
         return order
 
@@ -119,11 +230,7 @@ class Cart(TimeStampedModel):
 
     def get_items_count(self):
         """Get total number of items in cart"""
-        return sum([item.quantity for item in self.cart_items.all()])
-
-    def clear(self):
-        """Empty the cart"""
-        self.cart_items.all().delete()
+        return self.items_count
 
     def __str__(self):
         return f"Cart for {self.customer.username} - {self.restaurant.name}"
@@ -146,6 +253,8 @@ class CartItem(TimeStampedModel):
         related_name='in_carts'
     )
     quantity = models.PositiveIntegerField()
+    # quantity * menu item price plus the line's add-ons
+    subtotal = models.DecimalField(max_digits=10, decimal_places=2, default=0)
 
     class Meta:
         verbose_name = 'Cart Item'
@@ -3,25 +3,44 @@ from .models import Cart, CartItem, CartAddOn
 from restaurant.models import MenuItem, AddOn
 
 
-class AddCartItemSerializer(serializers.Serializer):
-    menu_item = serializers.PrimaryKeyRelatedField(
-        queryset=MenuItem.objects.filter(is_available=True)
-    )
-    quantity = serializers.IntegerField(min_value=1)
-
-
-class AddCartAddonSerializer(serializers.Serializer):
-    cart_item = serializers.PrimaryKeyRelatedField(
-        queryset=CartItem.objects.all()
-    )
-    add_on = serializers.PrimaryKeyRelatedField(
-        queryset=AddOn.objects.all()
-    )
-    quantity = serializers.IntegerField(min_value=1)
-
-
-class UpdateQuantitySerializer(serializers.Serializer):
-    quantity = serializers.IntegerField(min_value=1)
+class CartOperationSerializer(serializers.Serializer):
+    """A single operation inside a batch, mirroring the per-call cart actions"""
+    REQUIRED_FIELDS = {
+        'add_item': ('menu_item', 'quantity'),
+        'add_addon': ('add_on', 'quantity'),
+        'update_item_quantity': ('cart_item_id', 'quantity'),
+        'update_addon_quantity': ('addon_id', 'quantity'),
+        'remove_item': ('cart_item_id',),
+        'remove_addon': ('addon_id',),
+        'clear': (),
+    }
+
+    op = serializers.ChoiceField(choices=list(REQUIRED_FIELDS))
+    menu_item = serializers.IntegerField(required=False)
+    cart_item = serializers.IntegerField(required=False)
+    cart_item_id = serializers.IntegerField(required=False)
+    add_on = serializers.IntegerField(required=False)
+    addon_id = serializers.IntegerField(required=False)
+    quantity = serializers.IntegerField(min_value=1, required=False)
+
+    def validate(self, attrs):
+        missing = [
+            field for field in self.REQUIRED_FIELDS[attrs['op']]
+            if field not in attrs
+        ]
+        if attrs['op'] == 'add_addon' and \
+                'cart_item' not in attrs and 'menu_item' not in attrs:
+            missing.append('cart_item')
+
+        if missing:
+            raise serializers.ValidationError(
+                {field: 'This field is required.' for field in missing}
+            )
+        return attrs
+
+
+class CartBatchSerializer(serializers.Serializer):
+    operations = CartOperationSerializer(many=True, allow_empty=False)
 
 
 
@@ -135,3 +154,72 @@ class CartSerializer(serializers.ModelSerializer):
 
     def get_items_count(self, obj):
         return obj.get_items_count()
+
+
+class CartStateSerializer(CartSerializer):
+    """
+    Renders a cart whose lines live in a hot cart store rather than in
+    CartItem/CartAddOn rows. Expects the CartState in context['cart_state'].
+    """
+    cart_items = serializers.SerializerMethodField()
+
+    def to_representation(self, instance):
+        state = self.context['cart_state']
+        self.menu_items = MenuItem.objects.in_bulk(list(state.lines))
+        self.add_ons = AddOn.objects.in_bulk([
+            add_on_id
+            for add_ons in state.line_add_ons.values()
+            for add_on_id in add_ons
+        ])
+        return super().to_representation(instance)
+
+    def _lines(self):
+        state = self.context['cart_state']
+        for menu_item_id, quantity in state.lines.items():
+            menu_item = self.menu_items.get(menu_item_id)
+            if menu_item is None:
+                continue
+            add_ons = [
+                (self.add_ons[add_on_id], add_on_quantity)
+                for add_on_id, add_on_quantity
+                in state.line_add_ons.get(menu_item_id, {}).items()
+                if add_on_id in self.add_ons
+            ]
+            yield menu_item, quantity, add_ons
+
+    def get_cart_items(self, obj):
+        return [
+            {
+                'id': menu_item.id,
+                'menu_item': menu_item.id,
+                'menu_item_name': menu_item.name,
+                'menu_item_price': str(menu_item.price),
+                'menu_item_description': menu_item.description,
+                'quantity': quantity,
+                'cart_add_ons': [
+                    {
+                        'id': add_on.id,
+                        'add_on': add_on.id,
+                        'add_on_name': add_on.name,
+                        'add_on_price': str(add_on.price),
+                        'quantity': add_on_quantity,
+                        'total': add_on.price * add_on_quantity,
+                    }
+                    for add_on, add_on_quantity in add_ons
+                ],
+                'item_total': menu_item.price * quantity,
+            }
+            for menu_item, quantity, add_ons in self._lines()
+        ]
+
+    def get_total_price(self, obj):
+        return sum(
+            menu_item.price * quantity + sum(
+                add_on.price * add_on_quantity
+                for add_on, add_on_quantity in add_ons
+            )
+            for menu_item, quantity, add_ons in self._lines()
+        )
+
+    def get_items_count(self, obj):
+        return sum(quantity for _, quantity, _ in self._lines())
@@ -0,0 +1,188 @@
+import time
+
+from django.core.exceptions import ValidationError
+from django.db import transaction
+from django.db.models import F, Max, Min, Q
+from django.utils import timezone
+
+from restaurant.models import MenuItem, AddOn
+from .models import Cart, CartItem, CartAddOn
+from .storage import CartConflict, get_cart_store
+
+
+class CartBatch:
+    """
+    Applies an ordered list of cart operations to the cart's state and
+    hands the result to the cart store in one write.
+
+    Menu items and add-ons referenced by the batch are fetched once up
+    front, so validation does not re-query per operation the way
+    CartItem.full_clean() does.
+
+    When a hot store reports the cart changed underneath the batch, the
+    batch is replayed on the fresh state, up to MAX_ATTEMPTS times.
+    """
+    MAX_ATTEMPTS = 5
+
+    def __init__(self, cart, store=None):
+        self.cart = cart
+        self.store = store or get_cart_store()
+        self.state = None
+        self.menu_items = {}
+        self.add_ons = {}
+
+
+    def apply(self, operations):
+        if not self.cart.is_active:
+            raise ValidationError("Cannot modify an inactive cart.")
+
+        self._load_lookups(operations)
+
+        for _ in range(self.MAX_ATTEMPTS):
+            self.state = self.store.load(self.cart)
+            for index, operation in enumerate(operations):
+                handler = getattr(self, f"_{operation['op']}")
+                try:
+                    handler(operation)
+                except ValidationError as e:
+                    raise ValidationError(f"Operation #{index}: {e.message}")
+
+            try:
+                self.store.save(self.cart, self.state)
+            except CartConflict:
+                continue
+            return self.state
+
+        raise ValidationError("The cart is being changed elsewhere, please try again.")
+
+
+    def _load_lookups(self, operations):
+        """Fetch every menu item and add-on the batch refers to, once"""
+        menu_item_ids = {
+            op['menu_item'] for op in operations
+            if op['op'] == 'add_item'
+        }
+        add_on_ids = {
+            op['add_on'] for op in operations
+            if op['op'] == 'add_addon'
+        }
+
+        if menu_item_ids:
+            self.menu_items = MenuItem.objects.in_bulk(menu_item_ids)
+        if add_on_ids:
+            self.add_ons = AddOn.objects.in_bulk(add_on_ids)
+
+
+    # Lookups into the current state
+    def _get_line(self, cart_item_id):
+        menu_item_id = self.state.item_ids.get(cart_item_id)
+        if menu_item_id not in self.state.lines:
+            raise ValidationError("Invalid cart item for this cart.")
+        return menu_item_id
+
+    def _get_line_add_on(self, addon_id):
+        menu_item_id, add_on_id = self.state.add_on_ids.get(addon_id, (None, None))
+        if add_on_id not in self.state.line_add_ons.get(menu_item_id, {}):
+            raise ValidationError("Invalid add-on for this cart.")
+        return menu_item_id, add_on_id
+
+
+    # Operations
+    def _add_item(self, op):
+        menu_item = self.menu_items.get(op['menu_item'])
+        if menu_item is None or menu_item.restaurant_id != self.cart.restaurant_id:
+            raise ValidationError(
+                "Menu item does not belong to the cart's restaurant."
+            )
+        if not menu_item.is_available:
+            raise ValidationError(f"{menu_item.name} is not available.")
+
+        lines = self.state.lines
+        lines[menu_item.id] = lines.get(menu_item.id, 0) + op['quantity']
+        self.state.line_add_ons.setdefault(menu_item.id, {})
+
+    def _add_addon(self, op):
+        if op.get('cart_item') is not None:
+            menu_item_id = self._get_line(op['cart_item'])
+        elif op['menu_item'] in self.state.lines:
+            menu_item_id = op['menu_item']
+        else:
+            raise ValidationError("Invalid cart item for this cart.")
+
+        add_on = self.add_ons.get(op['add_on'])
+        if add_on is None or add_on.menu_item_id != menu_item_id:
+            raise ValidationError("Add-on does not belong to this menu item.")
+
+        self.state.line_add_ons[menu_item_id][add_on.id] = op['quantity']
+
+    def _update_item_quantity(self, op):
+        self.state.lines[self._get_line(op['cart_item_id'])] = op['quantity']
+
+    def _update_addon_quantity(self, op):
+        menu_item_id, add_on_id = self._get_line_add_on(op['addon_id'])
+        self.state.line_add_ons[menu_item_id][add_on_id] = op['quantity']
+
+    def _remove_item(self, op):
+        menu_item_id = self._get_line(op['cart_item_id'])
+        del self.state.lines[menu_item_id]
+        self.state.line_add_ons.pop(menu_item_id, None)
+
+    def _remove_addon(self, op):
+        menu_item_id, add_on_id = self._get_line_add_on(op['addon_id'])
+        del self.state.line_add_ons[menu_item_id][add_on_id]
+
+    def _clear(self, op):
+        self.state.lines.clear()
+        self.state.line_add_ons.clear()
+
+
+
+def sweep_stale_carts(ttl, batch_size=1000, delete=False, on_batch=None):
+    """
+    Deactivate active carts idle for longer than `ttl` (a timedelta), or
+    with delete=True remove every cart, active or not, idle that long.
+    Works through bounded id ranges, each in its own short
+    transaction with one bulk UPDATE or DELETE per table, so no lock is
+    held for the whole sweep.
+
+    `on_batch(processed, seconds)` is called after every batch.
+    Returns the total number of carts processed.
+    """
+    store = get_cart_store()
+    # Persist idle hot carts first, and leave carts still live in the store alone.
+    # Flushing stamps updated_at, so the flushed carts are swept by id.
+    evicted_cart_ids = store.evict_idle(ttl.total_seconds())
+    live_cart_ids = store.touched_since(time.time() - ttl.total_seconds())
+
+    stale = Cart.objects.filter(
+        Q(updated_at__lt=timezone.now() - ttl) | Q(id__in=evicted_cart_ids)
+    ).exclude(id__in=live_cart_ids)
+    if not delete:
+        stale = stale.filter(is_active=True)
+
+    bounds = stale.aggregate(low=Min('id'), high=Max('id'))
+    if bounds['low'] is None:
+        return 0
+
+    total = 0
+    for start in range(bounds['low'], bounds['high'] + 1, batch_size):
+        started = time.monotonic()
+        batch = stale.filter(id__gte=start, id__lt=start + batch_size)
+
+        with transaction.atomic():
+            if delete:
+                cart_ids = list(batch.values_list('id', flat=True))
+                CartAddOn.objects.filter(cart_item__cart_id__in=cart_ids).delete()
+                CartItem.objects.filter(cart_id__in=cart_ids).delete()
+                _, deleted = Cart.objects.filter(id__in=cart_ids).delete()
+                processed = deleted.get(Cart._meta.label, 0)
+            else:
+                processed = batch.update(
+                    is_active=False, version=F('version') + 1
+                )
+
+        total += processed
+        if on_batch:
+            on_batch(processed, time.monotonic() - started)
+
+    return total
@@ -0,0 +1,40 @@
+'''
+Keep the running totals of active carts in step with menu prices.
+'''
+
+from django.db import transaction
+from django.db.models.signals import pre_save
+from django.dispatch import receiver
+
+from restaurant.models import MenuItem, AddOn
+from .models import Cart
+
+
+def _price_change(sender, instance, update_fields):
+    if instance._state.adding or \
+            (update_fields is not None and 'price' not in update_fields):
+        return 0
+
+    old_price = sender.objects.filter(pk=instance.pk) \
+        .values_list('price', flat=True).first()
+    if old_price is None:
+        return 0
+    return instance.price - old_price
+
+
+@receiver(pre_save, sender=MenuItem)
+def reprice_carts_for_menu_item(sender, instance, update_fields=None, **kwargs):
+    price_change = _price_change(sender, instance, update_fields)
+    if price_change:
+        transaction.on_commit(lambda: Cart.reprice(
+            menu_item_id=instance.pk, price_change=price_change
+        ))
+
+
+@receiver(pre_save, sender=AddOn)
+def reprice_carts_for_add_on(sender, instance, update_fields=None, **kwargs):
+    price_change = _price_change(sender, instance, update_fields)
+    if price_change:
+        transaction.on_commit(lambda: Cart.reprice(
+            add_on_id=instance.pk, price_change=price_change
+        ))
@@ -0,0 +1,497 @@
+'''
+Storage backends for cart lines.
+
+The default DatabaseCartStore keeps lines in CartItem/CartAddOn rows.
+The hash-based stores keep active carts in Redis (or an in-process dict
+for tests) and only write them to the relational tables when the cart is
+confirmed or evicted, which keeps quantity taps off the database write lock.
+
+In a hot store a cart line is identified by its menu item id and an
+add-on by its add-on id, so those are the ids clients see and send back.
+
+Select the backend with the CART_STORE setting:
+
+    CART_STORE = {
+        'BACKEND': 'cart.storage.RedisCartStore',
+        'OPTIONS': {'url': 'redis://127.0.0.1:6379/1'},
+    }
+'''
+
+import threading
+import time
+
+from django.conf import settings
+from django.db import transaction
+from django.utils.module_loading import import_string
+
+from restaurant.models import MenuItem, AddOn
+from .models import Cart, CartItem, CartAddOn
+
+
+class CartConflict(Exception):
+    """The hot copy of a cart changed since its state was loaded"""
+
+
+
+class CartState:
+    """Quantities of a cart's lines, keyed by menu item and add-on ids"""
+
+    def __init__(self, lines=None, line_add_ons=None, item_ids=None,
+                 add_on_ids=None, version=0):
+        # {menu_item_id: quantity}
+        self.lines = lines or {}
+        # {menu_item_id: {add_on_id: quantity}}
+        self.line_add_ons = line_add_ons or {}
+        # Client facing ids -> menu_item_id / (menu_item_id, add_on_id)
+        self.item_ids = item_ids or {}
+        self.add_on_ids = add_on_ids or {}
+        self.version = version
+        self.rows = None
+
+    @classmethod
+    def from_rows(cls, cart_items):
+        state = cls(
+            lines={item.menu_item_id: item.quantity for item in cart_items},
+            line_add_ons={
+                item.menu_item_id: {
+                    add_on.add_on_id: add_on.quantity
+                    for add_on in item.cart_add_ons.all()
+                }
+                for item in cart_items
+            },
+            item_ids={item.id: item.menu_item_id for item in cart_items},
+            add_on_ids={
+                add_on.id: (item.menu_item_id, add_on.add_on_id)
+                for item in cart_items
+                for add_on in item.cart_add_ons.all()
+            },
+        )
+        state.rows = cart_items
+        return state
+
+    @classmethod
+    def keyed_by_menu(cls, lines, line_add_ons, version=0):
+        """State whose client facing ids are the menu item and add-on ids"""
+        return cls(
+            lines=lines,
+            line_add_ons=line_add_ons,
+            item_ids={menu_item_id: menu_item_id for menu_item_id in lines},
+            add_on_ids={
+                add_on_id: (menu_item_id, add_on_id)
+                for menu_item_id, add_ons in line_add_ons.items()
+                for add_on_id in add_ons
+            },
+            version=version,
+        )
+
+
+
+class BaseCartStore:
+    # Whether lines live outside the relational tables between writes
+    keeps_carts_hot = False
+
+    def load(self, cart):
+        raise NotImplementedError("Subclasses must implement this method.")
+
+    def save(self, cart, state):
+        """
+        Store `state`. Hot stores raise CartConflict when the cart was
+        written by someone else since `state` was loaded.
+        """
+        raise NotImplementedError("Subclasses must implement this method.")
+
+    def flush(self, cart):
+        """Persist a hot cart to the relational tables and drop the hot copy"""
+
+    def discard(self, cart):
+        """Drop the hot copy of a cart without persisting it"""
+
+    def evict_idle(self, max_idle_seconds):
+        """Flush carts untouched for max_idle_seconds, returning their ids"""
+        return []
+
+    def touched_since(self, timestamp):
+        """Ids of hot carts written after `timestamp` (a Unix time)"""
+        return []
+
+    def get_version(self, cart_id):
+        """Version of the hot copy of a cart, or None when it is not hot"""
+        return None
+
+
+
+class DatabaseCartStore(BaseCartStore):
+    def load(self, cart):
+        return CartState.from_rows(
+            list(cart.cart_items.prefetch_related('cart_add_ons'))
+        )
+
+    def save(self, cart, state):
+        """
+        Write the difference between the stored rows and the state, then
+        re-sum the cart's running totals from its lines. The cart row is
+        locked first so overlapping saves total up one after the other.
+        """
+        rows = state.rows
+        if rows is None:
+            rows = list(cart.cart_items.prefetch_related('cart_add_ons'))
+        state.rows = None
+
+        items = {item.menu_item_id: item for item in rows}
+        add_ons = {
+            (item.menu_item_id, add_on.add_on_id): add_on
+            for item in rows
+            for add_on in item.cart_add_ons.all()
+        }
+        stored_line_add_ons = {
+            item.menu_item_id: {
+                add_on.add_on_id: add_on.quantity
+                for add_on in item.cart_add_ons.all()
+            }
+            for item in rows
+        }
+
+        removed_items = [
+            item for menu_item_id, item in items.items()
+            if menu_item_id not in state.lines
+        ]
+        removed_add_on_ids = [
+            add_on.id for (menu_item_id, add_on_id), add_on in add_ons.items()
+            if menu_item_id in state.lines
+            and add_on_id not in state.line_add_ons.get(menu_item_id, {})
+        ]
+
+        # Lines whose quantity or add-ons changed need a fresh subtotal
+        touched = [
+            menu_item_id for menu_item_id, quantity in state.lines.items()
+            if menu_item_id not in items
+            or items[menu_item_id].quantity != quantity
+            or stored_line_add_ons[menu_item_id] != state.line_add_ons.get(menu_item_id, {})
+        ]
+        menu_items = MenuItem.objects.only('price').in_bulk(touched)
+        add_on_prices = AddOn.objects.only('price').in_bulk([
+            add_on_id
+            for menu_item_id in touched
+            for add_on_id in state.line_add_ons.get(menu_item_id, {})
+        ])
+
+        new_items = []
+        changed_items = []
+        for menu_item_id in touched:
+            quantity = state.lines[menu_item_id]
+            subtotal = menu_items[menu_item_id].price * quantity + sum(
+                add_on_prices[add_on_id].price * add_on_quantity
+                for add_on_id, add_on_quantity
+                in state.line_add_ons.get(menu_item_id, {}).items()
+            )
+
+            item = items.get(menu_item_id)
+            if item is None:
+                new_items.append(CartItem(
+                    cart=cart, menu_item_id=menu_item_id,
+                    quantity=quantity, subtotal=subtotal
+                ))
+            else:
+                item.quantity = quantity
+                item.subtotal = subtotal
+                changed_items.append(item)
+
+        with transaction.atomic():
+            Cart.objects.select_for_update().only('pk').get(pk=cart.pk)
+            if removed_items:
+                CartItem.objects.filter(
+                    id__in=[item.id for item in removed_items]
+                ).delete()
+            if removed_add_on_ids:
+                CartAddOn.objects.filter(id__in=removed_add_on_ids).delete()
+
+            # A concurrent save may have inserted the same line since the
+            # rows were read; take it over rather than fail on the unique key
+            CartItem.objects.bulk_create(
+                new_items, update_conflicts=True,
+                unique_fields=['cart', 'menu_item'],
+                update_fields=['quantity', 'subtotal']
+            )
+            CartItem.objects.bulk_update(changed_items, ['quantity', 'subtotal'])
+            items.update({item.menu_item_id: item for item in new_items})
+
+            new_add_ons = []
+            changed_add_ons = []
+            for menu_item_id, line_add_ons in state.line_add_ons.items():
+                for add_on_id, quantity in line_add_ons.items():
+                    add_on = add_ons.get((menu_item_id, add_on_id))
+                    if add_on is None:
+                        new_add_ons.append(CartAddOn(
+                            cart_item=items[menu_item_id],
+                            add_on_id=add_on_id,
+                            quantity=quantity
+                        ))
+                    elif add_on.quantity != quantity:
+                        add_on.quantity = quantity
+                        changed_add_ons.append(add_on)
+
+            CartAddOn.objects.bulk_create(
+                new_add_ons, update_conflicts=True,
+                unique_fields=['cart_item', 'add_on'],
+                update_fields=['quantity']
+            )
+            CartAddOn.objects.bulk_update(changed_add_ons, ['quantity'])
+
+            cart.refresh_totals()
+
+
+
+class HashCartStore(BaseCartStore):
+    """
+    Keeps each active cart in a flat hash:
+        i:<menu_item_id>             -> quantity
+        a:<menu_item_id>:<add_on_id> -> quantity
+        _v                           -> version, bumped on every save
+    plus an index of cart ids scored by last write time for eviction.
+    """
+    keeps_carts_hot = True
+
+    def __init__(self, key_prefix='cart'):
+        self.key_prefix = key_prefix
+        self.index_key = f'{key_prefix}:hot'
+
+    def key(self, cart_id):
+        return f'{self.key_prefix}:{cart_id}'
+
+
+    # Backend primitives
+    def _read(self, key):
+        raise NotImplementedError("Subclasses must implement this method.")
+
+    def _write(self, key, mapping, cart_id, touched_at, version=None):
+        """
+        Replace the hash, only if still at `version`, or still missing
+        when `version` is None. Returns whether it was written.
+        """
+        raise NotImplementedError("Subclasses must implement this method.")
+
+    def _delete(self, key, cart_id, version=None):
+        """Delete the hash, only if still at `version` when one is given"""
+        raise NotImplementedError("Subclasses must implement this method.")
+
+    def _idle_cart_ids(self, touched_before):
+        raise NotImplementedError("Subclasses must implement this method.")
+
+    def _touched_cart_ids(self, touched_after):
+        raise NotImplementedError("Subclasses must implement this method.")
+
+    def _read_version(self, key):
+        raise NotImplementedError("Subclasses must implement this method.")
+
+
+    # Encoding
+    @staticmethod
+    def _encode(state):
+        mapping = {'_v': state.version + 1}
+        for menu_item_id, quantity in state.lines.items():
+            mapping[f'i:{menu_item_id}'] = quantity
+            for add_on_id, add_on_quantity in \
+                    state.line_add_ons.get(menu_item_id, {}).items():
+                mapping[f'a:{menu_item_id}:{add_on_id}'] = add_on_quantity
+        return mapping
+
+    @staticmethod
+    def _decode(fields):
+        lines = {}
+        line_add_ons = {}
+        for field, value in fields.items():
+            parts = field.split(':')
+            if parts[0] == 'i':
+                lines[int(parts[1])] = int(value)
+                line_add_ons.setdefault(int(parts[1]), {})
+            elif parts[0] == 'a':
+                line_add_ons.setdefault(int(parts[1]), {})[int(parts[2])] = int(value)
+        return CartState.keyed_by_menu(
+            lines, line_add_ons, version=int(fields.get('_v', 0))
+        )
+
+
+    def load(self, cart):
+        fields = self._read(self.key(cart.pk))
+        if fields is not None:
+            return self._decode(fields)
+
+        # Cache miss: read the relational tables. Nothing is stored until
+        # the cart is next changed, so reads of inactive or idle carts do
+        # not fill the hot store; that first save writes version 0
+        rows = DatabaseCartStore().load(cart)
+        return CartState.keyed_by_menu(rows.lines, rows.line_add_ons, version=-1)
+
+    def get_version(self, cart_id):
+        version = self._read_version(self.key(cart_id))
+        return int(version) if version is not None else None
+
+    def save(self, cart, state):
+        if not cart.is_active:
+            # Confirmed or swept carts only live in the relational tables
+            DatabaseCartStore().save(cart, state)
+            return
+
+        mapping = self._encode(state)
+        # Version -1 is a state loaded from the relational tables
+        expected = state.version if state.version >= 0 else None
+        if not self._write(self.key(cart.pk), mapping, cart.pk, time.time(), expected):
+            raise CartConflict(cart.pk)
+        state.version = mapping['_v']
+
+    def flush(self, cart):
+        key = self.key(cart.pk)
+        fields = self._read(key)
+        if fields is None:
+            return
+
+        state = self._decode(fields)
+        if cart.is_active:
+            DatabaseCartStore().save(cart, state)
+        self._delete(key, cart.pk, version=state.version)
+
+    def discard(self, cart):
+        self._delete(self.key(cart.pk), cart.pk)
+
+    def evict_idle(self, max_idle_seconds):
+        cart_ids = self._idle_cart_ids(time.time() - max_idle_seconds)
+        carts = Cart.objects.in_bulk(cart_ids)
+
+        for cart_id in cart_ids:
+            cart = carts.get(cart_id)
+            if cart is None:
+                self._delete(self.key(cart_id), cart_id)
+            else:
+                self.flush(cart)
+        return cart_ids
+
+    def touched_since(self, timestamp):
+        return self._touched_cart_ids(timestamp)
+
+
+
+class RedisCartStore(HashCartStore):
+    def __init__(self, url='redis://127.0.0.1:6379/0', key_prefix='cart'):
+        import redis
+
+        super().__init__(key_prefix=key_prefix)
+        self.client = redis.Redis.from_url(url, decode_responses=True)
+
+    def _read(self, key):
+        return self.client.hgetall(key) or None
+
+    def _write(self, key, mapping, cart_id, touched_at, version=None):
+        from redis.exceptions import WatchError
+
+        expected = str(version) if version is not None else None
+        with self.client.pipeline() as pipe:
+            try:
+                pipe.watch(key)
+                if pipe.hget(key, '_v') != expected:
+                    return False
+                pipe.multi()
+                pipe.delete(key)
+                pipe.hset(key, mapping=mapping)
+                pipe.zadd(self.index_key, {cart_id: touched_at})
+                pipe.execute()
+                return True
+            except WatchError:
+                return False
+
+    def _delete(self, key, cart_id, version=None):
+        from redis.exceptions import WatchError
+
+        with self.client.pipeline() as pipe:
+            try:
+                pipe.watch(key)
+                if version is not None and pipe.hget(key, '_v') != str(version):
+                    return False
+                pipe.multi()
+                pipe.delete(key)
+                pipe.zrem(self.index_key, cart_id)
+                pipe.execute()
+                return True
+            except WatchError:
+                return False
+
+    def _read_version(self, key):
+        return self.client.hget(key, '_v')
+
+    def _idle_cart_ids(self, touched_before):
+        return [
+            int(cart_id)
+            for cart_id in self.client.zrangebyscore(
+                self.index_key, '-inf', touched_before
+            )
+        ]
+
+    def _touched_cart_ids(self, touched_after):
+        return [
+            int(cart_id)
+            for cart_id in self.client.zrangebyscore(
+                self.index_key, f'({touched_after}', '+inf'
+            )
+        ]
+
+
+
+class LocMemCartStore(HashCartStore):
+    """In-process stand-in for RedisCartStore, for tests and local runs"""
+
+    def __init__(self, key_prefix='cart'):
+        super().__init__(key_prefix=key_prefix)
+        self.hashes = {}
+        self.touched = {}
+        # Stands in for Redis' WATCH/MULTI between request threads
+        self.lock = threading.Lock()
+
+    def _read(self, key):
+        fields = self.hashes.get(key)
+        return {field: str(value) for field, value in fields.items()} \
+            if fields else None
+
+    def _write(self, key, mapping, cart_id, touched_at, version=None):
+        with self.lock:
+            if self.hashes.get(key, {}).get('_v') != version:
+                return False
+            self.hashes[key] = dict(mapping)
+            self.touched[cart_id] = touched_at
+            return True
+
+    def _delete(self, key, cart_id, version=None):
+        with self.lock:
+            fields = self.hashes.get(key)
+            if version is not None and fields and fields['_v'] != version:
+                return False
+            self.hashes.pop(key, None)
+            self.touched.pop(cart_id, None)
+            return True
+
+    def _read_version(self, key):
+        return self.hashes.get(key, {}).get('_v')
+
+    def _idle_cart_ids(self, touched_before):
+        return [
+            cart_id for cart_id, touched_at in self.touched.items()
+            if touched_at <= touched_before
+        ]
+
+    def _touched_cart_ids(self, touched_after):
+        return [
+            cart_id for cart_id, touched_at in self.touched.items()
+            if touched_at > touched_after
+        ]
+
+
+
+_stores = {}
+
+def get_cart_store():
+    config = getattr(settings, 'CART_STORE', {})
+    backend = config.get('BACKEND', 'cart.storage.DatabaseCartStore')
+    options = config.get('OPTIONS', {})
+
+    cache_key = (backend, tuple(sorted(options.items())))
+    if cache_key not in _stores:
+        _stores[cache_key] = import_string(backend)(**options)
+    return _stores[cache_key]
@@ -0,0 +1,13 @@
+from datetime import timedelta
+
+from celery import shared_task
+
+from .services import sweep_stale_carts
+
+
+@shared_task
+def sweep_carts(ttl_hours=24, batch_size=1000, delete=False):
+    """Periodic form of `manage.py sweep_carts`"""
+    return sweep_stale_carts(
+        ttl=timedelta(hours=ttl_hours), batch_size=batch_size, delete=delete
+    )
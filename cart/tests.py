@@ -1,3 +1,349 @@
-from django.test import TestCase
+import time
+from datetime import timedelta
+from decimal import Decimal
 
-# Create your tests here.
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from rest_framework.test import APIClient
+
+from authUser.models import User
+from cart.models import Cart, CartItem, CartAddOn
+from cart.services import CartBatch, sweep_stale_carts
+from cart.storage import CartConflict, _stores, get_cart_store
+from order.models import OrderItem, OrderAddOn
+from restaurant.models import Restaurant, MenuItem, AddOn
+
+
+class CartConfirmTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.customer = User.objects.create_user(
+            username='customer', password='pass', role=1, phone_number='100'
+        )
+        owner = User.objects.create_user(
+            username='owner', password='pass', role=2, phone_number='200'
+        )
+        cls.restaurant = Restaurant.objects.create(
+            owner=owner, name='Hungry Bird', address='Dhaka', phone_number='300'
+        )
+        cls.menu_items = MenuItem.objects.bulk_create([
+            MenuItem(
+                restaurant=cls.restaurant, name=f'Item {i}', price=Decimal('10.00')
+            )
+            for i in range(50)
+        ])
+        cls.add_ons = AddOn.objects.bulk_create([
+            AddOn(menu_item=menu_item, name='Extra', price=Decimal('1.50'))
+            for menu_item in cls.menu_items
+        ])
+
+    def make_cart(self, lines):
+        cart = Cart.objects.create(customer=self.customer, restaurant=self.restaurant)
+        cart_items = CartItem.objects.bulk_create([
+            CartItem(cart=cart, menu_item=menu_item, quantity=2)
+            for menu_item in self.menu_items[:lines]
+        ])
+        CartAddOn.objects.bulk_create([
+            CartAddOn(cart_item=cart_item, add_on=add_on, quantity=1)
+            for cart_item, add_on in zip(cart_items, self.add_ons)
+        ])
+        return cart
+
+    def confirm_and_count(self, lines):
+        cart = self.make_cart(lines)
+        with CaptureQueriesContext(connection) as queries:
+            order = cart.confirm(delivery_address='Gulshan')
+        return order, len(queries)
+
+    def test_confirm_copies_items_and_add_ons(self):
+        order, _ = self.confirm_and_count(3)
+
+        self.assertEqual(order.total_price, Decimal('64.50'))
+        self.assertEqual(OrderItem.objects.filter(order=order).count(), 3)
+        self.assertEqual(
+            OrderAddOn.objects.filter(order_item__order=order).count(), 3
+        )
+        self.assertFalse(Cart.objects.get(customer=self.customer).is_active)
+
+    def test_confirm_query_count_does_not_grow_with_cart_size(self):
+        _, single_line = self.confirm_and_count(1)
+        _, fifty_lines = self.confirm_and_count(50)
+
+        self.assertEqual(single_line, fifty_lines)
+
+
+class CartBatchTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.customer = User.objects.create_user(
+            username='customer', password='pass', role=1, phone_number='100'
+        )
+        owner = User.objects.create_user(
+            username='owner', password='pass', role=2, phone_number='200'
+        )
+        cls.restaurant = Restaurant.objects.create(
+            owner=owner, name='Hungry Bird', address='Dhaka', phone_number='300'
+        )
+        cls.other_restaurant = Restaurant.objects.create(
+            owner=owner, name='Night Owl', address='Dhaka', phone_number='301'
+        )
+        cls.menu_items = MenuItem.objects.bulk_create([
+            MenuItem(
+                restaurant=cls.restaurant, name=f'Item {i}', price=Decimal('10.00')
+            )
+            for i in range(20)
+        ])
+        cls.add_ons = AddOn.objects.bulk_create([
+            AddOn(menu_item=menu_item, name='Extra', price=Decimal('1.50'))
+            for menu_item in cls.menu_items
+        ])
+        cls.foreign_item = MenuItem.objects.create(
+            restaurant=cls.other_restaurant, name='Elsewhere', price=Decimal('5.00')
+        )
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.customer)
+        self.cart = Cart.objects.create(customer=self.customer, restaurant=self.restaurant)
+
+    def batch(self, operations):
+        return self.client.post(
+            f'/api/v1/cart/{self.cart.id}/batch/', {'operations': operations},
+            format='json'
+        )
+
+    def test_operations_apply_in_order(self):
+        first, second = self.menu_items[:2]
+        response = self.batch([
+            {'op': 'add_item', 'menu_item': first.id, 'quantity': 1},
+            {'op': 'add_addon', 'menu_item': first.id, 'add_on': self.add_ons[0].id, 'quantity': 2},
+            {'op': 'add_item', 'menu_item': second.id, 'quantity': 1},
+            {'op': 'add_item', 'menu_item': first.id, 'quantity': 2},
+        ])
+        self.assertEqual(response.status_code, 200)
+
+        lines = {item.menu_item_id: item for item in self.cart.cart_items.all()}
+        self.assertEqual(lines[first.id].quantity, 3)
+        self.assertEqual(lines[second.id].quantity, 1)
+        self.assertEqual(lines[first.id].cart_add_ons.get().quantity, 2)
+
+        line_id = lines[second.id].id
+        response = self.batch([
+            {'op': 'update_item_quantity', 'cart_item_id': line_id, 'quantity': 4},
+            {'op': 'remove_item', 'cart_item_id': line_id},
+        ])
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(self.cart.cart_items.filter(id=line_id).exists())
+
+        self.cart.refresh_from_db()
+        self.assertEqual(self.cart.items_count, 3)
+        self.assertEqual(self.cart.subtotal, Decimal('33.00'))
+
+    def test_bad_operation_rejects_the_whole_batch(self):
+        response = self.batch([
+            {'op': 'add_item', 'menu_item': self.menu_items[0].id, 'quantity': 1},
+            {'op': 'update_item_quantity', 'cart_item_id': 999999, 'quantity': 2},
+        ])
+
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('Operation #1', response.json()['detail'])
+        self.assertFalse(self.cart.cart_items.exists())
+
+    def test_menu_item_of_another_restaurant_is_rejected(self):
+        response = self.batch([
+            {'op': 'add_item', 'menu_item': self.foreign_item.id, 'quantity': 1},
+        ])
+
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(
+            response.json()['detail'],
+            "Operation #0: Menu item does not belong to the cart's restaurant."
+        )
+        self.assertFalse(self.cart.cart_items.exists())
+
+    def batch_and_count(self, lines):
+        operations = [
+            operation
+            for menu_item, add_on in zip(self.menu_items[:lines], self.add_ons)
+            for operation in (
+                {'op': 'add_item', 'menu_item': menu_item.id, 'quantity': 1},
+                {'op': 'add_addon', 'menu_item': menu_item.id, 'add_on': add_on.id, 'quantity': 1},
+            )
+        ]
+        with CaptureQueriesContext(connection) as queries:
+            response = self.batch(operations)
+        self.assertEqual(response.status_code, 200)
+        return len(queries)
+
+    def test_query_count_does_not_grow_with_batch_size(self):
+        one_line = self.batch_and_count(1)
+        self.batch([{'op': 'clear'}])
+        twenty_lines = self.batch_and_count(20)
+
+        self.assertEqual(one_line, twenty_lines)
+
+
+class CartStoreTestsMixin:
+    """Run against each CART_STORE backend by the subclasses below"""
+    backend = None
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.customer = User.objects.create_user(
+            username='customer', password='pass', role=1, phone_number='100'
+        )
+        owner = User.objects.create_user(
+            username='owner', password='pass', role=2, phone_number='200'
+        )
+        cls.restaurant = Restaurant.objects.create(
+            owner=owner, name='Hungry Bird', address='Dhaka', phone_number='300'
+        )
+        cls.menu_items = MenuItem.objects.bulk_create([
+            MenuItem(
+                restaurant=cls.restaurant, name=f'Item {i}', price=Decimal('10.00')
+            )
+            for i in range(3)
+        ])
+        cls.add_ons = AddOn.objects.bulk_create([
+            AddOn(menu_item=menu_item, name='Extra', price=Decimal('1.50'))
+            for menu_item in cls.menu_items
+        ])
+
+    def setUp(self):
+        settings = override_settings(CART_STORE={'BACKEND': self.backend})
+        settings.enable()
+        self.addCleanup(settings.disable)
+        _stores.clear()
+        self.addCleanup(_stores.clear)
+
+        self.store = get_cart_store()
+        self.cart = Cart.objects.create(customer=self.customer, restaurant=self.restaurant)
+
+    def apply(self, *operations):
+        return CartBatch(self.cart, self.store).apply(list(operations))
+
+    def line_id(self, menu_item):
+        """The id clients use for the cart's line of `menu_item`"""
+        state = self.store.load(self.cart)
+        return next(
+            line_id for line_id, menu_item_id in state.item_ids.items()
+            if menu_item_id == menu_item.id
+        )
+
+    def add_first_two(self):
+        first, second = self.menu_items[:2]
+        self.apply(
+            {'op': 'add_item', 'menu_item': first.id, 'quantity': 1},
+            {'op': 'add_addon', 'menu_item': first.id, 'add_on': self.add_ons[0].id, 'quantity': 2},
+            {'op': 'add_item', 'menu_item': second.id, 'quantity': 1},
+        )
+
+    def test_add_item_accumulates_quantity(self):
+        self.add_first_two()
+        self.apply({'op': 'add_item', 'menu_item': self.menu_items[0].id, 'quantity': 2})
+
+        state = self.store.load(self.cart)
+        self.assertEqual(
+            state.lines, {self.menu_items[0].id: 3, self.menu_items[1].id: 1}
+        )
+        self.assertEqual(
+            state.line_add_ons[self.menu_items[0].id], {self.add_ons[0].id: 2}
+        )
+
+    def test_update_and_remove_lines(self):
+        self.add_first_two()
+        self.apply(
+            {'op': 'update_item_quantity', 'cart_item_id': self.line_id(self.menu_items[0]), 'quantity': 5},
+            {'op': 'remove_item', 'cart_item_id': self.line_id(self.menu_items[1])},
+        )
+
+        state = self.store.load(self.cart)
+        self.assertEqual(state.lines, {self.menu_items[0].id: 5})
+        self.assertEqual(
+            state.line_add_ons, {self.menu_items[0].id: {self.add_ons[0].id: 2}}
+        )
+
+    def test_confirm_persists_the_cart(self):
+        self.add_first_two()
+        self.store.flush(self.cart)
+        order = self.cart.confirm(delivery_address='Gulshan')
+
+        self.assertEqual(order.total_price, Decimal('23.00'))
+        self.assertEqual(OrderItem.objects.filter(order=order).count(), 2)
+        self.assertIsNone(self.store.get_version(self.cart.pk))
+
+    def test_sweep_persists_and_deactivates_idle_carts(self):
+        self.add_first_two()
+        swept = sweep_stale_carts(timedelta(0))
+
+        self.assertEqual(swept, 1)
+        self.cart.refresh_from_db()
+        self.assertFalse(self.cart.is_active)
+        self.assertEqual(self.cart.items_count, 2)
+        self.assertEqual(
+            dict(self.cart.cart_items.values_list('menu_item_id', 'quantity')),
+            {self.menu_items[0].id: 1, self.menu_items[1].id: 1}
+        )
+        self.assertIsNone(self.store.get_version(self.cart.pk))
+
+
+class DatabaseCartStoreTests(CartStoreTestsMixin, TestCase):
+    backend = 'cart.storage.DatabaseCartStore'
+
+    def test_concurrent_new_line_does_not_fail(self):
+        # Both requests read the cart before either added the line
+        first, second = self.store.load(self.cart), self.store.load(self.cart)
+        first.lines[self.menu_items[0].id] = 1
+        second.lines[self.menu_items[0].id] = 2
+        self.store.save(self.cart, first)
+        self.store.save(self.cart, second)
+
+        self.assertEqual(self.cart.cart_items.get().quantity, 2)
+        self.cart.refresh_from_db()
+        self.assertEqual(self.cart.subtotal, Decimal('20.00'))
+        self.assertEqual(self.cart.items_count, 2)
+
+
+class LocMemCartStoreTests(CartStoreTestsMixin, TestCase):
+    backend = 'cart.storage.LocMemCartStore'
+
+    def test_reads_do_not_fill_the_hot_store(self):
+        self.store.load(self.cart)
+        self.assertIsNone(self.store.get_version(self.cart.pk))
+
+    def test_stale_state_is_rejected(self):
+        first, second = self.store.load(self.cart), self.store.load(self.cart)
+        first.lines[self.menu_items[0].id] = 1
+        second.lines[self.menu_items[1].id] = 1
+        self.store.save(self.cart, first)
+
+        with self.assertRaises(CartConflict):
+            self.store.save(self.cart, second)
+
+    def test_sweep_picks_up_carts_idle_in_the_hot_store(self):
+        self.add_first_two()
+        # Last written two hours ago; flushing it stamps updated_at afresh
+        self.store.touched[self.cart.pk] = time.time() - 2 * 60 * 60
+
+        swept = sweep_stale_carts(timedelta(hours=1))
+
+        self.assertEqual(swept, 1)
+        self.cart.refresh_from_db()
+        self.assertFalse(self.cart.is_active)
+        self.assertEqual(self.cart.items_count, 2)
+
+    def test_batch_is_replayed_after_a_conflict(self):
+        load = self.store.load
+
+        def load_then_race(cart):
+            # Another request saves the cart between this load and save
+            state = load(cart)
+            self.store.load = load
+            self.apply({'op': 'add_item', 'menu_item': self.menu_items[0].id, 'quantity': 1})
+            return state
+
+        self.store.load = load_then_race
+        self.apply({'op': 'add_item', 'menu_item': self.menu_items[0].id, 'quantity': 2})
+
+        self.assertEqual(self.store.load(self.cart).lines, {self.menu_items[0].id: 3})
@@ -5,19 +5,21 @@ from rest_framework.permissions import IsAuthenticated
 from django.shortcuts import get_object_or_404
 from django.core.exceptions import ValidationError as DjangoValidationError
 
-from .models import Cart, CartItem, CartAddOn
+from .models import Cart
 from .serializers import (
     CartSerializer, 
-    CartItemSerializer, 
-    CartAddOnSerializer, 
-    AddCartItemSerializer, 
-    AddCartAddonSerializer,
-    UpdateQuantitySerializer
+    CartStateSerializer,
+    CartOperationSerializer,
+    CartBatchSerializer
 )
+from .services import CartBatch
+from .storage import get_cart_store
+from hungryBird.etags import ConditionalRetrieveMixin
+from hungryBird.pagination import CreatedAtCursorPagination
 from hungryBird.permissions import IsCustomer
 
 
-class CartViewSet(viewsets.ModelViewSet):
+class CartViewSet(ConditionalRetrieveMixin, viewsets.ModelViewSet):
     """
     ViewSet for managing shopping carts.
     
@@ -29,12 +31,81 @@ class CartViewSet(viewsets.ModelViewSet):
     """
     serializer_class = CartSerializer
     permission_classes = [IsAuthenticated, IsCustomer]
+    pagination_class = CreatedAtCursorPagination
     lookup_field = 'id'
 
     def get_queryset(self):
         """Get carts for current user"""
+        if self.action in ['list', 'retrieve']:
+            return Cart.snapshot_queryset().filter(customer=self.request.user)
         return Cart.objects.filter(customer=self.request.user)
 
+    @property
+    def cart_store(self):
+        return get_cart_store()
+
+    def get_snapshot(self, cart, state=None):
+        """
+        Reload the cart with everything the serializer reads prefetched,
+        or render it from the hot cart store when one is configured.
+        """
+        if not self.cart_store.keeps_carts_hot:
+            cart = Cart.snapshot_queryset().get(pk=cart.pk)
+            return self.get_serializer(cart).data
+
+        cart = Cart.objects.select_related('customer', 'restaurant').get(pk=cart.pk)
+        if state is None:
+            state = self.cart_store.load(cart)
+        return CartStateSerializer(
+            cart, context={**self.get_serializer_context(), 'cart_state': state}
+        ).data
+
+    def apply_operations(self, cart, operations):
+        """Run operations through the cart store and respond with the new snapshot"""
+        try:
+            state = CartBatch(cart, self.cart_store).apply(operations)
+        except DjangoValidationError as e:
+            return Response(
+                {'detail': e.message},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        return Response(self.get_snapshot(cart, state), status=status.HTTP_200_OK)
+
+    def apply_operation(self, cart, op, data):
+        """Validate a single action's payload as a batch operation and apply it"""
+        serializer = CartOperationSerializer(data={**data, 'op': op})
+        serializer.is_valid(raise_exception=True)
+        return self.apply_operations(cart, [serializer.validated_data])
+
+    def list(self, request, *args, **kwargs):
+        if not self.cart_store.keeps_carts_hot:
+            return super().list(request, *args, **kwargs)
+
+        carts = self.paginate_queryset(self.filter_queryset(self.get_queryset()))
+        return self.get_paginated_response(
+            [self.get_snapshot(cart) for cart in carts]
+        )
+
+    def get_current_version(self):
+        current = super().get_current_version()
+        if current is None or not self.cart_store.keeps_carts_hot:
+            return current
+
+        # Lines of a hot cart change in the store without touching the row
+        pk, version = current
+        return pk, f'{version}.{self.cart_store.get_version(pk) or 0}'
+
+    def retrieve_fresh(self, request, *args, **kwargs):
+        if not self.cart_store.keeps_carts_hot:
+            return super().retrieve_fresh(request, *args, **kwargs)
+
+        return Response(self.get_snapshot(self.get_object()))
+
+    def perform_destroy(self, instance):
+        self.cart_store.discard(instance)
+        instance.delete()
+
     def create(self, request, *args, **kwargs):
         """Create a new cart for a restaurant"""
         from restaurant.models import Restaurant
@@ -68,8 +139,7 @@ class CartViewSet(viewsets.ModelViewSet):
             is_active=True
         )
         
-        serializer = self.get_serializer(cart)
-        return Response(serializer.data, status=status.HTTP_201_CREATED)
+        return Response(self.get_snapshot(cart), status=status.HTTP_201_CREATED)
 
     @action(detail=True, methods=['post'])
     def add_item(self, request, id=None):
@@ -77,23 +147,7 @@ class CartViewSet(viewsets.ModelViewSet):
         Add item to cart.
         Expected payload: {"menu_item": <id>, "quantity": <int>}
         """
-        cart = self.get_object()
-
-        serializer = AddCartItemSerializer(data=request.data)
-        serializer.is_valid(raise_exception=True)
-
-        try:
-            cart.add_item(
-                menu_item = serializer.validated_data['menu_item'],
-                quantity = serializer.validated_data['quantity']
-            )
-        except DjangoValidationError as e:
-            return Response(
-                {'detail': e.message},
-                status=status.HTTP_400_BAD_REQUEST
-            )
-        
-        return Response(self.get_serializer(cart).data, status=status.HTTP_200_OK)
+        return self.apply_operation(self.get_object(), 'add_item', request.data)
 
     @action(detail=True, methods=['post'])
     def add_addon(self, request, id=None):
@@ -101,29 +155,7 @@ class CartViewSet(viewsets.ModelViewSet):
         Add add-on to a cart item.
         Expected payload: {"cart_item": <id>, "add_on": <id>, "quantity": <int>}
         """
-        cart = self.get_object()
-        
-        serializer = AddCartAddonSerializer(data=request.data)
-        serializer.is_valid(raise_exception=True)
-
-        cart_item = serializer.validated_data['cart_item']
-        add_on = serializer.validated_data['add_on']
-        quantity = serializer.validated_data['quantity']
-
-        if cart_item.cart != cart:
-            return Response(
-                {'detail': 'Invalid cart item for this cart.'},
-                status=status.HTTP_400_BAD_REQUEST
-            )
-        
-        CartAddOn.objects.update_or_create(
-            cart_item = cart_item,
-            add_on = add_on,
-            defaults = {'quantity': quantity}
-        )
-
-
-        return Response(self.get_serializer(cart).data, status=status.HTTP_200_OK)
+        return self.apply_operation(self.get_object(), 'add_addon', request.data)
 
     @action(detail=True, methods=['patch'])
     def update_item_quantity(self, request, id=None):
@@ -131,24 +163,9 @@ class CartViewSet(viewsets.ModelViewSet):
         Update quantity of an item in cart.
         Expected payload: {"cart_item_id": <id>, "quantity": <int>}
         """
-        cart = self.get_object()
-        cart_item_id = request.data.get('cart_item_id')
-
-        if not cart_item_id:
-            return Response(
-                {'detail': 'cart_item_id is required.'},
-                status=status.HTTP_400_BAD_REQUEST
-            )
-        
-        serializer = UpdateQuantitySerializer(data=request.data)
-        serializer.is_valid(raise_exception=True)
-
-        cart_item = get_object_or_404(CartItem, id=cart_item_id, cart=cart)
-        cart_item.quantity = serializer.validated_data['quantity']
-        cart_item.save(update_fields=['quantity'])
-
-        serializer = CartSerializer(cart)
-        return Response(serializer.data, status=status.HTTP_200_OK)
+        return self.apply_operation(
+            self.get_object(), 'update_item_quantity', request.data
+        )
 
     @action(detail=True, methods=['patch'])
     def update_addon_quantity(self, request, id=None):
@@ -156,28 +173,9 @@ class CartViewSet(viewsets.ModelViewSet):
         Update quantity of an add-on in cart.
         Expected payload: {"addon_id": <id>, "quantity": <int>}
         """
-        cart = self.get_object()
-        addon_id = request.data.get('addon_id')
-
-        if not addon_id:
-            return Response(
-                {'detail': 'addon_id is required.'},
-                status=status.HTTP_400_BAD_REQUEST
-            )
-
-        serializer = UpdateQuantitySerializer(data=request.data)
-        serializer.is_valid(raise_exception=True)
-
-        cart_add_on = get_object_or_404(
-            CartAddOn, 
-            id=addon_id, 
-            cart_item__cart=cart
+        return self.apply_operation(
+            self.get_object(), 'update_addon_quantity', request.data
         )
-        cart_add_on.quantity = serializer.validated_data['quantity']
-        cart_add_on.save(update_fields=['quantity'])
-
-
-        return Response(self.get_serializer(cart).data, status=status.HTTP_200_OK)
 
     @action(detail=True, methods=['delete'])
     def remove_item(self, request, id=None):
@@ -185,20 +183,7 @@ class CartViewSet(viewsets.ModelViewSet):
         Remove an item from cart.
         Expected payload: {"cart_item_id": <id>}
         """
-        cart = self.get_object()
-        cart_item_id = request.data.get('cart_item_id')
-
-        if not cart_item_id:
-            return Response(
-                {'detail': 'cart_item_id is required.'},
-                status=status.HTTP_400_BAD_REQUEST
-            )
-
-        cart_item = get_object_or_404(CartItem, id=cart_item_id, cart=cart)
-        cart_item.delete()
-
-        serializer = CartSerializer(cart)
-        return Response(serializer.data, status=status.HTTP_200_OK)
+        return self.apply_operation(self.get_object(), 'remove_item', request.data)
 
     @action(detail=True, methods=['delete'])
     def remove_addon(self, request, id=None):
@@ -206,32 +191,29 @@ class CartViewSet(viewsets.ModelViewSet):
         Remove an add-on from a cart item.
         Expected payload: {"addon_id": <id>}
         """
-        cart = self.get_object()
-        addon_id = request.data.get('addon_id')
+        return self.apply_operation(self.get_object(), 'remove_addon', request.data)
 
-        if not addon_id:
-            return Response(
-                {'detail': 'addon_id is required.'},
-                status=status.HTTP_400_BAD_REQUEST
-            )
+    @action(detail=True, methods=['post'])
+    def batch(self, request, id=None):
+        """
+        Apply several cart operations in one transaction.
+        Expected payload: {"operations": [{"op": "add_item", "menu_item": <id>, "quantity": <int>}, ...]}
+        Supported ops: add_item, add_addon, update_item_quantity,
+        update_addon_quantity, remove_item, remove_addon, clear.
+        They take the same fields as the matching single actions;
+        add_addon also accepts "menu_item" to target a line added earlier in the batch.
+        """
+        cart = self.get_object()
 
-        cart_add_on = get_object_or_404(
-            CartAddOn, 
-            id=addon_id, 
-            cart_item__cart=cart
-        )
-        cart_add_on.delete()
+        serializer = CartBatchSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
 
-        serializer = CartSerializer(cart)
-        return Response(serializer.data, status=status.HTTP_200_OK)
+        return self.apply_operations(cart, serializer.validated_data['operations'])
 
     @action(detail=True, methods=['post'])
     def clear(self, request, id=None):
         """Clear all items from cart"""
-        cart = self.get_object()
-        cart.clear()
-        serializer = CartSerializer(cart)
-        return Response(serializer.data, status=status.HTTP_200_OK)
+        return self.apply_operations(self.get_object(), [{'op': 'clear'}])
 
     @action(detail=True, methods=['post'])
     def confirm(self, request, id=None):
@@ -245,6 +227,8 @@ class CartViewSet(viewsets.ModelViewSet):
             )
         
         try:
+            # Hot carts are written to the relational tables only now
+            self.cart_store.flush(cart)
             order = cart.confirm(delivery_address=delivery_address)
         except DjangoValidationError as e:
             return Response(
@@ -0,0 +1,115 @@
+import random
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS, connections
+from rest_framework.permissions import SAFE_METHODS
+
+
+# Set while a request that tolerates replica lag is being handled
+_replica_reads = ContextVar('replica_reads', default=False)
+
+
+def get_replicas():
+    return getattr(settings, 'DATABASE_REPLICAS', [])
+
+
+@contextmanager
+def primary_reads():
+    """Read from the primary inside the block, e.g. to fill a cache"""
+    token = _replica_reads.set(False)
+    try:
+        yield
+    finally:
+        _replica_reads.reset(token)
+
+
+def _pin_key(user_id):
+    return f'db_primary_pin:{user_id}'
+
+
+def pin_to_primary(user):
+    """
+    Keep the user's replica-eligible reads on the primary for
+    DATABASE_REPLICA_PIN_SECONDS, so they read back what they just wrote.
+    The pin lives in the default cache, which every worker shares, so it
+    holds whichever worker serves the next read.
+    """
+    if get_replicas() and user.is_authenticated:
+        cache.set(_pin_key(user.id), True, settings.DATABASE_REPLICA_PIN_SECONDS)
+
+
+def is_pinned_to_primary(user):
+    return user.is_authenticated and cache.get(_pin_key(user.id), False)
+
+
+class PrimaryReplicaRouter:
+    """
+    Writes, and reads of requests not served by ReplicaReadMixin, go to
+    the primary. Reads of the ones that are go to a random replica from
+    DATABASE_REPLICAS, unless a transaction is open on the primary.
+    """
+
+    def db_for_read(self, model, **hints):
+        replicas = get_replicas()
+        if (
+            replicas
+            and _replica_reads.get()
+            and not connections[DEFAULT_DB_ALIAS].in_atomic_block
+        ):
+            return random.choice(replicas)
+        return DEFAULT_DB_ALIAS
+
+    def db_for_write(self, model, **hints):
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Replicas hold the same rows as the primary
+        return True
+
+
+class ReplicaReadMixin:
+    """
+    Serves `replica_actions` from a replica. The user is authenticated
+    and permissions are checked on the primary first, and users pinned
+    by a recent write keep reading from the primary.
+    """
+    replica_actions = ('list', 'retrieve')
+
+    def initial(self, request, *args, **kwargs):
+        super().initial(request, *args, **kwargs)
+        if (
+            self.action in self.replica_actions
+            and request.method in SAFE_METHODS
+            and get_replicas()
+            and not is_pinned_to_primary(request.user)
+        ):
+            self._replica_token = _replica_reads.set(True)
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        token = getattr(self, '_replica_token', None)
+        if token is not None:
+            _replica_reads.reset(token)
+            self._replica_token = None
+        return super().finalize_response(request, response, *args, **kwargs)
+
+
+class PinPrimaryAfterWriteMiddleware:
+    """
+    Pins a user to the primary after any successful unsafe request, so
+    e.g. the order list right after a cart is confirmed shows the order.
+    Runs after DRF has authenticated the request inside the view.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        response = self.get_response(request)
+        if request.method not in SAFE_METHODS and response.status_code < 400:
+            user = getattr(request, 'user', None)
+            if user is not None:
+                pin_to_primary(user)
+        return response
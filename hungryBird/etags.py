@@ -0,0 +1,48 @@
+from django.core.exceptions import ValidationError
+from django.http import Http404
+from django.utils.http import parse_etags, quote_etag
+from rest_framework import status
+from rest_framework.response import Response
+
+
+class ConditionalRetrieveMixin:
+    """
+    Serves retrieve with a version-based ETag. When the client's
+    If-None-Match still matches, answers 304 after reading only the
+    version column, without loading or serializing the object.
+    """
+    etag_version_field = 'version'
+
+    def get_current_version(self):
+        '''Return (pk, version) for the requested object, or None'''
+        lookup_url_kwarg = self.lookup_url_kwarg or self.lookup_field
+        try:
+            return self.get_queryset().prefetch_related(None).filter(
+                **{self.lookup_field: self.kwargs[lookup_url_kwarg]}
+            ).values_list('pk', self.etag_version_field).first()
+        except (TypeError, ValueError, ValidationError):
+            # A lookup value the field cannot hold matches nothing
+            raise Http404
+
+    def get_etag(self, pk, version):
+        return quote_etag(f'{self.basename}-{pk}-{version}')
+
+    def retrieve(self, request, *args, **kwargs):
+        current = self.get_current_version()
+        if current is None:
+            raise Http404
+
+        etag = self.get_etag(*current)
+        if_none_match = request.headers.get('If-None-Match')
+        if if_none_match and (
+            etag in parse_etags(if_none_match) or if_none_match.strip() == '*'
+        ):
+            return Response(status=status.HTTP_304_NOT_MODIFIED, headers={'ETag': etag})
+
+        response = self.retrieve_fresh(request, *args, **kwargs)
+        response['ETag'] = etag
+        return response
+
+    def retrieve_fresh(self, request, *args, **kwargs):
+        '''Build the full response once the client's copy is stale'''
+        return super().retrieve(request, *args, **kwargs)
@@ -0,0 +1,123 @@
+from rest_framework.permissions import SAFE_METHODS
+from rest_framework.serializers import ListSerializer
+
+
+class FieldSelection:
+    '''
+    The response shape a read asked for with ?fields= and ?expand=.
+
+    - fields=a,b keeps only those top-level fields
+    - expand=rel,rel.nested embeds only the listed expandable relations
+      (listing a nested path embeds its parents too); other expandable
+      relations are left out. Expanded relations are kept even when
+      missing from `fields`.
+
+    Without either parameter everything is returned, as before.
+    '''
+
+    def __init__(self, fields=None, expand=None):
+        self.fields = fields
+        self.expand = None
+        if expand is not None:
+            self.expand = {
+                '.'.join(path.split('.')[:depth])
+                for path in expand
+                for depth in range(1, path.count('.') + 2)
+            }
+
+    @classmethod
+    def from_request(cls, request):
+        '''The selection of a read request, or None when it asks for everything'''
+        if request is None or request.method not in SAFE_METHODS:
+            return None
+
+        def names(param):
+            value = request.query_params.get(param)
+            if value is None:
+                return None
+            return {name.strip() for name in value.split(',') if name.strip()}
+
+        fields, expand = names('fields'), names('expand')
+        if fields is None and expand is None:
+            return None
+        return cls(fields, expand)
+
+    def includes(self, name):
+        return self.fields is None or name in self.fields or \
+            (self.expand is not None and name in self.expand)
+
+    def expands(self, path):
+        return self.includes(path.split('.')[0]) and \
+            (self.expand is None or path in self.expand)
+
+
+def expands(selection, path):
+    '''Whether `path` is embedded under `selection`, which may be None'''
+    return selection is None or selection.expands(path)
+
+
+class DynamicFieldsMixin:
+    '''
+    Serializer side of FieldSelection. `expandable_fields` names the
+    relations of this serializer that are only embedded when selected;
+    nested serializers using the mixin resolve their own relations by
+    their dotted path from the root.
+    '''
+    expandable_fields = ()
+
+    def field_selection(self):
+        if not hasattr(self, '_field_selection'):
+            self._field_selection = FieldSelection.from_request(self.context.get('request'))
+        return self._field_selection
+
+    def field_path(self):
+        names, node = [], self
+        while node.parent is not None:
+            if node.field_name:
+                names.append(node.field_name)
+            node = node.parent
+        return ''.join(f'{name}.' for name in reversed(names))
+
+    def is_expanded(self, name):
+        return expands(self.field_selection(), self.field_path() + name)
+
+    def get_fields(self):
+        fields = super().get_fields()
+        selection = self.field_selection()
+        if selection is None:
+            return fields
+
+        prefix = self.field_path()
+        for name in list(fields):
+            if not prefix and not selection.includes(name):
+                fields.pop(name)
+            elif name in self.expandable_fields and not selection.expands(prefix + name):
+                fields.pop(name)
+        return fields
+
+    @classmethod
+    def select(cls, data, selection, prefix=''):
+        '''Apply `selection` to a representation built without one, e.g. a cached one'''
+        if selection is None:
+            return data
+
+        selected = {}
+        for name, value in data.items():
+            if not prefix and not selection.includes(name):
+                continue
+            if name in cls.expandable_fields:
+                if not selection.expands(prefix + name):
+                    continue
+                nested = cls._declared_fields[name]
+                if isinstance(nested, ListSerializer):
+                    nested = nested.child
+                if isinstance(nested, DynamicFieldsMixin):
+                    if isinstance(value, list):
+                        value = [
+                            nested.select(item, selection, f'{prefix}{name}.')
+                            for item in value
+                        ]
+                    elif value is not None:
+                        value = nested.select(value, selection, f'{prefix}{name}.')
+            selected[name] = value
+        return selected
@@ -0,0 +1,115 @@
+import math
+
+
+EARTH_RADIUS_KM = 6371.0088
+KM_PER_DEGREE = 111.32
+
+GEOHASH_ALPHABET = '0123456789bcdefghjkmnpqrstuvwxyz'
+GEOHASH_PRECISION = 12
+# Sorts after every geohash character, so [prefix, prefix + '~') is
+# every hash starting with prefix, as an index range on any backend
+GEOHASH_RANGE_END = '~'
+
+
+def geohash_encode(latitude, longitude, precision=GEOHASH_PRECISION):
+    latitude, longitude = float(latitude), float(longitude)
+    lat_range, lng_range = [-90.0, 90.0], [-180.0, 180.0]
+    chars, bits, bit_count, even = [], 0, 0, True
+
+    while len(chars) < precision:
+        value, bounds = (longitude, lng_range) if even else (latitude, lat_range)
+        middle = (bounds[0] + bounds[1]) / 2
+        bits <<= 1
+        if value >= middle:
+            bits |= 1
+            bounds[0] = middle
+        else:
+            bounds[1] = middle
+        even = not even
+
+        bit_count += 1
+        if bit_count == 5:
+            chars.append(GEOHASH_ALPHABET[bits])
+            bits, bit_count = 0, 0
+
+    return ''.join(chars)
+
+
+def geohash_cell_size(precision):
+    """(height, width) of a cell in degrees"""
+    lat_bits = 5 * precision // 2
+    lng_bits = 5 * precision - lat_bits
+    return 180.0 / 2 ** lat_bits, 360.0 / 2 ** lng_bits
+
+
+def bounding_box(latitude, longitude, radius_km):
+    """
+    (south, north, west, east) in degrees around the circle. West and
+    east are not wrapped, so they may fall outside -180..180.
+    """
+    latitude, longitude = float(latitude), float(longitude)
+    # Degrees of longitude shrink towards the poles; size the box for the
+    # circle's edge nearest to one
+    farthest_latitude = min(abs(latitude) + radius_km / KM_PER_DEGREE, 90.0)
+    lng_degrees = radius_km / (
+        KM_PER_DEGREE * max(math.cos(math.radians(farthest_latitude)), 1e-6)
+    )
+    return (
+        max(latitude - radius_km / KM_PER_DEGREE, -90.0),
+        min(latitude + radius_km / KM_PER_DEGREE, 90.0),
+        longitude - lng_degrees,
+        longitude + lng_degrees,
+    )
+
+
+def geohash_cover(latitude, longitude, radius_km, max_cells=16):
+    """
+    Prefixes of the cells covering the bounding box of the circle, at the
+    finest precision needing at most `max_cells` of them. Empty when even
+    the coarsest precision needs more, meaning every row is a candidate.
+    """
+    south, north, west, east = bounding_box(latitude, longitude, radius_km)
+
+    for precision in range(GEOHASH_PRECISION, 0, -1):
+        height, width = geohash_cell_size(precision)
+        first_row = math.floor((south + 90) / height)
+        rows = min(math.floor((north + 90) / height), 2 ** (5 * precision // 2) - 1) - first_row + 1
+        first_column = math.floor((west + 180) / width)
+        columns = math.floor((east + 180) / width) - first_column + 1
+        if rows * columns <= max_cells:
+            break
+    else:
+        return []
+
+    return sorted({
+        geohash_encode(
+            (first_row + row + 0.5) * height - 90,
+            ((first_column + column + 0.5) * width) % 360 - 180,
+            precision
+        )
+        for row in range(rows)
+        for column in range(columns)
+    })
+
+
+def haversine_km(latitude, longitude, points):
+    """
+    Great-circle distances from (latitude, longitude) to each
+    (latitude, longitude) in `points`.
+
+    A plain loop rather than a vectorized pass: numpy is not a dependency,
+    and `points` are only the candidates inside the geohash cover and the
+    bounding box, a few thousand rows at most for city-sized radii.
+    """
+    lat1 = math.radians(float(latitude))
+    lng1 = math.radians(float(longitude))
+    cos_lat1 = math.cos(lat1)
+    sin, cos, asin, sqrt, radians = math.sin, math.cos, math.asin, math.sqrt, math.radians
+
+    distances = []
+    for lat2, lng2 in points:
+        lat2, lng2 = radians(float(lat2)), radians(float(lng2))
+        a = sin((lat2 - lat1) / 2) ** 2 + \
+            cos_lat1 * cos(lat2) * sin((lng2 - lng1) / 2) ** 2
+        distances.append(2 * EARTH_RADIUS_KM * asin(min(1.0, sqrt(a))))
+    return distances
@@ -0,0 +1,23 @@
+from rest_framework.pagination import CursorPagination, PageNumberPagination
+
+
+class CreatedAtCursorPagination(CursorPagination):
+    '''
+    Keyset pagination, newest first. Each page seeks from the cursor's
+    created_at on a (<owner>, created_at) index, so a deep page costs the
+    same as the first one.
+    '''
+    ordering = ('-created_at', '-id')
+    page_size = 20
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+
+
+class RankedPagination(PageNumberPagination):
+    '''
+    Numbered pages over results ranked by distance or search relevance,
+    which have no column a cursor could seek on.
+    '''
+    page_size = 20
+    page_size_query_param = 'page_size'
+    max_page_size = 100
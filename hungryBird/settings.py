@@ -46,6 +46,7 @@ MIDDLEWARE = [
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'hungryBird.db_router.PinPrimaryAfterWriteMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
@@ -92,6 +93,25 @@ WSGI_APPLICATION = 'hungryBird.wsgi.application'
 ASGI_APPLICATION = 'hungryBird.asgi.application'
 
 
+# Where cart lines live between checkouts. Switch BACKEND to
+# 'cart.storage.RedisCartStore' to keep active carts in Redis and write
+# them to the database only on confirm or eviction.
+CART_STORE = {
+    'BACKEND': 'cart.storage.DatabaseCartStore',
+    'OPTIONS': {},
+}
+
+
+# Shared by every worker, so cache invalidations (menus, kitchen queues)
+# and the read-your-writes pins of the replica router reach all of them
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': os.environ.get('REDIS_CACHE_URL', 'redis://127.0.0.1:6379/2'),
+    }
+}
+
+
 CHANNEL_LAYERS = {
     'default': {
         'BACKEND': 'channels_redis.core.RedisChannelLayer',
@@ -112,6 +132,25 @@ DATABASES = {
     }
 }
 
+# Read replicas, as a comma separated list of database files in
+# DATABASE_REPLICA_NAMES. Restaurant/menu browsing and order history
+# lists read from them; a user who just wrote something reads from the
+# primary for DATABASE_REPLICA_PIN_SECONDS. To try it locally, copy
+# db.sqlite3 to the replica file whenever it should "catch up".
+DATABASE_REPLICAS = []
+for index, name in enumerate(
+    filter(None, os.environ.get('DATABASE_REPLICA_NAMES', '').split(','))
+):
+    DATABASES[f'replica_{index}'] = {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': name,
+        'TEST': {'MIRROR': 'default'},
+    }
+    DATABASE_REPLICAS.append(f'replica_{index}')
+
+DATABASE_ROUTERS = ['hungryBird.db_router.PrimaryReplicaRouter']
+DATABASE_REPLICA_PIN_SECONDS = 10
+
 
 # Password validation
 # https://docs.djangoproject.com/en/6.0/ref/settings/#auth-password-validators
@@ -210,5 +249,10 @@ LOGGING = {
             'level': 'INFO',
             'propagate': False,
         },
+        'order': {
+            'handlers': ['console', 'file', 'error_file'],
+            'level': 'INFO',
+            'propagate': False,
+        },
     },
 }
@@ -0,0 +1,18 @@
+"""
+Settings for `manage.py test`. Tests run without a Redis server, and
+their cache.clear() calls must never wipe a developer's shared cache,
+so each test process gets its own in-memory cache and channel layer.
+"""
+from hungryBird.settings import *  # noqa: F401,F403
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    }
+}
+
+CHANNEL_LAYERS = {
+    'default': {
+        'BACKEND': 'channels.layers.InMemoryChannelLayer',
+    }
+}
@@ -3,6 +3,7 @@ This files handle Channels safety and correctness.
 '''
 
 
+import asyncio
 import json
 from channels.layers import get_channel_layer
 from asgiref.sync import async_to_sync
@@ -15,9 +16,11 @@ class BaseNotifier:
     Base class for all notifiers.
     """
 
-    def __init__(self, order):
+    def __init__(self, order, outbox=None):
         self.order = order
         self.channel_layer = get_channel_layer()
+        # When given, messages are collected here for send_many instead of sent
+        self.outbox = outbox
 
     
     def notify(self):
@@ -25,6 +28,10 @@ class BaseNotifier:
     
 
     def send(self, group_name, payload):
+        if self.outbox is not None:
+            self.outbox.append((group_name, payload))
+            return
+
         if not self.channel_layer:
             print("Channel layer:", self.channel_layer)
             return
@@ -35,3 +42,18 @@ class BaseNotifier:
             payload
         )
 
+
+    @staticmethod
+    def send_many(messages):
+        """Send (group_name, payload) pairs concurrently in one event loop hop"""
+        channel_layer = get_channel_layer()
+        if not channel_layer or not messages:
+            return
+
+        async def send_all():
+            await asyncio.gather(*(
+                channel_layer.group_send(group_name, payload)
+                for group_name, payload in messages
+            ))
+
+        async_to_sync(send_all)()
@@ -1,3 +1,4 @@
+from notifications.base import BaseNotifier
 from notifications.notifiers import (
     DriverNotifier,
     RestaurantNotifier,
@@ -30,3 +31,29 @@ class OrderNotificationDispatcher:
                     order.id,
                 )
                 continue
+
+
+    @classmethod
+    def dispatch_many(cls, orders):
+        """
+        Build the notifications for every order first, then send them all
+        in a single round to the channel layer.
+        """
+        outbox = []
+        for order in orders:
+            for notifier_cls in cls.NOTIFIERS:
+                try:
+                    notifier_cls(order, outbox=outbox).notify()
+                except Exception as e:
+                    logger.exception(
+                        "Notification failed: %s for order %s",
+                        notifier_cls.__name__,
+                        order.id,
+                    )
+
+        try:
+            BaseNotifier.send_many(outbox)
+        except Exception as e:
+            logger.exception(
+                "Batched notification send failed for %s messages", len(outbox)
+            )
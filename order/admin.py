@@ -1,7 +1,8 @@
 from django.contrib import admin
-from order.models import Order, OrderItem, OrderAddOn
+from order.models import Order, OrderItem, OrderAddOn, ArchivedOrder
 
 # Register your models here.
 admin.site.register(Order)
 admin.site.register(OrderItem)
-admin.site.register(OrderAddOn)
\ No newline at end of file
+admin.site.register(OrderAddOn)
+admin.site.register(ArchivedOrder)
@@ -0,0 +1,70 @@
+import time
+
+from django.db import transaction
+from django.db.models import Max, Min
+from django.utils import timezone
+
+
+ARCHIVED_STATUSES = (5, 6)  # Delivered, Cancelled
+
+
+def archive_orders(older_than, batch_size=500, on_batch=None):
+    """
+    Move delivered and cancelled orders whose last change is older than
+    `older_than` (a timedelta) into ArchivedOrder. Works through bounded
+    id ranges, each in its own transaction: lock the range's orders, copy
+    them out, then delete their add-ons, lines, status events, payments
+    and the orders themselves with one DELETE per table.
+
+    Sales rollups are left as they are; rebuild_sales_rollups reads the
+    archive for days whose orders have moved there.
+
+    `on_batch(archived, seconds)` is called after every batch.
+    Returns the total number of orders archived.
+    """
+    from order.models import Order, OrderItem, OrderAddOn, OrderStatusEvent, ArchivedOrder
+    from payment.models import Payment
+
+    terminal = Order.objects.filter(
+        status__in=ARCHIVED_STATUSES,
+        updated_at__lt=timezone.now() - older_than
+    )
+    bounds = terminal.aggregate(low=Min('id'), high=Max('id'))
+    if bounds['low'] is None:
+        return 0
+
+    total = 0
+    for start in range(bounds['low'], bounds['high'] + 1, batch_size):
+        started = time.monotonic()
+
+        with transaction.atomic():
+            orders = list(
+                Order.snapshot_queryset().select_related(
+                    'payment'
+                ).prefetch_related(
+                    'status_events'
+                ).filter(
+                    id__in=terminal.filter(
+                        id__gte=start, id__lt=start + batch_size
+                    ).values('id')
+                ).select_for_update(of=('self',))
+            )
+            if not orders:
+                continue
+
+            order_ids = [order.id for order in orders]
+            ArchivedOrder.objects.bulk_create(
+                [ArchivedOrder.from_order(order) for order in orders]
+            )
+            OrderAddOn.objects.filter(order_item__order_id__in=order_ids).delete()
+            OrderItem.objects.filter(order_id__in=order_ids).delete()
+            OrderStatusEvent.objects.filter(order_id__in=order_ids).delete()
+            Payment.objects.filter(order_id__in=order_ids).delete()
+            # Clears DriverAvailability.order (SET_NULL) before removing the rows
+            Order.objects.filter(id__in=order_ids).delete()
+
+        total += len(orders)
+        if on_batch:
+            on_batch(len(orders), time.monotonic() - started)
+
+    return total
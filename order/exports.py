@@ -0,0 +1,105 @@
+import csv
+import json
+
+
+EXPORT_CHUNK_SIZE = 500
+# ArchivedOrder.record is an export record plus these
+ARCHIVE_ONLY_KEYS = ('payment', 'status_events')
+
+CSV_HEADER = [
+    'order_id', 'created_at', 'status', 'customer_id', 'restaurant_id',
+    'restaurant', 'driver_id', 'delivery_address', 'order_total',
+    'menu_item_id', 'item', 'quantity', 'unit_price', 'line_total', 'add_ons',
+]
+
+
+class Echo:
+    """Implements just the write method of the file-like interface, for csv.writer"""
+
+    def write(self, value):
+        return value
+
+
+def export_record(order):
+    """Plain dict of an order loaded with Order.snapshot_queryset"""
+    return {
+        'id': order.id,
+        'created_at': order.created_at.isoformat(),
+        'status': order.get_status_display(),
+        'customer_id': order.customer_id,
+        'restaurant_id': order.restaurant_id,
+        'restaurant': order.restaurant.name,
+        'driver_id': order.driver_id,
+        'delivery_address': order.delivery_address,
+        'total_price': str(order.total_price),
+        'items': [
+            {
+                'menu_item_id': item.menu_item_id,
+                'name': item.menu_item.name,
+                'quantity': item.quantity,
+                'unit_price': str(item.unit_price),
+                'line_total': str(item.line_total),
+                'add_ons': [
+                    {
+                        'add_on_id': add_on.add_on_id,
+                        'name': add_on.add_on.name,
+                        'quantity': add_on.quantity,
+                        'unit_price': str(add_on.unit_price),
+                        'line_total': str(add_on.line_total),
+                    }
+                    for add_on in item.order_add_ons.all()
+                ],
+            }
+            for item in order.order_items.all()
+        ],
+    }
+
+
+def iter_records(orders, archived=None):
+    """
+    Export records of the `orders` queryset, then of the `archived`
+    ArchivedOrder queryset, each by id. Both are walked in chunks and
+    prefetches run per chunk, so memory stays bounded by the chunk size
+    rather than the export size.
+    """
+    for order in orders.order_by('id').iterator(chunk_size=EXPORT_CHUNK_SIZE):
+        yield export_record(order)
+
+    if archived is not None:
+        for record in archived.order_by('id').values_list(
+            'record', flat=True
+        ).iterator(chunk_size=EXPORT_CHUNK_SIZE):
+            yield {
+                key: value for key, value in record.items()
+                if key not in ARCHIVE_ONLY_KEYS
+            }
+
+
+def ndjson_lines(orders, archived=None):
+    for record in iter_records(orders, archived):
+        yield json.dumps(record) + '\n'
+
+
+def csv_lines(orders, archived=None):
+    """One row per order line, with the line's add-ons in a single column"""
+    writer = csv.writer(Echo())
+    yield writer.writerow(CSV_HEADER)
+
+    for record in iter_records(orders, archived):
+        head = [
+            record['id'], record['created_at'], record['status'],
+            record['customer_id'], record['restaurant_id'], record['restaurant'],
+            record['driver_id'], record['delivery_address'], record['total_price'],
+        ]
+        for item in record['items'] or [None]:
+            if item is None:
+                yield writer.writerow(head + [''] * 6)
+                continue
+            yield writer.writerow(head + [
+                item['menu_item_id'], item['name'], item['quantity'],
+                item['unit_price'], item['line_total'],
+                '; '.join(
+                    f"{add_on['name']} x{add_on['quantity']}"
+                    for add_on in item['add_ons']
+                ),
+            ])
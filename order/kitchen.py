@@ -0,0 +1,95 @@
+import uuid
+
+from django.core.cache import cache
+from django.db import transaction
+
+
+class KitchenQueue:
+    """
+    Active orders (Pending to Out for Delivery) of one restaurant, cached
+    under a per-restaurant version key so the dashboard reads only what
+    is still in flight.
+
+    Placing, editing, moving or deleting an order sets a new version once
+    the transaction commits, and the next read rebuilds the queue from
+    the (restaurant, status) index. The cached queue is never patched in
+    place, so writers on different workers cannot overwrite each other's
+    changes; a reader that loaded just before a commit stores its result
+    under the old version, which nobody reads again.
+    """
+    ACTIVE_STATUSES = (1, 2, 3, 4)
+    TIMEOUT = 60 * 60
+
+    def __init__(self, restaurant_id):
+        self.restaurant_id = restaurant_id
+        self.version_key = self.version_key_for(restaurant_id)
+
+
+    @staticmethod
+    def version_key_for(restaurant_id):
+        return f'kitchen_queue_version:{restaurant_id}'
+
+    @staticmethod
+    def _new_version():
+        # Random, like MenuCache versions, so an evicted version key
+        # cannot come back pointing at an older queue
+        return uuid.uuid4().hex
+
+    @staticmethod
+    def entry(order):
+        """Dashboard view of an order loaded with Order.snapshot_queryset"""
+        return {
+            'id': order.id,
+            'status': order.status,
+            'status_display': order.get_status_display(),
+            'driver_id': order.driver_id,
+            'total_price': str(order.total_price),
+            'delivery_address': order.delivery_address,
+            'created_at': order.created_at.isoformat(),
+            'items': [
+                {
+                    'name': item.menu_item.name,
+                    'quantity': item.quantity,
+                    'add_ons': [
+                        {'name': add_on.add_on.name, 'quantity': add_on.quantity}
+                        for add_on in item.order_add_ons.all()
+                    ]
+                }
+                for item in order.order_items.all()
+            ]
+        }
+
+    def _load(self):
+        from order.models import Order
+
+        orders = Order.snapshot_queryset().filter(
+            restaurant_id=self.restaurant_id,
+            status__in=self.ACTIVE_STATUSES
+        ).order_by('created_at')
+        return [self.entry(order) for order in orders]
+
+    def orders(self):
+        """Active orders, oldest first"""
+        version = cache.get(self.version_key)
+        if version is None:
+            cache.add(self.version_key, self._new_version(), None)
+            version = cache.get(self.version_key)
+
+        key = f'kitchen_queue:{self.restaurant_id}:{version}'
+        entries = cache.get(key)
+        if entries is None:
+            entries = self._load()
+            cache.set(key, entries, self.TIMEOUT)
+        return entries
+
+
+    @classmethod
+    def record(cls, orders):
+        """Invalidate the queues of `orders`' restaurants once the transaction commits"""
+        keys = {cls.version_key_for(order.restaurant_id) for order in orders}
+        if not keys:
+            return
+
+        transaction.on_commit(
+            lambda: cache.set_many({key: cls._new_version() for key in keys}, None)
+        )
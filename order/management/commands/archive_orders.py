@@ -0,0 +1,32 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+
+from order.archive import archive_orders
+
+
+class Command(BaseCommand):
+    help = 'Move delivered and cancelled orders older than an age into the order archive.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--older-than-days', type=float, default=90,
+            help='Orders last changed more than this many days ago are archived (default: 90).'
+        )
+        parser.add_argument(
+            '--batch-size', type=int, default=500,
+            help='Width of each id range archived in one transaction (default: 500).'
+        )
+
+    def handle(self, *args, **options):
+        def report(archived, seconds):
+            self.stdout.write(
+                f'Archived {archived} orders ({archived / max(seconds, 1e-6):.0f} rows/s)'
+            )
+
+        total = archive_orders(
+            older_than=timedelta(days=options['older_than_days']),
+            batch_size=options['batch_size'],
+            on_batch=report,
+        )
+        self.stdout.write(self.style.SUCCESS(f'Archived {total} orders in total.'))
@@ -0,0 +1,47 @@
+import datetime
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from django.utils.dateparse import parse_date
+
+from order.rollups import rebuild_sales_rollups
+
+
+class Command(BaseCommand):
+    help = 'Recompute daily sales rollups for a date range from the order tables.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--since', help='First day to rebuild, YYYY-MM-DD (default: 30 days ago).'
+        )
+        parser.add_argument(
+            '--until', help='Last day to rebuild, YYYY-MM-DD (default: today).'
+        )
+        parser.add_argument(
+            '--chunk-days', type=int, default=7,
+            help='Days recomputed in one transaction (default: 7).'
+        )
+
+    def parse_day(self, value, default):
+        if value is None:
+            return default
+        day = parse_date(value)
+        if day is None:
+            raise CommandError(f'Invalid date: {value}')
+        return day
+
+    def handle(self, *args, **options):
+        until = self.parse_day(options['until'], timezone.localdate())
+        since = self.parse_day(options['since'], until - datetime.timedelta(days=30))
+        if since > until:
+            raise CommandError('--since must not be after --until.')
+
+        def report(first_day, rows):
+            self.stdout.write(f'{first_day}: {rows} rollup rows')
+
+        rebuild_sales_rollups(
+            since, until + datetime.timedelta(days=1),
+            chunk_days=options['chunk_days'],
+            on_chunk=report,
+        )
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt sales rollups {since} to {until}.'))
@@ -0,0 +1,65 @@
+# Generated by Django 6.0 on 2026-10-17 22:40
+
+from django.db import migrations, models
+from django.db.models import DecimalField, ExpressionWrapper, F, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+
+
+def backfill_line_prices(apps, schema_editor):
+    """
+    Freeze existing lines at the current menu prices, the closest record
+    of what was charged that the tables hold.
+    """
+    OrderItem = apps.get_model('order', 'OrderItem')
+    OrderAddOn = apps.get_model('order', 'OrderAddOn')
+
+    OrderAddOn.objects.update(unit_price=Subquery(
+        OrderAddOn.objects.filter(pk=OuterRef('pk')).values('add_on__price')
+    ))
+    OrderAddOn.objects.update(line_total=ExpressionWrapper(
+        F('quantity') * F('unit_price'), output_field=DecimalField()
+    ))
+
+    add_ons_total = OrderAddOn.objects.filter(
+        order_item=OuterRef('pk')
+    ).values('order_item').annotate(total=Sum('line_total')).values('total')
+
+    OrderItem.objects.update(unit_price=Subquery(
+        OrderItem.objects.filter(pk=OuterRef('pk')).values('menu_item__price')
+    ))
+    OrderItem.objects.update(line_total=ExpressionWrapper(
+        F('quantity') * F('unit_price')
+        + Coalesce(Subquery(add_ons_total), Value(0), output_field=DecimalField()),
+        output_field=DecimalField()
+    ))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('order', '0004_order_history_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='orderaddon',
+            name='line_total',
+            field=models.DecimalField(decimal_places=2, default=0, max_digits=10),
+        ),
+        migrations.AddField(
+            model_name='orderaddon',
+            name='unit_price',
+            field=models.DecimalField(decimal_places=2, default=0, max_digits=10),
+        ),
+        migrations.AddField(
+            model_name='orderitem',
+            name='line_total',
+            field=models.DecimalField(decimal_places=2, default=0, max_digits=10),
+        ),
+        migrations.AddField(
+            model_name='orderitem',
+            name='unit_price',
+            field=models.DecimalField(decimal_places=2, default=0, max_digits=10),
+        ),
+        migrations.RunPython(backfill_line_prices, migrations.RunPython.noop),
+    ]
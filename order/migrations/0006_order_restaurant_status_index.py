@@ -0,0 +1,20 @@
+# Generated by Django 6.0 on 2026-10-17 22:48
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('order', '0005_order_line_prices'),
+        ('restaurant', '0001_initial'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['restaurant', 'status'], name='order_restaurant_status_idx'),
+        ),
+    ]
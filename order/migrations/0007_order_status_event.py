@@ -0,0 +1,33 @@
+# Generated by Django 6.0 on 2026-10-17 22:49
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('order', '0006_order_restaurant_status_index'),
+        ('restaurant', '0001_initial'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OrderStatusEvent',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('from_status', models.IntegerField(blank=True, choices=[(1, 'Pending'), (2, 'Preparing'), (3, 'Ready for Pickup'), (4, 'Out for Delivery'), (5, 'Delivered'), (6, 'Cancelled')], null=True)),
+                ('to_status', models.IntegerField(choices=[(1, 'Pending'), (2, 'Preparing'), (3, 'Ready for Pickup'), (4, 'Out for Delivery'), (5, 'Delivered'), (6, 'Cancelled')])),
+                ('occurred_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('actor', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.DO_NOTHING, related_name='+', to=settings.AUTH_USER_MODEL)),
+                ('order', models.ForeignKey(on_delete=django.db.models.deletion.DO_NOTHING, related_name='status_events', to='order.order')),
+                ('restaurant', models.ForeignKey(on_delete=django.db.models.deletion.DO_NOTHING, related_name='+', to='restaurant.restaurant')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['restaurant', 'occurred_at'], name='event_restaurant_time_idx'), models.Index(fields=['order', 'occurred_at'], name='event_order_time_idx')],
+            },
+        ),
+    ]
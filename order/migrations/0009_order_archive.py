@@ -0,0 +1,35 @@
+# Generated by Django 6.0 on 2026-10-17 22:54
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('order', '0008_sales_rollups'),
+        ('restaurant', '0001_initial'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ArchivedOrder',
+            fields=[
+                ('id', models.BigIntegerField(primary_key=True, serialize=False)),
+                ('status', models.IntegerField(choices=[(1, 'Pending'), (2, 'Preparing'), (3, 'Ready for Pickup'), (4, 'Out for Delivery'), (5, 'Delivered'), (6, 'Cancelled')])),
+                ('total_price', models.DecimalField(decimal_places=2, max_digits=10)),
+                ('created_at', models.DateTimeField()),
+                ('archived_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('record', models.JSONField()),
+                ('customer', models.ForeignKey(on_delete=django.db.models.deletion.DO_NOTHING, related_name='+', to=settings.AUTH_USER_MODEL)),
+                ('driver', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.DO_NOTHING, related_name='+', to=settings.AUTH_USER_MODEL)),
+                ('restaurant', models.ForeignKey(on_delete=django.db.models.deletion.DO_NOTHING, related_name='+', to='restaurant.restaurant')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['customer', 'created_at'], name='archive_customer_created_idx'), models.Index(fields=['restaurant', 'created_at'], name='archive_restaurant_created_idx'), models.Index(fields=['driver', 'created_at'], name='archive_driver_created_idx')],
+            },
+        ),
+    ]
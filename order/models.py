@@ -1,4 +1,8 @@
+import logging
+
 from django.db import models, transaction
+from django.db.models import Avg, Count, ExpressionWrapper, F, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
 from hungryBird.baseModels import TimeStampedModel, LocationModel
 from django.utils import timezone
 from channels.layers import get_channel_layer
@@ -6,6 +10,12 @@ from asgiref.sync import async_to_sync
 from rest_framework.exceptions import PermissionDenied
 import json
 from notifications.dispatcher import OrderNotificationDispatcher
+from order.exports import export_record
+from order.kitchen import KitchenQueue
+from order.rollups import SalesRollup
+from restaurant.models import Restaurant
+
+logger = logging.getLogger(__name__)
 
 # Create your models here.
 class Order(TimeStampedModel, LocationModel):
@@ -43,6 +53,63 @@ class Order(TimeStampedModel, LocationModel):
     status = models.IntegerField(choices=STATUS_CHOICES, default=1)
     total_price = models.DecimalField(max_digits=10, decimal_places=2)
     delivery_address = models.TextField()
+    # Bumped on every change; served as the order's ETag
+    version = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        # Order history is read per customer, restaurant or driver, newest first
+        indexes = [
+            models.Index(
+                fields=['customer', 'created_at'], name='order_customer_created_idx'
+            ),
+            models.Index(
+                fields=['restaurant', 'created_at'], name='order_restaurant_created_idx'
+            ),
+            models.Index(
+                fields=['driver', 'created_at'], name='order_driver_created_idx'
+            ),
+            # Active orders per restaurant, for the kitchen queue
+            models.Index(
+                fields=['restaurant', 'status'], name='order_restaurant_status_idx'
+            ),
+        ]
+
+    def save(self, *args, **kwargs):
+        bump = not self._state.adding
+        if bump:
+            # Bumped in the UPDATE so a concurrent F() bump is not overwritten
+            self.version = F('version') + 1
+            if kwargs.get('update_fields') is not None:
+                kwargs['update_fields'] = {*kwargs['update_fields'], 'version'}
+        super().save(*args, **kwargs)
+        if bump:
+            self.refresh_from_db(fields=['version'])
+
+    @classmethod
+    def snapshot_queryset(cls, restaurant=True, driver=True, items=True):
+        """
+        Orders with restaurant, driver, items, menu items and add-ons
+        loaded up front, so a page of orders renders in a fixed number of
+        queries however many orders or lines it holds. Relations the
+        caller will not render can be left out.
+        """
+        orders = cls.objects.select_related(*[
+            name for name, wanted in (('restaurant', restaurant), ('driver', driver))
+            if wanted
+        ])
+        if not items:
+            return orders
+        return orders.prefetch_related(
+            models.Prefetch(
+                'order_items',
+                OrderItem.objects.select_related('menu_item').prefetch_related(
+                    models.Prefetch(
+                        'order_add_ons',
+                        OrderAddOn.objects.select_related('add_on')
+                    )
+                )
+            )
+        )
 
     # Helpers
     def get_status_message(self):
@@ -70,69 +137,182 @@ class Order(TimeStampedModel, LocationModel):
         }
     
     def get_order_total(self):
-        total = sum([item.get_item_total() for item in self.order_items.all()])
-        total += sum([add_on.get_add_on_total() for item in self.order_items.all() \
-                      for add_on in item.order_add_ons.all()])
-        return total
+        """Sum of the frozen line totals, which already include add-ons"""
+        return self.order_items.aggregate(
+            total=Coalesce(Sum('line_total'), Value(0), output_field=models.DecimalField())
+        )['total']
     
 
     # State Transitions
-    def _allowed_transitions(self):
-        return {
-            1: {
-                1: [6], # Customer can cancel
-                2: [6]
-            },
-            2: {  # Owner can change status from preparing to out for delivery
-                1: [2],
-                2: [3],
-                3: [4],
-            },
-            3: { # Driver can change status from ready for pickup to delivered
-                3: [4],
-                4: [5],
-            }
+    # role -> current status -> statuses that role may move the order to
+    TRANSITIONS = {
+        1: {
+            1: (6,), # Customer can cancel
+            2: (6,)
+        },
+        2: {  # Owner can change status from preparing to out for delivery
+            1: (2,),
+            2: (3,),
+            3: (4,),
+        },
+        3: { # Driver can change status from ready for pickup to delivered
+            3: (4,),
+            4: (5,),
         }
+    }
+
+    def _allowed_transitions(self):
+        return self.TRANSITIONS
 
 
     def transition_status(self, user, new_status):
-        role = int(user.role)
+        """
+        Move the order to `new_status` with one conditional UPDATE that
+        only matches while the order is still in the status it was read
+        in. Returns False when a concurrent transition got there first.
+        """
         current_status = self.status
 
-        allowed = self._allowed_transitions().get(role, {}). \
-            get(current_status, [])
+        allowed = self.TRANSITIONS.get(int(user.role), {}). \
+            get(current_status, ())
         
         if new_status not in allowed:
             raise PermissionDenied("Invalid status transition.")
-        
-        
 
+        changes = {'status': new_status}
+        now = timezone.now()
         with transaction.atomic():
-            self.status = new_status
-            self.save(update_fields=['status', 'updated_at'])  
-    
-            # If order is cancelled, no further actions needed
-            if new_status == 6:
-                transaction.on_commit(
-                    lambda: OrderNotificationDispatcher.dispatch(self)
-                )
-                return
+            won = Order.objects.filter(
+                pk=self.pk, status=current_status
+            ).update(
+                **changes,
+                updated_at=now,
+                version=models.F('version') + 1
+            )
+            if not won:
+                return False
 
-            if new_status == 3 and not self.driver:  # Ready for Pickup by Owner
-                driver = self.restaurant.assign_driver(self)
+            # Only the winner picks a driver, while the row is still locked
+            if new_status == 3 and not self.driver_id:  # Ready for Pickup by Owner
+                driver = self.restaurant.pick_driver()
                 if driver:
-                    self.driver = driver
-                    print(f"Assigned driver {driver.id} to order {self.id}")
-                    self.save(update_fields=['driver'])
-                    transaction.on_commit(
-                        lambda: OrderNotificationDispatcher.dispatch(self)
-                    )
-                    return
+                    Order.objects.filter(pk=self.pk).update(driver=driver)
+                    changes['driver'] = driver
+
+            OrderStatusEvent.objects.create(
+                order=self, restaurant_id=self.restaurant_id, actor=user,
+                from_status=current_status, to_status=new_status, occurred_at=now
+            )
+            rollup = SalesRollup()
+            rollup.moved([(self, current_status)], new_status)
+            rollup.save()
+
+            for field, value in changes.items():
+                setattr(self, field, value)
+            self.version += 1
+            if 'driver' in changes:
+                logger.info(f"Assigned driver {self.driver_id} to order {self.id}")
 
+            KitchenQueue.record([self])
             # Always notify on status change
             transaction.on_commit(
                 lambda: OrderNotificationDispatcher.dispatch(self)
-            )   
+            )
+        return True
+
+
+    @classmethod
+    def bulk_transition_status(cls, orders, user, new_status):
+        """
+        Move every order in the `orders` queryset to `new_status` at once.
+        Current statuses are read in one query, locking the rows, and all
+        checked against TRANSITIONS before anything is written; then each
+        group of orders sharing a status is moved with one UPDATE.
+        Notifications go out in a single batch after commit.
+
+        The lock keeps concurrent transitions out between the read and the
+        UPDATEs, so the moved orders are exactly the rows read here and
+        none of them is logged or rolled up twice.
+
+        Returns the moved orders.
+        """
+        allowed_from = {
+            status for status, targets in
+            cls.TRANSITIONS.get(int(user.role), {}).items()
+            if new_status in targets
+        }
+
+        with transaction.atomic():
+            rows = list(
+                orders.select_for_update(of=('self',)).values_list(
+                    'id', 'status', 'restaurant_id', 'driver_id'
+                )
+            )
+            invalid = [pk for pk, status, _, _ in rows if status not in allowed_from]
+            if invalid:
+                raise PermissionDenied(
+                    f"Invalid status transition for orders {invalid}."
+                )
+
+            by_status = {}
+            for pk, status, _, _ in rows:
+                by_status.setdefault(status, []).append(pk)
+
+            assignments = {}
+            if new_status == 3:  # Ready for Pickup needs a driver per order
+                waiting = {}
+                for pk, _, restaurant_id, driver_id in rows:
+                    if not driver_id:
+                        waiting.setdefault(restaurant_id, []).append(pk)
+                restaurants = Restaurant.objects.in_bulk(waiting)
+                for restaurant_id, order_ids in waiting.items():
+                    drivers = restaurants[restaurant_id].pick_drivers(len(order_ids))
+                    assignments.update(zip(order_ids, (d.id for d in drivers)))
+
+            now = timezone.now()
+            changes = {
+                'status': new_status,
+                'updated_at': now,
+                'version': models.F('version') + 1,
+            }
+            if assignments:
+                changes['driver'] = models.Case(
+                    *[
+                        models.When(pk=pk, then=models.Value(driver_id))
+                        for pk, driver_id in assignments.items()
+                    ],
+                    default=models.F('driver'),
+                    output_field=cls._meta.get_field('driver').target_field
+                )
+
+            for status, order_ids in by_status.items():
+                cls.objects.filter(pk__in=order_ids, status=status).update(**changes)
+
+            previous = {pk: status for pk, status, _, _ in rows}
+            moved = list(
+                cls.objects.filter(pk__in=previous).select_related(
+                    'restaurant', 'customer', 'driver'
+                )
+            )
+            OrderStatusEvent.objects.bulk_create([
+                OrderStatusEvent(
+                    order=order, restaurant_id=order.restaurant_id, actor=user,
+                    from_status=previous[order.id], to_status=new_status,
+                    occurred_at=now
+                )
+                for order in moved
+            ])
+            rollup = SalesRollup()
+            rollup.moved(
+                [(order, previous[order.id]) for order in moved], new_status
+            )
+            rollup.save()
+
+            KitchenQueue.record(moved)
+            transaction.on_commit(
+                lambda: OrderNotificationDispatcher.dispatch_many(moved)
+            )
+        return moved
 
 
     def __str__(self):
@@ -147,10 +327,28 @@ class OrderItem(TimeStampedModel):
     order = models.ForeignKey('order.Order', on_delete=models.DO_NOTHING, related_name='order_items')
     menu_item = models.ForeignKey('restaurant.MenuItem', on_delete=models.DO_NOTHING)
     quantity = models.PositiveIntegerField()
+    # Prices frozen when the line is written, so history survives menu repricing
+    unit_price = models.DecimalField(max_digits=10, decimal_places=2, default=0)
+    # quantity * unit_price plus the line's add-ons
+    line_total = models.DecimalField(max_digits=10, decimal_places=2, default=0)
+
+
+    @classmethod
+    def priced(cls, menu_item, quantity, add_ons=(), **kwargs):
+        """Unsaved line at the menu item's current price; `add_ons` are its priced OrderAddOns"""
+        return cls(
+            menu_item=menu_item,
+            quantity=quantity,
+            unit_price=menu_item.price,
+            line_total=menu_item.price * quantity + sum(
+                add_on.line_total for add_on in add_ons
+            ),
+            **kwargs
+        )
 
 
     def get_item_total(self):
-        return self.menu_item.price * self.quantity
+        return self.unit_price * self.quantity
     
 
     def __str__(self):
@@ -162,11 +360,223 @@ class OrderAddOn(TimeStampedModel):
         on_delete=models.CASCADE, related_name='order_add_ons')
     add_on = models.ForeignKey('restaurant.AddOn', on_delete=models.DO_NOTHING)
     quantity = models.PositiveIntegerField()
+    unit_price = models.DecimalField(max_digits=10, decimal_places=2, default=0)
+    line_total = models.DecimalField(max_digits=10, decimal_places=2, default=0)
+
+
+    @classmethod
+    def priced(cls, add_on, quantity, **kwargs):
+        """Unsaved add-on line at the add-on's current price"""
+        return cls(
+            add_on=add_on,
+            quantity=quantity,
+            unit_price=add_on.price,
+            line_total=add_on.price * quantity,
+            **kwargs
+        )
 
 
     def get_add_on_total(self):
-        return self.add_on.price * self.quantity
+        return self.line_total
     
     def __str__(self):
         return f"{self.quantity} x {self.add_on.name} for OrderItem #{self.order_item.id}"
     
+
+
+
+class OrderStatusEvent(models.Model):
+    """
+    Append-only log of status changes, written in the same transaction as
+    the change itself. from_status is empty for the event placing the order.
+    """
+    order = models.ForeignKey(
+        'order.Order', on_delete=models.DO_NOTHING, related_name='status_events'
+    )
+    # Copied from the order so per-restaurant time ranges need no join
+    restaurant = models.ForeignKey(
+        'restaurant.Restaurant', on_delete=models.DO_NOTHING, related_name='+'
+    )
+    actor = models.ForeignKey(
+        'authUser.User', on_delete=models.DO_NOTHING,
+        null=True, blank=True, related_name='+'
+    )
+    from_status = models.IntegerField(
+        choices=Order.STATUS_CHOICES, null=True, blank=True
+    )
+    to_status = models.IntegerField(choices=Order.STATUS_CHOICES)
+    occurred_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        indexes = [
+            models.Index(
+                fields=['restaurant', 'occurred_at'], name='event_restaurant_time_idx'
+            ),
+            models.Index(
+                fields=['order', 'occurred_at'], name='event_order_time_idx'
+            ),
+        ]
+
+    @classmethod
+    def placed(cls, order):
+        """Unsaved event for a newly placed order"""
+        return cls(
+            order=order, restaurant_id=order.restaurant_id, actor_id=order.customer_id,
+            to_status=order.status, occurred_at=order.created_at
+        )
+
+    @classmethod
+    def stage_durations(cls, restaurant_ids, since, until):
+        """
+        Average and count of how long orders stayed in each status, for
+        stages entered within [since, until). Each event is paired with
+        the order's next event and the durations are averaged by the
+        database. Stages the order has not left yet are not counted.
+        """
+        next_event_at = cls.objects.filter(
+            order=OuterRef('order'), id__gt=OuterRef('id')
+        ).order_by('id').values('occurred_at')[:1]
+
+        return cls.objects.filter(
+            restaurant_id__in=restaurant_ids,
+            occurred_at__gte=since,
+            occurred_at__lt=until
+        ).annotate(
+            left_at=Subquery(next_event_at)
+        ).filter(
+            left_at__isnull=False
+        ).values('to_status').annotate(
+            orders=Count('id'),
+            average=Avg(ExpressionWrapper(
+                F('left_at') - F('occurred_at'), output_field=models.DurationField()
+            ))
+        ).order_by('to_status')
+
+    def __str__(self):
+        return f"Order #{self.order_id}: {self.from_status} -> {self.to_status}"
+
+
+
+class DailySales(models.Model):
+    """
+    Orders placed at a restaurant on a day that are currently in `status`,
+    and their total. Kept in step by order/rollups.py as orders are placed,
+    edited and move status; rebuild_sales_rollups recomputes any range.
+    """
+    restaurant = models.ForeignKey(
+        'restaurant.Restaurant', on_delete=models.CASCADE, related_name='+'
+    )
+    day = models.DateField()
+    status = models.IntegerField(choices=Order.STATUS_CHOICES)
+    orders = models.IntegerField(default=0)
+    revenue = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['restaurant', 'day', 'status'], name='unique_daily_sales'
+            )
+        ]
+
+    def __str__(self):
+        return f"{self.restaurant_id} {self.day} {self.get_status_display()}: {self.orders}"
+
+
+
+class DailyItemSales(models.Model):
+    """Quantity and line revenue of a menu item on a day, cancelled orders excluded"""
+    restaurant = models.ForeignKey(
+        'restaurant.Restaurant', on_delete=models.CASCADE, related_name='+'
+    )
+    day = models.DateField()
+    menu_item = models.ForeignKey(
+        'restaurant.MenuItem', on_delete=models.CASCADE, related_name='+'
+    )
+    quantity = models.IntegerField(default=0)
+    revenue = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['restaurant', 'day', 'menu_item'], name='unique_daily_item_sales'
+            )
+        ]
+
+    def __str__(self):
+        return f"{self.restaurant_id} {self.day} item {self.menu_item_id}: {self.quantity}"
+
+
+
+class ArchivedOrder(models.Model):
+    """
+    A delivered or cancelled order moved out of the active tables by
+    order/archive.py. Keeps the columns history is filtered by and the
+    rest of the order (lines, payment, status events) as one record.
+    """
+    # The order's own id, so archived and active orders never collide
+    id = models.BigIntegerField(primary_key=True)
+    customer = models.ForeignKey(
+        'authUser.User', on_delete=models.DO_NOTHING, related_name='+'
+    )
+    restaurant = models.ForeignKey(
+        'restaurant.Restaurant', on_delete=models.DO_NOTHING, related_name='+'
+    )
+    driver = models.ForeignKey(
+        'authUser.User', on_delete=models.DO_NOTHING,
+        null=True, blank=True, related_name='+'
+    )
+    status = models.IntegerField(choices=Order.STATUS_CHOICES)
+    total_price = models.DecimalField(max_digits=10, decimal_places=2)
+    created_at = models.DateTimeField()
+    archived_at = models.DateTimeField(default=timezone.now)
+    record = models.JSONField()
+
+    class Meta:
+        indexes = [
+            models.Index(
+                fields=['customer', 'created_at'], name='archive_customer_created_idx'
+            ),
+            models.Index(
+                fields=['restaurant', 'created_at'], name='archive_restaurant_created_idx'
+            ),
+            models.Index(
+                fields=['driver', 'created_at'], name='archive_driver_created_idx'
+            ),
+        ]
+
+    @classmethod
+    def from_order(cls, order):
+        """
+        Unsaved archive of an order loaded with Order.snapshot_queryset,
+        plus its payment and status events
+        """
+        record = export_record(order)
+        payment = getattr(order, 'payment', None)
+        record['payment'] = payment and {
+            'method': payment.get_method_display(),
+            'amount': str(payment.amount),
+            'status': payment.get_status_display(),
+            'transaction_id': payment.transaction_id,
+        }
+        record['status_events'] = [
+            {
+                'from_status': event.from_status,
+                'to_status': event.to_status,
+                'actor_id': event.actor_id,
+                'occurred_at': event.occurred_at.isoformat(),
+            }
+            for event in order.status_events.all()
+        ]
+        return cls(
+            id=order.id,
+            customer_id=order.customer_id,
+            restaurant_id=order.restaurant_id,
+            driver_id=order.driver_id,
+            status=order.status,
+            total_price=order.total_price,
+            created_at=order.created_at,
+            record=record,
+        )
+
+    def __str__(self):
+        return f"Archived order #{self.id}"
@@ -0,0 +1,248 @@
+import datetime
+from collections import defaultdict
+from decimal import Decimal
+
+from django.db import models, transaction
+from django.db.models import Case, Count, F, Sum, Value, When
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+
+class SalesRollup:
+    """
+    Collects DailySales / DailyItemSales deltas for one unit of work and
+    writes them in a fixed number of statements per table: insert any
+    missing rows, read their ids, then one UPDATE adding every delta.
+
+    DailySales rows count orders by the status they are in now, so a
+    status change moves an order between two rows of the same day.
+    Item rows leave cancelled orders out.
+    """
+
+    def __init__(self):
+        # (restaurant_id, day, status) -> [orders, revenue]
+        self.sales = defaultdict(lambda: [0, Decimal('0')])
+        # (restaurant_id, day, menu_item_id) -> [quantity, revenue]
+        self.items = defaultdict(lambda: [0, Decimal('0')])
+
+    @staticmethod
+    def day(order):
+        return timezone.localdate(order.created_at)
+
+
+    # Changes
+    def placed(self, order, order_items):
+        sales = self.sales[(order.restaurant_id, self.day(order), order.status)]
+        sales[0] += 1
+        sales[1] += order.total_price
+        if order.status != 6:
+            self._add_lines(order, [
+                (item.menu_item_id, item.quantity, item.line_total)
+                for item in order_items
+            ])
+
+    def removed(self, order, order_items):
+        """Take back what placed() and later changes added for a deleted order"""
+        sales = self.sales[(order.restaurant_id, self.day(order), order.status)]
+        sales[0] -= 1
+        sales[1] -= order.total_price
+        if order.status != 6:
+            self._add_lines(order, [
+                (item.menu_item_id, -item.quantity, -item.line_total)
+                for item in order_items
+            ])
+
+    def moved(self, moves, to_status):
+        """`moves` is a list of (order with its new total, status it left)"""
+        cancelled = []
+        for order, from_status in moves:
+            day = self.day(order)
+            left = self.sales[(order.restaurant_id, day, from_status)]
+            left[0] -= 1
+            left[1] -= order.total_price
+            entered = self.sales[(order.restaurant_id, day, to_status)]
+            entered[0] += 1
+            entered[1] += order.total_price
+            if to_status == 6 and from_status != 6:
+                cancelled.append(order)
+
+        if cancelled:
+            from order.models import OrderItem
+
+            orders = {order.id: order for order in cancelled}
+            lines = defaultdict(list)
+            for order_id, menu_item_id, quantity, line_total in \
+                    OrderItem.objects.filter(order__in=cancelled).values_list(
+                        'order_id', 'menu_item_id', 'quantity', 'line_total'):
+                lines[order_id].append((menu_item_id, -quantity, -line_total))
+            for order_id, order_lines in lines.items():
+                self._add_lines(orders[order_id], order_lines)
+
+    def lines_changed(self, order, old_lines, new_lines):
+        """Lines are (menu_item_id, quantity, line_total) before and after an edit"""
+        sales = self.sales[(order.restaurant_id, self.day(order), order.status)]
+        sales[1] += sum(line[2] for line in new_lines) - sum(line[2] for line in old_lines)
+        if order.status != 6:
+            self._add_lines(order, [
+                (menu_item_id, -quantity, -line_total)
+                for menu_item_id, quantity, line_total in old_lines
+            ] + list(new_lines))
+
+    def _add_lines(self, order, lines):
+        day = self.day(order)
+        for menu_item_id, quantity, line_total in lines:
+            item = self.items[(order.restaurant_id, day, menu_item_id)]
+            item[0] += quantity
+            item[1] += line_total
+
+
+    # Writing
+    def save(self):
+        from order.models import DailySales, DailyItemSales
+
+        with transaction.atomic():
+            self._apply(DailySales, 'status', 'orders', self.sales)
+            self._apply(DailyItemSales, 'menu_item_id', 'quantity', self.items)
+        self.sales.clear()
+        self.items.clear()
+
+    @staticmethod
+    def _apply(model, key_field, count_field, deltas):
+        deltas = {key: delta for key, delta in deltas.items() if any(delta)}
+        if not deltas:
+            return
+
+        model.objects.bulk_create(
+            [
+                model(restaurant_id=restaurant_id, day=day, **{key_field: key})
+                for restaurant_id, day, key in deltas
+            ],
+            ignore_conflicts=True
+        )
+        ids = {
+            (restaurant_id, day, key): pk
+            for pk, restaurant_id, day, key in model.objects.filter(
+                restaurant_id__in={key[0] for key in deltas},
+                day__in={key[1] for key in deltas},
+                **{f'{key_field}__in': {key[2] for key in deltas}}
+            ).values_list('id', 'restaurant_id', 'day', key_field)
+            if (restaurant_id, day, key) in deltas
+        }
+
+        def increments(index, output_field):
+            return Case(
+                *[
+                    When(pk=ids[key], then=Value(delta[index]))
+                    for key, delta in deltas.items()
+                ],
+                default=Value(0),
+                output_field=output_field
+            )
+
+        model.objects.filter(pk__in=ids.values()).update(**{
+            count_field: F(count_field) + increments(0, models.IntegerField()),
+            'revenue': F('revenue') + increments(
+                1, models.DecimalField(max_digits=12, decimal_places=2)
+            ),
+        })
+
+
+
+def rebuild_sales_rollups(since, until, chunk_days=7, on_chunk=None):
+    """
+    Recompute the rollups of days in [since, until) from the order tables
+    and the order archive, `chunk_days` at a time, each chunk in its own
+    transaction. `on_chunk(first_day, rows)` is called after every chunk.
+
+    A chunk first locks its existing rollup rows, then reads the orders
+    and overwrites the rows in place. An order change that commits before
+    the read is in the aggregates; one still in flight has its delta wait
+    for the lock and add it on top of the rebuilt values, so neither is
+    lost. Rows left with nothing are zeroed rather than deleted, so a
+    waiting delta still finds its row.
+    """
+    from order.models import Order, OrderItem, ArchivedOrder, DailySales, DailyItemSales
+
+    start = since
+    while start < until:
+        end = min(start + datetime.timedelta(days=chunk_days), until)
+        window = (
+            timezone.make_aware(datetime.datetime.combine(start, datetime.time.min)),
+            timezone.make_aware(datetime.datetime.combine(end, datetime.time.min)),
+        )
+
+        with transaction.atomic():
+            daily_sales = DailySales.objects.filter(day__gte=start, day__lt=end)
+            daily_items = DailyItemSales.objects.filter(day__gte=start, day__lt=end)
+            list(daily_sales.select_for_update().values_list('id'))
+            list(daily_items.select_for_update().values_list('id'))
+
+            rollup = SalesRollup()
+            for model in (Order, ArchivedOrder):
+                for row in model.objects.filter(
+                    created_at__gte=window[0], created_at__lt=window[1]
+                ).annotate(
+                    day=TruncDate('created_at')
+                ).values('restaurant_id', 'day', 'status').annotate(
+                    total_orders=Count('id'), revenue=Sum('total_price')
+                ).order_by():
+                    sales = rollup.sales[(row['restaurant_id'], row['day'], row['status'])]
+                    sales[0] += row['total_orders']
+                    sales[1] += row['revenue']
+
+            items = OrderItem.objects.filter(
+                order__created_at__gte=window[0], order__created_at__lt=window[1]
+            ).exclude(
+                order__status=6
+            ).annotate(
+                day=TruncDate('order__created_at')
+            ).values('order__restaurant_id', 'day', 'menu_item_id').annotate(
+                total_quantity=Sum('quantity'), revenue=Sum('line_total')
+            ).order_by()
+            for row in items:
+                item = rollup.items[(row['order__restaurant_id'], row['day'], row['menu_item_id'])]
+                item[0] += row['total_quantity']
+                item[1] += row['revenue']
+
+            # Archived lines only exist inside each order's record
+            for archived in ArchivedOrder.objects.filter(
+                created_at__gte=window[0], created_at__lt=window[1]
+            ).exclude(status=6).only('restaurant_id', 'created_at', 'record').iterator():
+                rollup._add_lines(archived, [
+                    (item['menu_item_id'], item['quantity'], Decimal(item['line_total']))
+                    for item in archived.record['items']
+                ])
+
+            daily_sales.update(orders=0, revenue=0)
+            daily_items.update(quantity=0, revenue=0)
+
+            rows = DailySales.objects.bulk_create(
+                [
+                    DailySales(
+                        restaurant_id=restaurant_id, day=day, status=status,
+                        orders=orders, revenue=revenue
+                    )
+                    for (restaurant_id, day, status), (orders, revenue)
+                    in rollup.sales.items()
+                ],
+                update_conflicts=True,
+                unique_fields=['restaurant', 'day', 'status'],
+                update_fields=['orders', 'revenue']
+            )
+            rows += DailyItemSales.objects.bulk_create(
+                [
+                    DailyItemSales(
+                        restaurant_id=restaurant_id, day=day, menu_item_id=menu_item_id,
+                        quantity=quantity, revenue=revenue
+                    )
+                    for (restaurant_id, day, menu_item_id), (quantity, revenue)
+                    in rollup.items.items()
+                ],
+                update_conflicts=True,
+                unique_fields=['restaurant', 'day', 'menu_item'],
+                update_fields=['quantity', 'revenue']
+            )
+
+        if on_chunk:
+            on_chunk(start, len(rows))
+        start = end
@@ -1,52 +1,41 @@
 from rest_framework import serializers
-from order.models import Order, OrderItem, OrderAddOn
+from order.kitchen import KitchenQueue
+from order.rollups import SalesRollup
+from order.models import Order, OrderItem, OrderAddOn, OrderStatusEvent
 from payment.models import Payment
 from django.db.models import Prefetch
 from django.db.transaction import atomic
 from restaurant.serializers import MenuItemSerializer, RestaurantSerializer
 from restaurant.models import MenuItem, AddOn, Restaurant
+from hungryBird.fields import DynamicFieldsMixin
 
 class OrderAddOnSerializer(serializers.Serializer):
     id = serializers.IntegerField()
     quantity = serializers.IntegerField(min_value=1)
-
-    def validate_id(self, value):
-        if not AddOn.objects.filter(id=value).exists():
-            raise serializers.ValidationError("Add-on does not exist.")
-        return value
     
 
 class OrderItemSerializer(serializers.ModelSerializer):
-    menu_item_id = serializers.PrimaryKeyRelatedField(
-        queryset=MenuItem.objects.all(),
-        source='menu_item',
-        write_only=True
-    )
+    # Identifies an existing line when editing an order
+    id = serializers.IntegerField(required=False, write_only=True)
+    # Resolved to `menu_item` for the whole order in OrderSerializer.validate
+    menu_item_id = serializers.IntegerField(write_only=True)
     add_ons = OrderAddOnSerializer(many=True, required=False, write_only=True)
 
     class Meta:
         model = OrderItem
-        fields = ['menu_item_id', 'quantity', 'add_ons']
-
-    def create(self, validated_data):
-        add_ons_data = validated_data.pop('add_ons', [])
-        order = self.context['order']
+        fields = ['id', 'menu_item_id', 'quantity', 'add_ons']
 
-        order_item = OrderItem.objects.create(order=order, **validated_data)
 
-        for add_on_data in add_ons_data:
-            OrderAddOn.objects.create(
-                order_item=order_item,
-                add_on_id=add_on_data['id'],
-                quantity=add_on_data['quantity']
-            )
-
-        return order_item
-
-    
+class BulkStatusChangeSerializer(serializers.Serializer):
+    order_ids = serializers.ListField(
+        child=serializers.IntegerField(), allow_empty=False, max_length=500
+    )
+    status = serializers.ChoiceField(choices=Order.STATUS_CHOICES)
 
 
-class OrderSerializer(serializers.ModelSerializer):
+class OrderSerializer(DynamicFieldsMixin, serializers.ModelSerializer):
+    # Built in to_representation; `items` is also the write-only input field
+    expandable_fields = ('restaurant', 'items', 'driver')
     items = OrderItemSerializer(many=True, write_only=True)
     payment_method = serializers.ChoiceField(
         choices=Payment.METHOD_CHOICES, write_only=True
@@ -67,40 +56,90 @@ class OrderSerializer(serializers.ModelSerializer):
         ]
         read_only_fields = ['id', 'total_price', 'customer', 'created_at']
 
+    def validate(self, attrs):
+        """
+        Resolve every menu item and add-on in the order with one query
+        each and check they belong to the order's restaurant.
+        """
+        items_data = attrs.get('items')
+        if items_data is None:
+            return attrs
+
+        restaurant = attrs.get('restaurant') or self.instance.restaurant
+
+        menu_items = MenuItem.objects.in_bulk({
+            item_data['menu_item_id'] for item_data in items_data
+        })
+        add_on_ids = {
+            add_on_data['id']
+            for item_data in items_data
+            for add_on_data in item_data.get('add_ons', [])
+        }
+        add_ons = AddOn.objects.in_bulk(add_on_ids) if add_on_ids else {}
+
+        for item_data in items_data:
+            menu_item = menu_items.get(item_data.pop('menu_item_id'))
+            if menu_item is None:
+                raise serializers.ValidationError(
+                    {'items': "Menu item does not exist."}
+                )
+            if menu_item.restaurant_id != restaurant.id:
+                raise serializers.ValidationError(
+                    {'items': f"{menu_item.name} is not on this restaurant's menu."}
+                )
+            item_data['menu_item'] = menu_item
+
+            for add_on_data in item_data.get('add_ons', []):
+                add_on = add_ons.get(add_on_data['id'])
+                if add_on is None:
+                    raise serializers.ValidationError(
+                        {'items': "Add-on does not exist."}
+                    )
+                if add_on.menu_item_id != menu_item.id:
+                    raise serializers.ValidationError(
+                        {'items': "Add-on does not belong to this menu item."}
+                    )
+                add_on_data['add_on'] = add_on
+
+        return attrs
+
     def create(self, validated_data):
         items_data = validated_data.pop('items')
         payment_method = validated_data.pop('payment_method')
         user = self.context['request'].user
 
+        # Prices come from the instances resolved in validate()
+        lines = []
+        for item_data in items_data:
+            add_ons = [
+                OrderAddOn.priced(add_on_data['add_on'], add_on_data['quantity'])
+                for add_on_data in item_data.get('add_ons', [])
+            ]
+            lines.append((
+                OrderItem.priced(item_data['menu_item'], item_data['quantity'], add_ons),
+                add_ons
+            ))
+        total = sum(order_item.line_total for order_item, _ in lines)
+
         with atomic():
             order = Order.objects.create(
                 customer=user,
-                total_price=0,
+                total_price=total,
                 **validated_data
             )
 
-            total = 0
-
-            for item_data in items_data:
-                add_ons_data = item_data.pop('add_ons', [])
-                order_item = OrderItem.objects.create(
-                    order=order,
-                    **item_data
-                )
-                for add_on_data in add_ons_data:
-                    OrderAddOn.objects.create(
-                        order_item=order_item,
-                        add_on_id=add_on_data['id'],
-                        quantity=add_on_data['quantity']
-                    )
-                total += order_item.get_item_total()
-                total += sum(
-                    add_on.get_add_on_total()
-                    for add_on in order_item.order_add_ons.all()
-                )
+            for order_item, _ in lines:
+                order_item.order = order
+            OrderItem.objects.bulk_create(
+                [order_item for order_item, _ in lines]
+            )
 
-            order.total_price = total
-            order.save(update_fields=['total_price'])
+            for order_item, add_ons in lines:
+                for add_on in add_ons:
+                    add_on.order_item = order_item
+            OrderAddOn.objects.bulk_create(
+                [add_on for _, add_ons in lines for add_on in add_ons]
+            )
 
             Payment.objects.create(
                 order=order,
@@ -108,6 +147,11 @@ class OrderSerializer(serializers.ModelSerializer):
                 amount=total,
                 status=0
             )
+            OrderStatusEvent.placed(order).save()
+            rollup = SalesRollup()
+            rollup.placed(order, [order_item for order_item, _ in lines])
+            rollup.save()
+            KitchenQueue.record([order])
 
         return order
     
@@ -118,30 +162,49 @@ class OrderSerializer(serializers.ModelSerializer):
         data = super().to_representation(instance)
 
         # Restaurant details
-        data['restaurant'] = {
-            'id': instance.restaurant.id,
-            'name': instance.restaurant.name,
-            'address': instance.restaurant.address,
-        }
+        if self.is_expanded('restaurant'):
+            data['restaurant'] = {
+                'id': instance.restaurant.id,
+                'name': instance.restaurant.name,
+                'address': instance.restaurant.address,
+            }
 
-        # Order items
-        items_qs = (
-            instance.order_items
-            .all()
-            .select_related('menu_item')
-            .prefetch_related('order_add_ons__add_on')
-        )
+        if self.is_expanded('items'):
+            data['items'] = self.items_representation(instance)
+
+        if self.is_expanded('driver'):
+            data['driver'] = {
+                'id': instance.driver.id,
+                'phone_number': instance.driver.phone_number,
+                'name': instance.driver.get_full_name(),
+            } if instance.driver else None
+
+        return data
+
+
+    def items_representation(self, instance):
+        # Order items, read from the cache when loaded via snapshot_queryset
+        if 'order_items' in getattr(instance, '_prefetched_objects_cache', {}):
+            items_qs = instance.order_items.all()
+        else:
+            items_qs = (
+                instance.order_items
+                .all()
+                .select_related('menu_item')
+                .prefetch_related('order_add_ons__add_on')
+            )
 
-        data['items'] = []
+        items = []
         for item in items_qs:
             item_data = {
                 'id': item.id,
                 'menu_item': {
                     'id': item.menu_item.id,
                     'name': item.menu_item.name,
-                    'price': str(item.menu_item.price),
+                    'price': str(item.unit_price),
                 },
                 'quantity': item.quantity,
+                'line_total': str(item.line_total),
                 'add_ons': []
             }
 
@@ -150,22 +213,13 @@ class OrderSerializer(serializers.ModelSerializer):
                 item_data['add_ons'].append({
                     'id': add_on.add_on.id,
                     'name': add_on.add_on.name,
-                    'price': str(add_on.add_on.price),
+                    'price': str(add_on.unit_price),
                     'quantity': add_on.quantity
                 })
                 
-            data['items'].append(item_data)
-            data['driver'] = {
-                'id': instance.driver.id,
-                'phone_number': instance.driver.phone_number,
-                'name': instance.driver.get_full_name(),
-            } if instance.driver else None
-
+            items.append(item_data)
+        return items
 
-        return data
-        
-
-        
 
     def update(self, instance, validated_data):
         request = self.context['request']
@@ -174,9 +228,12 @@ class OrderSerializer(serializers.ModelSerializer):
 
         # status update
         if 'status' in validated_data:
-            instance.transition_status(
+            if not instance.transition_status(
                 user, validated_data['status']
-            )
+            ):
+                raise serializers.ValidationError(
+                    "Order status was changed concurrently. Refresh and retry."
+                )
 
         # Item updates (customer only)
         items_data = validated_data.pop('items', None)
@@ -190,75 +247,107 @@ class OrderSerializer(serializers.ModelSerializer):
                     "Order cannot be edited at this stage."
                 )
             
-            self._sync_order_items(instance, items_data)
-
-            instance.total_price = instance.get_order_total()
-            instance.save(update_fields=['total_price'])
+            with atomic():
+                line_fields = ('menu_item_id', 'quantity', 'line_total')
+                old_lines = list(instance.order_items.values_list(*line_fields))
+                self._sync_order_items(instance, items_data)
+
+                instance.total_price = instance.get_order_total()
+                instance.save(update_fields=['total_price'])
+
+                rollup = SalesRollup()
+                rollup.lines_changed(
+                    instance, old_lines,
+                    list(instance.order_items.values_list(*line_fields))
+                )
+                rollup.save()
+                KitchenQueue.record([instance])
         return instance
     
 
     # synchronize order items with provided data
     def _sync_order_items(self, order, items_data):
+        """
+        Diff the incoming lines against the stored ones in memory and
+        apply the result with filtered deletes and bulk writes, so the
+        statement count does not depend on the size of the order.
+        """
         existing_items = {
-            item.id: item for item in order.order_items.all()
+            item.id: item for item in order.order_items.prefetch_related('order_add_ons')
         }
-        incoming_item_ids = set()
+        kept_items = []
+        new_items = []
 
         for item_data in items_data:
-            item_id = item_data.get('id')
-            add_ons = item_data.pop('add_ons', [])
-
-            if item_id and item_id in existing_items:
-                order_item = existing_items[item_id]
-                order_item.quantity = item_data.get(
-                    'quantity', order_item.quantity
-                )
-                order_item.save()
-                self._sync_add_ons(order_item, add_ons)
-                incoming_item_ids.add(item_id)
+            order_item = existing_items.get(item_data.get('id'))
+            if order_item is not None:
+                if order_item.menu_item_id != item_data['menu_item'].id:
+                    order_item.unit_price = item_data['menu_item'].price
+                order_item.menu_item = item_data['menu_item']
+                order_item.quantity = item_data['quantity']
+                kept_items.append((order_item, item_data.get('add_ons', [])))
             else:
-                order_item = OrderItem.objects.create(
-                    order=order,
-                    **item_data
-                )
-                self._sync_add_ons(order_item, add_ons)
-                incoming_item_ids.add(order_item.id)
-
-
-        # Remove items not in incoming data
-        for item_id, order_item in existing_items.items():
-            if item_id not in incoming_item_ids:
-                order_item.delete()
-
-
-    
-    # synchronize add-ons for an order item
-    def _sync_add_ons(self, order_item, add_ons):
-        existing = {
-            ao.add_on_id: ao for ao in order_item.order_add_ons.all()
-        }
-        incoming_ao_ids = set()
-
-        for ao in add_ons:
-            ao_id = ao['id']
-            qty = ao['quantity']
-
-            if ao_id in existing:
-                existing[ao_id].quantity = qty
-                existing[ao_id].save()
-            else:
-                OrderAddOn.objects.create(
-                    order_item=order_item,
-                    add_on_id=ao_id,
-                    quantity=qty
-                )
-
-            incoming_ao_ids.add(ao_id)
+                add_ons = [
+                    OrderAddOn.priced(ao['add_on'], ao['quantity'])
+                    for ao in item_data.get('add_ons', [])
+                ]
+                new_items.append((
+                    OrderItem.priced(
+                        item_data['menu_item'], item_data['quantity'], add_ons,
+                        order=order
+                    ),
+                    add_ons
+                ))
+
+        kept_item_ids = [order_item.id for order_item, _ in kept_items]
+
+        # Remove items not in incoming data, with their add-ons
+        OrderAddOn.objects.filter(order_item__order=order).exclude(
+            order_item_id__in=kept_item_ids
+        ).delete()
+        OrderItem.objects.filter(order=order).exclude(
+            id__in=kept_item_ids
+        ).delete()
+
+        OrderItem.objects.bulk_create(
+            [order_item for order_item, _ in new_items]
+        )
 
-    
-        # Remove add-ons not in incoming data
-        for ao_id, order_add_on in existing.items():
-            if ao_id not in incoming_ao_ids:
-                order_add_on.delete()
+        add_ons_to_update = []
+        add_ons_to_create = []
+        stale_add_on_ids = []
+        for order_item, add_ons in new_items:
+            for add_on in add_ons:
+                add_on.order_item = order_item
+            add_ons_to_create.extend(add_ons)
+
+        for order_item, add_ons in kept_items:
+            existing = {
+                ao.add_on_id: ao for ao in order_item.order_add_ons.all()
+            }
+            add_ons_total = 0
+
+            for ao in add_ons:
+                if ao['id'] in existing:
+                    order_add_on = existing.pop(ao['id'])
+                    order_add_on.quantity = ao['quantity']
+                    order_add_on.line_total = order_add_on.unit_price * ao['quantity']
+                    add_ons_to_update.append(order_add_on)
+                else:
+                    order_add_on = OrderAddOn.priced(
+                        ao['add_on'], ao['quantity'], order_item=order_item
+                    )
+                    add_ons_to_create.append(order_add_on)
+                add_ons_total += order_add_on.line_total
 
+            # Remove add-ons not in incoming data
+            stale_add_on_ids.extend(ao.id for ao in existing.values())
+            order_item.line_total = order_item.get_item_total() + add_ons_total
 
+        OrderItem.objects.bulk_update(
+            [order_item for order_item, _ in kept_items],
+            ['menu_item', 'quantity', 'unit_price', 'line_total']
+        )
+        OrderAddOn.objects.filter(id__in=stale_add_on_ids).delete()
+        OrderAddOn.objects.bulk_update(add_ons_to_update, ['quantity', 'line_total'])
+        OrderAddOn.objects.bulk_create(add_ons_to_create)
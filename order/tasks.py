@@ -0,0 +1,13 @@
+from datetime import timedelta
+
+from celery import shared_task
+
+from .archive import archive_orders as archive_terminal_orders
+
+
+@shared_task
+def archive_orders(older_than_days=90, batch_size=500):
+    """Periodic form of `manage.py archive_orders`"""
+    return archive_terminal_orders(
+        older_than=timedelta(days=older_than_days), batch_size=batch_size
+    )
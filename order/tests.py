@@ -1,3 +1,414 @@
-from django.test import TestCase
+import threading
+import time
+from datetime import timedelta
+from decimal import Decimal
 
-# Create your tests here.
+from django.core.cache import cache
+from django.db import OperationalError, connection, connections, transaction
+from django.db.models import F
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from authUser.models import User
+from cart.models import Cart
+from order.kitchen import KitchenQueue
+from order.models import (
+    Order, OrderItem, OrderAddOn, OrderStatusEvent, DailySales, DailyItemSales
+)
+from order.rollups import rebuild_sales_rollups
+from payment.models import Payment
+from restaurant.models import Restaurant, MenuItem, AddOn
+
+
+class OrderListQueryTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.customer = User.objects.create_user(
+            username='customer', password='pass', role=1, phone_number='100'
+        )
+        cls.owner = User.objects.create_user(
+            username='owner', password='pass', role=2, phone_number='200'
+        )
+        cls.driver = User.objects.create_user(
+            username='driver', password='pass', role=3, phone_number='400'
+        )
+        cls.restaurant = Restaurant.objects.create(
+            owner=cls.owner, name='Hungry Bird', address='Dhaka', phone_number='300'
+        )
+        cls.menu_items = MenuItem.objects.bulk_create([
+            MenuItem(
+                restaurant=cls.restaurant, name=f'Item {i}', price=Decimal('10.00')
+            )
+            for i in range(3)
+        ])
+        cls.add_ons = AddOn.objects.bulk_create([
+            AddOn(menu_item=menu_item, name='Extra', price=Decimal('1.50'))
+            for menu_item in cls.menu_items
+        ])
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.customer)
+
+    def make_orders(self, count):
+        orders = Order.objects.bulk_create([
+            Order(
+                customer=self.customer, restaurant=self.restaurant,
+                driver=self.driver, total_price=Decimal('64.50'),
+                delivery_address='Gulshan'
+            )
+            for _ in range(count)
+        ])
+        order_items = OrderItem.objects.bulk_create([
+            OrderItem(
+                order=order, menu_item=menu_item, quantity=2,
+                unit_price=Decimal('10.00'), line_total=Decimal('21.50')
+            )
+            for order in orders
+            for menu_item in self.menu_items
+        ])
+        OrderAddOn.objects.bulk_create([
+            OrderAddOn(
+                order_item=order_item, add_on_id=add_on_id, quantity=1,
+                unit_price=Decimal('1.50'), line_total=Decimal('1.50')
+            )
+            for order_item, add_on_id in zip(
+                order_items,
+                [add_on.id for add_on in self.add_ons] * count
+            )
+        ])
+
+    def list_and_count(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get('/api/v1/orders/', {'page_size': 50})
+        self.assertEqual(response.status_code, 200)
+        return response.json()['results'], len(queries)
+
+    def test_list_renders_items_add_ons_and_driver(self):
+        self.make_orders(1)
+        orders, _ = self.list_and_count()
+
+        self.assertEqual(len(orders), 1)
+        self.assertEqual(orders[0]['restaurant']['name'], 'Hungry Bird')
+        self.assertEqual(orders[0]['driver']['id'], self.driver.id)
+        self.assertEqual(len(orders[0]['items']), 3)
+        self.assertEqual(orders[0]['items'][0]['add_ons'][0]['price'], '1.50')
+
+    def test_list_query_count_does_not_grow_with_page_size(self):
+        self.make_orders(1)
+        _, one_order = self.list_and_count()
+
+        self.make_orders(49)
+        orders, fifty_orders = self.list_and_count()
+
+        self.assertEqual(len(orders), 50)
+        self.assertEqual(one_order, fifty_orders)
+
+    def test_save_keeps_a_concurrent_version_bump(self):
+        self.make_orders(1)
+        order = Order.objects.get()
+        # Another request bumps the version after this copy was read
+        Order.objects.filter(pk=order.pk).update(version=F('version') + 1)
+
+        order.delivery_address = 'Banani'
+        order.save(update_fields=['delivery_address'])
+
+        self.assertEqual(order.version, 2)
+        self.assertEqual(Order.objects.get().version, 2)
+
+    def test_out_of_range_datetime_param_is_rejected(self):
+        self.client.force_authenticate(self.owner)
+        response = self.client.get(
+            '/api/v1/orders/stage_durations/', {'since': '2024-02-30T00:00:00'}
+        )
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('since', response.json())
+
+    def test_retrieve_with_a_malformed_id_is_not_found(self):
+        response = self.client.get('/api/v1/orders/abc/')
+        self.assertEqual(response.status_code, 404)
+
+
+class OrderTransitionRaceTests(TransactionTestCase):
+    def setUp(self):
+        self.customer = User.objects.create_user(
+            username='customer', password='pass', role=1, phone_number='100'
+        )
+        self.owner = User.objects.create_user(
+            username='owner', password='pass', role=2, phone_number='200'
+        )
+        restaurant = Restaurant.objects.create(
+            owner=self.owner, name='Hungry Bird', address='Dhaka', phone_number='300'
+        )
+        self.order = Order.objects.create(
+            customer=self.customer, restaurant=restaurant,
+            total_price=Decimal('10.00'), delivery_address='Gulshan'
+        )
+
+    def test_parallel_transitions_have_exactly_one_winner(self):
+        # Owner accepting and customer cancelling the same pending order at once
+        attempts = [(self.owner, 2), (self.customer, 6)] * 4
+        barrier = threading.Barrier(len(attempts))
+        results = []
+
+        def transition(user, new_status):
+            order = Order.objects.get(pk=self.order.pk)
+            barrier.wait()
+            try:
+                while True:
+                    try:
+                        won = order.transition_status(user, new_status)
+                        break
+                    except OperationalError:
+                        # The shared in-memory SQLite test database reports a
+                        # concurrent writer as "table is locked" instead of waiting
+                        time.sleep(0.01)
+                results.append((new_status, won))
+            finally:
+                connection.close()
+
+        threads = [
+            threading.Thread(target=transition, args=attempt)
+            for attempt in attempts
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        winners = [new_status for new_status, won in results if won]
+        self.assertEqual(len(results), len(attempts))
+        self.assertEqual(len(winners), 1)
+
+        self.order.refresh_from_db()
+        self.assertEqual(self.order.status, winners[0])
+        self.assertEqual(self.order.version, 1)
+
+
+class KitchenQueueTests(TransactionTestCase):
+    def setUp(self):
+        customer = User.objects.create_user(
+            username='customer', password='pass', role=1, phone_number='100'
+        )
+        owner = User.objects.create_user(
+            username='owner', password='pass', role=2, phone_number='200'
+        )
+        self.restaurant = Restaurant.objects.create(
+            owner=owner, name='Hungry Bird', address='Dhaka', phone_number='300'
+        )
+        self.orders = Order.objects.bulk_create([
+            Order(
+                customer=customer, restaurant=self.restaurant,
+                total_price=Decimal('10.00'), delivery_address='Gulshan'
+            )
+            for _ in range(2)
+        ])
+        cache.clear()
+
+    def test_concurrent_records_are_both_seen(self):
+        queue = KitchenQueue(self.restaurant.id)
+        self.assertEqual([entry['status'] for entry in queue.orders()], [1, 1])
+
+        barrier = threading.Barrier(len(self.orders))
+
+        def move(order):
+            barrier.wait()
+            try:
+                while True:
+                    try:
+                        with transaction.atomic():
+                            Order.objects.filter(pk=order.pk).update(status=2)
+                            order.status = 2
+                            KitchenQueue.record([order])
+                        break
+                    except OperationalError:
+                        # See OrderTransitionRaceTests
+                        time.sleep(0.01)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=move, args=(order,)) for order in self.orders]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual([entry['status'] for entry in queue.orders()], [2, 2])
+
+    def test_deleted_order_leaves_the_queue(self):
+        queue = KitchenQueue(self.restaurant.id)
+        self.assertEqual(len(queue.orders()), 2)
+
+        self.orders[0].delete()
+        KitchenQueue.record([self.orders[0]])
+
+        self.assertEqual(
+            [entry['id'] for entry in queue.orders()], [self.orders[1].id]
+        )
+
+
+class OrderLifecycleTests(TransactionTestCase):
+    """Orders placed through the cart API, then edited, moved and removed"""
+
+    def setUp(self):
+        self.customer = User.objects.create_user(
+            username='customer', password='pass', role=1, phone_number='100'
+        )
+        self.owner = User.objects.create_user(
+            username='owner', password='pass', role=2, phone_number='200'
+        )
+        self.restaurant = Restaurant.objects.create(
+            owner=self.owner, name='Hungry Bird', address='Dhaka', phone_number='300'
+        )
+        self.menu_items = MenuItem.objects.bulk_create([
+            MenuItem(
+                restaurant=self.restaurant, name=f'Item {i}', price=Decimal('10.00')
+            )
+            for i in range(2)
+        ])
+        self.add_on = AddOn.objects.create(
+            menu_item=self.menu_items[0], name='Extra', price=Decimal('1.50')
+        )
+        self.client = APIClient()
+        cache.clear()
+
+    def place(self):
+        self.client.force_authenticate(self.customer)
+        cart = Cart.objects.create(customer=self.customer, restaurant=self.restaurant)
+        response = self.client.post(
+            f'/api/v1/cart/{cart.id}/batch/', {'operations': [
+                {'op': 'add_item', 'menu_item': self.menu_items[0].id, 'quantity': 2},
+                {'op': 'add_item', 'menu_item': self.menu_items[1].id, 'quantity': 1},
+                {'op': 'add_addon', 'menu_item': self.menu_items[0].id,
+                 'add_on': self.add_on.id, 'quantity': 1},
+            ]}, format='json'
+        )
+        self.assertEqual(response.status_code, 200)
+
+        response = self.client.post(
+            f'/api/v1/cart/{cart.id}/confirm/', {'delivery_address': 'Gulshan'},
+            format='json'
+        )
+        self.assertEqual(response.status_code, 201)
+        return Order.objects.get(pk=response.json()['order_id'])
+
+    def test_destroy_removes_a_placed_order(self):
+        order = self.place()
+        Payment.objects.create(order=order, method=1, amount=order.total_price)
+
+        response = self.client.delete(f'/api/v1/orders/{order.id}/')
+
+        self.assertEqual(response.status_code, 204)
+        self.assertFalse(Order.objects.filter(pk=order.pk).exists())
+        self.assertFalse(OrderItem.objects.filter(order_id=order.pk).exists())
+        self.assertFalse(OrderStatusEvent.objects.filter(order_id=order.pk).exists())
+        self.assertFalse(Payment.objects.filter(order_id=order.pk).exists())
+
+
+    def rollup_rows(self):
+        sales = DailySales.objects.exclude(orders=0, revenue=0).values_list(
+            'restaurant_id', 'day', 'status', 'orders', 'revenue'
+        )
+        items = DailyItemSales.objects.exclude(quantity=0, revenue=0).values_list(
+            'restaurant_id', 'day', 'menu_item_id', 'quantity', 'revenue'
+        )
+        return sorted(sales), sorted(items)
+
+    def test_incremental_rollups_match_a_rebuild(self):
+        orders = [self.place() for _ in range(4)]
+
+        self.client.force_authenticate(self.customer)
+        response = self.client.patch(
+            f'/api/v1/orders/{orders[0].id}/',
+            {'items': [{'menu_item_id': self.menu_items[1].id, 'quantity': 5}]},
+            format='json'
+        )
+        self.assertEqual(response.status_code, 200)
+        response = self.client.patch(
+            f'/api/v1/orders/{orders[1].id}/change_status/', {'status': 6},
+            format='json'
+        )
+        self.assertEqual(response.status_code, 200)
+        response = self.client.delete(f'/api/v1/orders/{orders[3].id}/')
+        self.assertEqual(response.status_code, 204)
+
+        self.client.force_authenticate(self.owner)
+        response = self.client.post(
+            '/api/v1/orders/bulk_change_status/',
+            {'order_ids': [orders[0].id, orders[2].id], 'status': 2},
+            format='json'
+        )
+        self.assertEqual(response.status_code, 200)
+
+        incremental = self.rollup_rows()
+        self.assertTrue(incremental[0])
+        self.assertTrue(incremental[1])
+
+        today = timezone.localdate()
+        rebuild_sales_rollups(today, today + timedelta(days=1))
+        self.assertEqual(self.rollup_rows(), incremental)
+
+
+@override_settings(DATABASE_REPLICAS=['replica'])
+class OrderReplicaRoutingTests(TransactionTestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        # A second SQLite alias onto the test database stands in for a
+        # replica that has caught up. The test runner only sets up aliases
+        # from settings, so this one is added once the class is set up.
+        connections.settings['replica'] = {**connections['default'].settings_dict}
+        cls.databases = {*cls.databases, 'replica'}
+
+    @classmethod
+    def tearDownClass(cls):
+        connections['replica'].close()
+        del connections['replica']
+        del connections.settings['replica']
+        super().tearDownClass()
+
+    def setUp(self):
+        self.customer = User.objects.create_user(
+            username='customer', password='pass', role=1, phone_number='100'
+        )
+        owner = User.objects.create_user(
+            username='owner', password='pass', role=2, phone_number='200'
+        )
+        restaurant = Restaurant.objects.create(
+            owner=owner, name='Hungry Bird', address='Dhaka', phone_number='300'
+        )
+        self.order = Order.objects.create(
+            customer=self.customer, restaurant=restaurant,
+            total_price=Decimal('10.00'), delivery_address='Gulshan'
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(self.customer)
+        cache.clear()
+
+    def request(self, method, path, data=None):
+        with CaptureQueriesContext(connections['default']) as primary, \
+                CaptureQueriesContext(connections['replica']) as replica:
+            response = getattr(self.client, method)(path, data, format='json')
+        self.assertLess(response.status_code, 400)
+        return len(primary), len(replica)
+
+    def test_reads_use_the_replica_until_the_user_writes(self):
+        _, replica = self.request('get', '/api/v1/orders/')
+        self.assertGreater(replica, 0)
+
+        primary, replica = self.request(
+            'patch', f'/api/v1/orders/{self.order.id}/change_status/', {'status': 6}
+        )
+        self.assertGreater(primary, 0)
+        self.assertEqual(replica, 0)
+
+        # Pinned to the primary, so the cancellation is read back right away
+        primary, replica = self.request('get', '/api/v1/orders/')
+        self.assertGreater(primary, 0)
+        self.assertEqual(replica, 0)
+
+        cache.clear()  # The pin expires
+        _, replica = self.request('get', '/api/v1/orders/')
+        self.assertGreater(replica, 0)
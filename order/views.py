@@ -1,28 +1,72 @@
+from datetime import timedelta
+
+from django.utils import timezone
+from django.db import transaction
+from django.db.models import Sum
+from django.http import Http404, StreamingHttpResponse
+from django.utils.dateparse import parse_date, parse_datetime
 from rest_framework.viewsets import ModelViewSet
-from order.models import Order
-from order.serializers import OrderSerializer
+from restaurant.models import Restaurant
+from order.exports import ndjson_lines, csv_lines
+from order.kitchen import KitchenQueue
+from order.models import (
+    Order, OrderItem, OrderAddOn, OrderStatusEvent, DailySales, DailyItemSales,
+    ArchivedOrder
+)
+from order.rollups import SalesRollup
+from order.serializers import OrderSerializer, BulkStatusChangeSerializer
+from payment.models import Payment
 from rest_framework import status
 from rest_framework.decorators import action
 from rest_framework.exceptions import ValidationError
 from rest_framework.permissions import IsAuthenticated
 from rest_framework.response import Response
+from hungryBird.db_router import ReplicaReadMixin
+from hungryBird.etags import ConditionalRetrieveMixin
+from hungryBird.fields import FieldSelection, expands
+from hungryBird.pagination import CreatedAtCursorPagination
 from hungryBird.permissions import IsCustomer, IsRestaurantOwner, IsDriver
 
 
 # Create your views here.
-class OrderViewSet(ModelViewSet):
+class OrderViewSet(ReplicaReadMixin, ConditionalRetrieveMixin, ModelViewSet):
     queryset = Order.objects.all()
     serializer_class = OrderSerializer
+    pagination_class = CreatedAtCursorPagination
+    # Order history; single orders are read from the primary
+    replica_actions = ('list', 'archived')
 
 
     def get_permissions(self):
         if self.action in ['create', 'destroy']:
             permission_classes = [IsCustomer]
+        elif self.action in [
+            'bulk_change_status', 'kitchen_queue', 'stage_durations', 'sales'
+        ]:
+            permission_classes = [IsRestaurantOwner]
         else:
             permission_classes = [IsAuthenticated]
         return [permission() for permission in permission_classes]
     
 
+    def perform_destroy(self, instance):
+        with transaction.atomic():
+            # Roll back the status and lines the rollups hold now, not the
+            # ones read before a concurrent transition or edit committed
+            order = Order.objects.select_for_update().get(pk=instance.pk)
+            rollup = SalesRollup()
+            rollup.removed(order, order.order_items.all())
+            # The children's foreign keys are DO_NOTHING, so they go first,
+            # in the same order archive_orders removes them
+            OrderAddOn.objects.filter(order_item__order_id=order.pk).delete()
+            OrderItem.objects.filter(order_id=order.pk).delete()
+            OrderStatusEvent.objects.filter(order_id=order.pk).delete()
+            Payment.objects.filter(order_id=order.pk).delete()
+            instance.delete()
+            rollup.save()
+            KitchenQueue.record([instance])
+
+
     def perform_create(self, serializer):
         if int(self.request.user.role) != 1:
             return Response(
@@ -33,15 +77,48 @@ class OrderViewSet(ModelViewSet):
 
 
     def get_queryset(self):
+        if self.action in ['list', 'retrieve']:
+            selection = FieldSelection.from_request(self.request)
+            return self.scope_to_user(Order.snapshot_queryset(
+                restaurant=expands(selection, 'restaurant'),
+                driver=expands(selection, 'driver'),
+                items=expands(selection, 'items'),
+            ))
+        if self.action == 'export':
+            return self.scope_to_user(Order.snapshot_queryset())
+        return self.scope_to_user(Order.objects.all())
+
+
+    def scope_to_user(self, orders):
+        """Orders, active or archived, the requesting user may see"""
         user = self.request.user
         if hasattr(user, 'role'):
             if int(user.role) == 1:  # Customer
-                return Order.objects.filter(customer=user)
+                return orders.filter(customer=user)
             elif int(user.role) == 2:  # Restaurant Owner
-                return Order.objects.filter(restaurant__owner=user)
+                return orders.filter(restaurant__owner=user)
             elif int(user.role) == 3:  # Driver
-                return Order.objects.filter(driver=user)
-        return Order.objects.none()
+                return orders.filter(driver=user)
+        return orders.none()
+
+
+    def retrieve(self, request, *args, **kwargs):
+        """Orders no longer in the active tables are looked up in the archive"""
+        try:
+            return super().retrieve(request, *args, **kwargs)
+        except Http404:
+            try:
+                archived = self.scope_to_user(ArchivedOrder.objects.all()).filter(
+                    pk=kwargs[self.lookup_url_kwarg or self.lookup_field]
+                ).first()
+            except (TypeError, ValueError):
+                archived = None
+            if archived is None:
+                raise
+            return Response(
+                {**archived.record, 'archived_at': archived.archived_at},
+                status=status.HTTP_200_OK
+            )
     
 
     def partial_update(self, request, *args, **kwargs):
@@ -72,7 +149,11 @@ class OrderViewSet(ModelViewSet):
         except (TypeError, ValueError):
             raise ValidationError({"status": "Invalid status value."})
         
-        order.transition_status(request.user, new_status)
+        if not order.transition_status(request.user, new_status):
+            return Response(
+                {'detail': 'Order status was changed concurrently. Refresh and retry.'},
+                status=status.HTTP_409_CONFLICT
+            )
         
         return Response(
             {
@@ -83,4 +164,255 @@ class OrderViewSet(ModelViewSet):
             },
             status=status.HTTP_200_OK
         )
-    
\ No newline at end of file
+    
+
+
+    @action(
+        detail=False, methods=['post'],
+        permission_classes=[IsAuthenticated, IsRestaurantOwner],
+        url_path='bulk_change_status'
+    )
+    def bulk_change_status(self, request):
+        """
+        Move many orders to one status at once.
+        Expected payload: {"order_ids": [<id>, ...], "status": <int>}
+        Orders that were not found are listed in "skipped".
+        """
+        serializer = BulkStatusChangeSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        order_ids = set(serializer.validated_data['order_ids'])
+
+        moved = Order.bulk_transition_status(
+            self.get_queryset().filter(id__in=order_ids),
+            request.user,
+            serializer.validated_data['status']
+        )
+        moved_ids = sorted(order.id for order in moved)
+
+        return Response(
+            {
+                "updated": moved_ids,
+                "skipped": sorted(order_ids - set(moved_ids)),
+                "message": f"{len(moved_ids)} orders updated."
+            },
+            status=status.HTTP_200_OK
+        )
+
+
+    @action(
+        detail=False, methods=['get'],
+        permission_classes=[IsAuthenticated, IsRestaurantOwner],
+        url_path='kitchen_queue'
+    )
+    def kitchen_queue(self, request):
+        """
+        Active orders (Pending to Out for Delivery) of the owner's
+        restaurants, oldest first. Optional query param: ?restaurant=<id>
+        """
+        restaurants = Restaurant.objects.filter(owner=request.user)
+        restaurant_id = request.query_params.get('restaurant')
+        if restaurant_id is not None:
+            try:
+                restaurants = restaurants.filter(id=int(restaurant_id))
+            except ValueError:
+                raise ValidationError({"restaurant": "Invalid restaurant id."})
+
+        return Response(
+            [
+                {
+                    'restaurant': restaurant_id,
+                    'orders': KitchenQueue(restaurant_id).orders()
+                }
+                for restaurant_id in restaurants.values_list('id', flat=True)
+            ],
+            status=status.HTTP_200_OK
+        )
+
+
+    @action(
+        detail=False, methods=['get'],
+        permission_classes=[IsAuthenticated, IsRestaurantOwner],
+        url_path='stage_durations'
+    )
+    def stage_durations(self, request):
+        """
+        Average time orders of the owner's restaurants spent in each status.
+        Optional query params: ?since=<ISO datetime>&until=<ISO datetime>,
+        defaulting to the last 7 days.
+        """
+        until = self._parse_datetime_param('until', timezone.now())
+        since = self._parse_datetime_param('since', until - timedelta(days=7))
+
+        stages = OrderStatusEvent.stage_durations(
+            Restaurant.objects.filter(owner=request.user).values('id'),
+            since, until
+        )
+        labels = dict(Order.STATUS_CHOICES)
+
+        return Response(
+            [
+                {
+                    'status': stage['to_status'],
+                    'status_display': labels[stage['to_status']],
+                    'orders': stage['orders'],
+                    'average_seconds': stage['average'].total_seconds(),
+                }
+                for stage in stages
+            ],
+            status=status.HTTP_200_OK
+        )
+
+
+    @action(
+        detail=False, methods=['get'],
+        permission_classes=[IsAuthenticated, IsRestaurantOwner],
+        url_path='sales'
+    )
+    def sales(self, request):
+        """
+        Daily order counts and revenue plus top items for the owner's
+        restaurants, read from the daily rollups.
+        Optional query params: ?since=<YYYY-MM-DD>&until=<YYYY-MM-DD>
+        (default: the last 30 days) and ?restaurant=<id>.
+        """
+        until = self._parse_date_param('until', timezone.localdate())
+        since = self._parse_date_param('since', until - timedelta(days=30))
+
+        restaurants = Restaurant.objects.filter(owner=request.user)
+        restaurant_id = request.query_params.get('restaurant')
+        if restaurant_id is not None:
+            try:
+                restaurants = restaurants.filter(id=int(restaurant_id))
+            except ValueError:
+                raise ValidationError({"restaurant": "Invalid restaurant id."})
+        scope = {
+            'restaurant_id__in': restaurants.values('id'),
+            'day__gte': since,
+            'day__lte': until,
+        }
+
+        days = {}
+        labels = dict(Order.STATUS_CHOICES)
+        for row in DailySales.objects.filter(**scope).values(
+            'day', 'status'
+        ).annotate(
+            total_orders=Sum('orders'), total_revenue=Sum('revenue')
+        ).order_by('day', 'status'):
+            day = days.setdefault(row['day'], {
+                'day': row['day'], 'orders': 0, 'revenue': 0, 'by_status': {}
+            })
+            if not row['total_orders']:
+                continue
+            day['by_status'][labels[row['status']]] = row['total_orders']
+            if row['status'] != 6:  # Cancelled orders bring no revenue
+                day['orders'] += row['total_orders']
+                day['revenue'] += row['total_revenue']
+
+        top_items = DailyItemSales.objects.filter(**scope).values(
+            'menu_item_id', 'menu_item__name'
+        ).annotate(
+            total_quantity=Sum('quantity'), total_revenue=Sum('revenue')
+        ).filter(total_quantity__gt=0).order_by('-total_quantity')[:10]
+
+        return Response(
+            {
+                'days': [
+                    {**day, 'revenue': f"{day['revenue']:.2f}"}
+                    for day in days.values()
+                ],
+                'top_items': [
+                    {
+                        'menu_item': item['menu_item_id'],
+                        'name': item['menu_item__name'],
+                        'quantity': item['total_quantity'],
+                        'revenue': f"{item['total_revenue']:.2f}",
+                    }
+                    for item in top_items
+                ],
+            },
+            status=status.HTTP_200_OK
+        )
+
+
+    @action(detail=False, methods=['get'], url_path='archived')
+    def archived(self, request):
+        """
+        The caller's archived (delivered or cancelled long ago) orders,
+        newest first, as stored at archive time.
+        """
+        archived = self.scope_to_user(ArchivedOrder.objects.all())
+        page = self.paginate_queryset(archived)
+        return self.get_paginated_response([
+            {**order.record, 'archived_at': order.archived_at}
+            for order in page
+        ])
+
+
+    @action(detail=False, methods=['get'], url_path='export')
+    def export(self, request):
+        """
+        Stream the caller's orders with their items and add-ons, active
+        ones first, then those archived (delivered or cancelled long ago).
+        Optional query params: ?as=ndjson|csv (default: ndjson),
+        ?since=<ISO datetime>&until=<ISO datetime>, ?status=<int>[,<int>...]
+        """
+        export_as = request.query_params.get('as', 'ndjson')
+        if export_as not in ('ndjson', 'csv'):
+            raise ValidationError({"as": "Expected ndjson or csv."})
+
+        filters = {}
+        if 'since' in request.query_params:
+            filters['created_at__gte'] = self._parse_datetime_param('since', None)
+        if 'until' in request.query_params:
+            filters['created_at__lt'] = self._parse_datetime_param('until', None)
+        if 'status' in request.query_params:
+            try:
+                filters['status__in'] = [
+                    int(value) for value in request.query_params['status'].split(',')
+                ]
+            except ValueError:
+                raise ValidationError({"status": "Invalid status value."})
+
+        orders = self.get_queryset().filter(**filters)
+        archived = self.scope_to_user(ArchivedOrder.objects.all()).filter(**filters)
+
+        if export_as == 'csv':
+            response = StreamingHttpResponse(
+                csv_lines(orders, archived), content_type='text/csv'
+            )
+        else:
+            response = StreamingHttpResponse(
+                ndjson_lines(orders, archived), content_type='application/x-ndjson'
+            )
+        response['Content-Disposition'] = f'attachment; filename="orders.{export_as}"'
+        return response
+
+
+    def _parse_date_param(self, name, default):
+        value = self.request.query_params.get(name)
+        if value is None:
+            return default
+
+        try:
+            parsed = parse_date(value)
+        except ValueError:
+            parsed = None
+        if parsed is None:
+            raise ValidationError({name: "Invalid date, expected YYYY-MM-DD."})
+        return parsed
+
+
+    def _parse_datetime_param(self, name, default):
+        value = self.request.query_params.get(name)
+        if value is None:
+            return default
+
+        try:
+            parsed = parse_datetime(value)
+        except ValueError:
+            parsed = None
+        if parsed is None:
+            raise ValidationError({name: "Invalid datetime, expected ISO 8601."})
+        if timezone.is_naive(parsed):
+            parsed = timezone.make_aware(parsed)
+        return parsed
@@ -0,0 +1,172 @@
+import uuid
+
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Count, Max, Min
+
+from hungryBird.db_router import primary_reads
+
+
+class MenuCache:
+    """
+    Serialized restaurants (menu items and add-ons included) for public
+    reads, stored under a per-restaurant version key. Saving or deleting
+    a restaurant, menu item or add-on bumps the version (restaurant/
+    signals.py), so stale entries are never read again and simply expire.
+
+    The list of active restaurant ids has a version of its own, bumped
+    when any restaurant is saved or deleted, and so do the category
+    facets across all restaurants, bumped on any menu change.
+    """
+    TIMEOUT = 60 * 60 * 24
+    INDEX_VERSION_KEY = 'restaurant_index_version'
+    FACETS_VERSION_KEY = 'menu_facets_version'
+
+
+    @staticmethod
+    def version_key(restaurant_id):
+        return f'menu_version:{restaurant_id}'
+
+    @staticmethod
+    def _new_version():
+        # Random rather than a counter, so a version key that was evicted
+        # cannot come back with the number of an older, stale entry
+        return uuid.uuid4().hex
+
+    @classmethod
+    def versions(cls, keys):
+        """Current version of each key, creating the missing ones"""
+        versions = cache.get_many(keys)
+        for key in keys:
+            if key not in versions:
+                cache.add(key, cls._new_version(), None)
+                versions[key] = cache.get(key)
+        return versions
+
+
+    # Reads
+    @classmethod
+    def restaurant_ids(cls):
+        """Active restaurant ids, by name"""
+        version = cls.versions([cls.INDEX_VERSION_KEY])[cls.INDEX_VERSION_KEY]
+        key = f'restaurant_index:{version}'
+        restaurant_ids = cache.get(key)
+        if restaurant_ids is None:
+            from restaurant.models import Restaurant
+
+            with primary_reads():
+                restaurant_ids = list(
+                    Restaurant.objects.filter(is_active=True).order_by(
+                        'name'
+                    ).values_list('id', flat=True)
+                )
+            cache.set(key, restaurant_ids, cls.TIMEOUT)
+        return restaurant_ids
+
+    @classmethod
+    def menus(cls, restaurant_ids):
+        """{restaurant_id: serialized restaurant} for the active ones among `restaurant_ids`"""
+        versions = cls.versions([cls.version_key(pk) for pk in restaurant_ids])
+        keys = {
+            pk: f'menu:{pk}:{versions[cls.version_key(pk)]}'
+            for pk in restaurant_ids
+        }
+        cached = cache.get_many(keys.values())
+        menus = {pk: cached[key] for pk, key in keys.items() if key in cached}
+
+        missing = [pk for pk in restaurant_ids if pk not in menus]
+        if missing:
+            from restaurant.models import Restaurant
+            from restaurant.serializers import RestaurantSerializer
+
+            # Filled from the primary: a lagging replica would otherwise
+            # store an old menu under the new version
+            with primary_reads():
+                loaded = {
+                    restaurant.id: RestaurantSerializer(restaurant).data
+                    for restaurant in Restaurant.menu_queryset().filter(id__in=missing)
+                }
+            cache.set_many(
+                {keys[pk]: menu for pk, menu in loaded.items()}, cls.TIMEOUT
+            )
+            menus.update(loaded)
+        return menus
+
+    @classmethod
+    def restaurants(cls):
+        """Every active restaurant, by name"""
+        restaurant_ids = cls.restaurant_ids()
+        menus = cls.menus(restaurant_ids)
+        return [menus[pk] for pk in restaurant_ids if pk in menus]
+
+    @classmethod
+    def restaurant(cls, restaurant_id):
+        return cls.menus([restaurant_id]).get(restaurant_id)
+
+
+    @classmethod
+    def facets(cls, restaurant_id=None):
+        """
+        Categories with available items, with item counts and price
+        ranges, of one restaurant or of every active one
+        """
+        if restaurant_id is None:
+            version_key, scope = cls.FACETS_VERSION_KEY, 'all'
+        else:
+            version_key, scope = cls.version_key(restaurant_id), restaurant_id
+        key = f'menu_facets:{scope}:{cls.versions([version_key])[version_key]}'
+
+        facets = cache.get(key)
+        if facets is None:
+            facets = cls._load_facets(restaurant_id)
+            cache.set(key, facets, cls.TIMEOUT)
+        return facets
+
+    @staticmethod
+    def _load_facets(restaurant_id):
+        from restaurant.models import MenuItem
+
+        menu_items = MenuItem.objects.filter(
+            is_active=True, is_available=True, restaurant__is_active=True
+        )
+        if restaurant_id is not None:
+            menu_items = menu_items.filter(restaurant_id=restaurant_id)
+
+        with primary_reads():
+            rows = list(menu_items.values('category').annotate(
+                items=Count('id'), min_price=Min('price'), max_price=Max('price')
+            ).order_by())
+
+        # Tabs follow the order of CATEGORY_CHOICES, uncategorized last
+        position = {value: index for index, (value, _) in enumerate(MenuItem.CATEGORY_CHOICES)}
+        labels = dict(MenuItem.CATEGORY_CHOICES)
+        rows.sort(key=lambda row: position.get(row['category'], len(position)))
+        return [
+            {
+                'value': row['category'],
+                'label': labels.get(row['category'], 'Other'),
+                'items': row['items'],
+                'min_price': f"{row['min_price']:.2f}",
+                'max_price': f"{row['max_price']:.2f}",
+            }
+            for row in rows
+        ]
+
+
+    # Invalidation
+    @classmethod
+    def bump(cls, restaurant_id, index=False):
+        """
+        New menu version for the restaurant, the facets and, with `index`,
+        the id list, once the transaction commits. The restaurant's facets
+        are computed right away, so category tabs never wait on them.
+        """
+        keys = [cls.version_key(restaurant_id), cls.FACETS_VERSION_KEY]
+        if index:
+            keys.append(cls.INDEX_VERSION_KEY)
+
+        def apply():
+            cache.set_many({key: cls._new_version() for key in keys}, None)
+            cls.facets(restaurant_id)
+
+        transaction.on_commit(apply)
@@ -0,0 +1,43 @@
+# Generated by Django 6.0 on 2026-10-17 22:58
+
+from django.conf import settings
+from django.db import migrations, models
+
+from hungryBird.geo import geohash_encode
+
+
+def backfill_geohash(apps, schema_editor):
+    Restaurant = apps.get_model('restaurant', 'Restaurant')
+
+    restaurants = Restaurant.objects.filter(
+        latitude__isnull=False, longitude__isnull=False
+    ).only('id', 'latitude', 'longitude')
+    batch = []
+    for restaurant in restaurants.iterator(chunk_size=1000):
+        restaurant.geohash = geohash_encode(restaurant.latitude, restaurant.longitude)
+        batch.append(restaurant)
+        if len(batch) == 1000:
+            Restaurant.objects.bulk_update(batch, ['geohash'])
+            batch = []
+    Restaurant.objects.bulk_update(batch, ['geohash'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('restaurant', '0001_initial'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='restaurant',
+            name='geohash',
+            field=models.CharField(blank=True, default='', max_length=12),
+        ),
+        migrations.AddIndex(
+            model_name='restaurant',
+            index=models.Index(fields=['geohash'], name='restaurant_geohash_idx'),
+        ),
+        migrations.RunPython(backfill_geohash, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,123 @@
+# Generated by Django 6.0 on 2026-10-17 23:02
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+SQLITE_INDEX = [
+    """
+    CREATE VIRTUAL TABLE restaurant_menusearch_fts USING fts5(
+        name, restaurant_text, body,
+        content='restaurant_menusearchdocument', content_rowid='menu_item_id',
+        tokenize='unicode61 remove_diacritics 2'
+    )
+    """,
+    """
+    CREATE TRIGGER restaurant_menusearch_ai AFTER INSERT ON restaurant_menusearchdocument BEGIN
+        INSERT INTO restaurant_menusearch_fts(rowid, name, restaurant_text, body)
+        VALUES (new.menu_item_id, new.name, new.restaurant_text, new.body);
+    END
+    """,
+    """
+    CREATE TRIGGER restaurant_menusearch_ad AFTER DELETE ON restaurant_menusearchdocument BEGIN
+        INSERT INTO restaurant_menusearch_fts(restaurant_menusearch_fts, rowid, name, restaurant_text, body)
+        VALUES ('delete', old.menu_item_id, old.name, old.restaurant_text, old.body);
+    END
+    """,
+    """
+    CREATE TRIGGER restaurant_menusearch_au AFTER UPDATE ON restaurant_menusearchdocument BEGIN
+        INSERT INTO restaurant_menusearch_fts(restaurant_menusearch_fts, rowid, name, restaurant_text, body)
+        VALUES ('delete', old.menu_item_id, old.name, old.restaurant_text, old.body);
+        INSERT INTO restaurant_menusearch_fts(rowid, name, restaurant_text, body)
+        VALUES (new.menu_item_id, new.name, new.restaurant_text, new.body);
+    END
+    """,
+]
+
+SQLITE_DROP_INDEX = [
+    'DROP TRIGGER restaurant_menusearch_au',
+    'DROP TRIGGER restaurant_menusearch_ad',
+    'DROP TRIGGER restaurant_menusearch_ai',
+    'DROP TABLE restaurant_menusearch_fts',
+]
+
+POSTGRES_INDEX = [
+    """
+    ALTER TABLE restaurant_menusearchdocument ADD COLUMN document tsvector
+    GENERATED ALWAYS AS (
+        setweight(to_tsvector('simple', name), 'A')
+        || setweight(to_tsvector('simple', restaurant_text), 'B')
+        || setweight(to_tsvector('simple', body), 'C')
+    ) STORED
+    """,
+    """
+    CREATE INDEX restaurant_menusearch_document_idx
+    ON restaurant_menusearchdocument USING GIN (document)
+    """,
+]
+
+POSTGRES_DROP_INDEX = [
+    'DROP INDEX restaurant_menusearch_document_idx',
+    'ALTER TABLE restaurant_menusearchdocument DROP COLUMN document',
+]
+
+
+def run_for_vendor(statements):
+    def run(apps, schema_editor):
+        for statement in statements.get(schema_editor.connection.vendor, []):
+            schema_editor.execute(statement)
+    return run
+
+
+def backfill_search_documents(apps, schema_editor):
+    MenuItem = apps.get_model('restaurant', 'MenuItem')
+    AddOn = apps.get_model('restaurant', 'AddOn')
+    MenuSearchDocument = apps.get_model('restaurant', 'MenuSearchDocument')
+
+    menu_items = MenuItem.objects.filter(
+        is_active=True, restaurant__is_active=True
+    ).select_related('restaurant').prefetch_related(
+        models.Prefetch('add_ons', AddOn.objects.filter(is_active=True))
+    )
+    batch = []
+    for menu_item in menu_items.iterator(chunk_size=1000):
+        batch.append(MenuSearchDocument(
+            menu_item=menu_item,
+            restaurant_id=menu_item.restaurant_id,
+            name=menu_item.name,
+            body=' '.join(filter(None, [
+                menu_item.description,
+                menu_item.get_category_display() if menu_item.category else '',
+                *(add_on.name for add_on in menu_item.add_ons.all()),
+            ])),
+            restaurant_text=f'{menu_item.restaurant.name} {menu_item.restaurant.address}',
+        ))
+        if len(batch) == 1000:
+            MenuSearchDocument.objects.bulk_create(batch)
+            batch = []
+    MenuSearchDocument.objects.bulk_create(batch)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('restaurant', '0002_restaurant_geohash'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MenuSearchDocument',
+            fields=[
+                ('menu_item', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='+', serialize=False, to='restaurant.menuitem')),
+                ('name', models.CharField(max_length=255)),
+                ('body', models.TextField(blank=True)),
+                ('restaurant_text', models.TextField(blank=True)),
+                ('restaurant', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='restaurant.restaurant')),
+            ],
+        ),
+        migrations.RunPython(
+            run_for_vendor({'sqlite': SQLITE_INDEX, 'postgresql': POSTGRES_INDEX}),
+            run_for_vendor({'sqlite': SQLITE_DROP_INDEX, 'postgresql': POSTGRES_DROP_INDEX}),
+        ),
+        migrations.RunPython(backfill_search_documents, migrations.RunPython.noop),
+    ]
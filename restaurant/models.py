@@ -1,5 +1,6 @@
 from django.db import models
 from hungryBird.baseModels import TimeStampedModel, LocationModel
+from hungryBird.geo import geohash_encode
 
 # Create your models here.
 class Restaurant(TimeStampedModel, LocationModel):
@@ -17,21 +18,53 @@ class Restaurant(TimeStampedModel, LocationModel):
         related_name='assigned_restaurants',
         blank=True
     )
-
-
-    def assign_driver(self, order):
-        # Assign driver with no pending order
-        available_drivers = self.drivers.filter(
+    # Derived from latitude/longitude on save; prefix ranges of it find
+    # the restaurants near a point without scanning the table
+    geohash = models.CharField(max_length=12, blank=True, default='')
+
+
+    def save(self, *args, **kwargs):
+        if self.latitude is not None and self.longitude is not None:
+            self.geohash = geohash_encode(self.latitude, self.longitude)
+        else:
+            self.geohash = ''
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and {'latitude', 'longitude'} & set(update_fields):
+            kwargs['update_fields'] = {*update_fields, 'geohash'}
+        super().save(*args, **kwargs)
+
+
+    @classmethod
+    def menu_queryset(cls, menu_items=True, add_ons=True):
+        """Active restaurants with their active menu items and add-ons loaded up front"""
+        restaurants = cls.objects.filter(is_active=True)
+        if not menu_items:
+            return restaurants
+
+        items = MenuItem.objects.filter(is_active=True)
+        if add_ons:
+            items = items.prefetch_related('add_ons')
+        return restaurants.prefetch_related(models.Prefetch('menu_items', items))
+
+
+    def pick_drivers(self, count):
+        # Up to `count` distinct drivers with no pending order; nothing is saved
+        return list(self.drivers.filter(
             role = 3,
         ).exclude(
             deliveries__status__in=[3,4] # Exclude drivers with 'Ready for Pickup' or 'Out for Delivery' orders
-        ).order_by('?') # Random order to distribute assignments fairly
-        if available_drivers.exists():
-            driver = available_drivers.first()
+        ).order_by('?')[:count]) # Random order to distribute assignments fairly
+
+    def pick_driver(self):
+        drivers = self.pick_drivers(1)
+        return drivers[0] if drivers else None
+
+    def assign_driver(self, order):
+        driver = self.pick_driver()
+        if driver:
             order.driver = driver
-            order.save()
-            return driver
-        return None
+            order.save(update_fields=['driver'])
+        return driver
 
 
     def __str__(self):
@@ -41,6 +74,9 @@ class Restaurant(TimeStampedModel, LocationModel):
         verbose_name = 'Restaurant'
         verbose_name_plural = 'Restaurants'
         ordering = ['name']
+        indexes = [
+            models.Index(fields=['geohash'], name='restaurant_geohash_idx'),
+        ]
 
 
 
@@ -90,4 +126,64 @@ class AddOn(TimeStampedModel):
 
     def __str__(self):
         return f"{self.name} ({self.menu_item.name})"
-    
+
+
+
+class MenuSearchDocument(models.Model):
+    """
+    Searchable text of one active menu item of an active restaurant,
+    indexed by the database's full-text search (restaurant/search.py).
+    Rewritten by restaurant/signals.py whenever the item, its add-ons
+    or its restaurant are saved.
+    """
+    menu_item = models.OneToOneField(
+        MenuItem, on_delete=models.CASCADE, primary_key=True, related_name='+'
+    )
+    restaurant = models.ForeignKey(
+        Restaurant, on_delete=models.CASCADE, related_name='+'
+    )
+    name = models.CharField(max_length=255)
+    # Description, category and add-on names
+    body = models.TextField(blank=True)
+    # Restaurant name and address
+    restaurant_text = models.TextField(blank=True)
+
+
+    @classmethod
+    def build(cls, menu_item):
+        """Unsaved document of a menu item loaded with its restaurant and active add-ons"""
+        return cls(
+            menu_item=menu_item,
+            restaurant_id=menu_item.restaurant_id,
+            name=menu_item.name,
+            body=' '.join(filter(None, [
+                menu_item.description,
+                menu_item.get_category_display() if menu_item.category else '',
+                *(add_on.name for add_on in menu_item.add_ons.all()),
+            ])),
+            restaurant_text=f'{menu_item.restaurant.name} {menu_item.restaurant.address}',
+        )
+
+    @classmethod
+    def refresh(cls, menu_item_ids):
+        """Rewrite the documents of these menu items, dropping the ones no longer searchable"""
+        menu_item_ids = list(menu_item_ids)
+        menu_items = MenuItem.objects.filter(
+            id__in=menu_item_ids, is_active=True, restaurant__is_active=True
+        ).select_related('restaurant').prefetch_related(
+            models.Prefetch('add_ons', AddOn.objects.filter(is_active=True))
+        )
+        documents = [cls.build(menu_item) for menu_item in menu_items]
+
+        cls.objects.filter(menu_item_id__in=menu_item_ids).exclude(
+            menu_item_id__in=[document.menu_item_id for document in documents]
+        ).delete()
+        cls.objects.bulk_create(
+            documents,
+            update_conflicts=True,
+            unique_fields=['menu_item'],
+            update_fields=['restaurant', 'name', 'body', 'restaurant_text'],
+        )
+
+    def __str__(self):
+        return self.name
@@ -0,0 +1,115 @@
+import re
+
+from django.db import connections, router
+from django.db.models import Q
+
+
+MAX_SEARCH_TERMS = 8
+
+
+class MenuSearchResults:
+    """
+    Ids of the menu items matching `query`, best first. Counts and
+    slices run against the database's full-text index, so it can be
+    handed to a paginator like a queryset:
+
+    - SQLite: the FTS5 table over MenuSearchDocument, ranked by bm25
+    - PostgreSQL: the document tsvector column, ranked by ts_rank
+    - anything else: icontains on the documents, by name
+
+    Every term must match, as a prefix of a word in the item's name,
+    description, category, add-ons or restaurant name and address.
+    Name matches rank above restaurant matches, which rank above the rest.
+    """
+
+    def __init__(self, query):
+        from restaurant.models import MenuSearchDocument
+
+        self.model = MenuSearchDocument
+        self.terms = re.findall(r'\w+', query.lower())[:MAX_SEARCH_TERMS]
+        self.connection = connections[router.db_for_read(MenuSearchDocument)]
+        self._count = None
+
+    def count(self):
+        if self._count is None:
+            self._count = self._fetch_count() if self.terms else 0
+        return self._count
+
+    def __len__(self):
+        return self.count()
+
+    def __getitem__(self, page):
+        if not self.terms:
+            return []
+        return self._fetch_ids(page.start or 0, page.stop - (page.start or 0))
+
+
+    # Backends
+    def _fetch_count(self):
+        vendor = self.connection.vendor
+        if vendor == 'sqlite':
+            return self._scalar(
+                'SELECT count(*) FROM restaurant_menusearch_fts '
+                'WHERE restaurant_menusearch_fts MATCH %s',
+                [self._fts5_query()]
+            )
+        if vendor == 'postgresql':
+            return self._scalar(
+                "SELECT count(*) FROM restaurant_menusearchdocument "
+                "WHERE document @@ to_tsquery('simple', %s)",
+                [self._tsquery()]
+            )
+        return self._fallback().count()
+
+    def _fetch_ids(self, offset, limit):
+        vendor = self.connection.vendor
+        if vendor == 'sqlite':
+            # bm25 weights follow the column order: name, restaurant_text, body
+            sql = (
+                'SELECT rowid FROM restaurant_menusearch_fts '
+                'WHERE restaurant_menusearch_fts MATCH %s '
+                'ORDER BY bm25(restaurant_menusearch_fts, 10.0, 5.0, 1.0), rowid '
+                'LIMIT %s OFFSET %s'
+            )
+            params = [self._fts5_query(), limit, offset]
+        elif vendor == 'postgresql':
+            sql = (
+                "SELECT menu_item_id FROM restaurant_menusearchdocument "
+                "WHERE document @@ to_tsquery('simple', %s) "
+                "ORDER BY ts_rank(document, to_tsquery('simple', %s)) DESC, menu_item_id "
+                "LIMIT %s OFFSET %s"
+            )
+            params = [self._tsquery(), self._tsquery(), limit, offset]
+        else:
+            return list(
+                self._fallback().order_by('name', 'menu_item_id').values_list(
+                    'menu_item_id', flat=True
+                )[offset:offset + limit]
+            )
+
+        with self.connection.cursor() as cursor:
+            cursor.execute(sql, params)
+            return [row[0] for row in cursor.fetchall()]
+
+    def _scalar(self, sql, params):
+        with self.connection.cursor() as cursor:
+            cursor.execute(sql, params)
+            return cursor.fetchone()[0]
+
+    def _fts5_query(self):
+        # Terms are \w+ only, so quoting each one is enough to keep FTS5
+        # operators out of user input
+        return ' '.join(f'"{term}"*' for term in self.terms)
+
+    def _tsquery(self):
+        return ' & '.join(f'{term}:*' for term in self.terms)
+
+    def _fallback(self):
+        documents = self.model.objects.using(self.connection.alias)
+        for term in self.terms:
+            documents = documents.filter(
+                Q(name__icontains=term)
+                | Q(body__icontains=term)
+                | Q(restaurant_text__icontains=term)
+            )
+        return documents
@@ -1,6 +1,7 @@
 from rest_framework import serializers
 from .models import Restaurant, MenuItem, AddOn
 from django.contrib.auth import get_user_model
+from hungryBird.fields import DynamicFieldsMixin
 
 
 User = get_user_model()
@@ -12,7 +13,8 @@ class AddOnSerializer(serializers.ModelSerializer):
         fields = ['id', 'name', 'price']
 
 
-class MenuItemSerializer(serializers.ModelSerializer):
+class MenuItemSerializer(DynamicFieldsMixin, serializers.ModelSerializer):
+    expandable_fields = ('add_ons',)
     add_ons = AddOnSerializer(many=True, read_only=True)
     restaurant_id = serializers.PrimaryKeyRelatedField(
         source='restaurant',
@@ -23,13 +25,21 @@ class MenuItemSerializer(serializers.ModelSerializer):
         model = MenuItem
         fields = ['id', 'name', 'category', 'description', 'price',  'is_available', 'restaurant_id', 'add_ons', ]
 
+class MenuItemSearchSerializer(MenuItemSerializer):
+    restaurant_name = serializers.CharField(source='restaurant.name', read_only=True)
+
+    class Meta(MenuItemSerializer.Meta):
+        fields = MenuItemSerializer.Meta.fields + ['restaurant_name']
+
+
 class RestaurantDriverSerializer(serializers.ModelSerializer):
     class Meta:
         model = User
         fields = ['id', 'username', 'first_name', 'last_name', 'phone_number']
 
 
-class RestaurantSerializer(serializers.ModelSerializer):
+class RestaurantSerializer(DynamicFieldsMixin, serializers.ModelSerializer):
+    expandable_fields = ('menu_items',)
     menu_items = MenuItemSerializer(many=True, read_only=True)
 
     class Meta:
@@ -0,0 +1,49 @@
+'''
+Keep derived menu data in step with restaurants, menu items and add-ons:
+bump the restaurant's menu cache version and rewrite the search
+documents of the affected items whenever one is saved or deleted.
+'''
+
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .cache import MenuCache
+from .models import Restaurant, MenuItem, AddOn, MenuSearchDocument
+
+
+@receiver([post_save, post_delete], sender=Restaurant)
+def bump_restaurant_menu(sender, instance, **kwargs):
+    # Name or active flag may have changed, so the id list is bumped too
+    MenuCache.bump(instance.pk, index=True)
+
+
+@receiver(post_save, sender=Restaurant)
+def refresh_restaurant_search(sender, instance, **kwargs):
+    MenuSearchDocument.refresh(
+        MenuItem.objects.filter(restaurant=instance).values_list('id', flat=True)
+    )
+
+
+@receiver([post_save, post_delete], sender=MenuItem)
+def bump_menu_item_menu(sender, instance, **kwargs):
+    MenuCache.bump(instance.restaurant_id)
+
+
+@receiver(post_save, sender=MenuItem)
+def refresh_menu_item_search(sender, instance, **kwargs):
+    # Deleted items lose their document through the cascade
+    MenuSearchDocument.refresh([instance.pk])
+
+
+@receiver([post_save, post_delete], sender=AddOn)
+def bump_add_on_menu(sender, instance, origin=None, **kwargs):
+    restaurant_id = MenuItem.objects.filter(
+        pk=instance.menu_item_id
+    ).values_list('restaurant_id', flat=True).first()
+    if restaurant_id is None:
+        return
+    MenuCache.bump(restaurant_id)
+
+    # Add-ons deleted along with their menu item take its document with them
+    if getattr(origin, 'model', type(origin)) in (AddOn, type(None)):
+        MenuSearchDocument.refresh([instance.menu_item_id])
@@ -1,3 +1,65 @@
+from decimal import Decimal
+
+from django.core.cache import cache
+from django.db import connection
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from rest_framework.test import APIClient
+
+from authUser.models import User
+from restaurant.models import Restaurant, MenuItem
+
+
+class MenuCacheTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        owner = User.objects.create_user(
+            username='owner', password='pass', role=2, phone_number='200'
+        )
+        # Invalidation runs on commit, so the test runs those callbacks
+        with self.captureOnCommitCallbacks(execute=True):
+            self.restaurant = Restaurant.objects.create(
+                owner=owner, name='Hungry Bird', address='Dhaka', phone_number='300'
+            )
+            self.menu_item = MenuItem.objects.create(
+                restaurant=self.restaurant, name='Kacchi', price=Decimal('10.00'),
+                category='MAIN'
+            )
+        self.client = APIClient()
+
+    def get(self, path, data=None):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(path, data)
+        self.assertEqual(response.status_code, 200)
+        return response.json(), len(queries)
+
+    def test_menu_edit_invalidates_cached_reads(self):
+        path = f'/api/v1/restaurants/{self.restaurant.id}/'
+        self.get(path)
+        _, warm = self.get(path)
+        self.assertEqual(warm, 0)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.menu_item.price = Decimal('12.00')
+            self.menu_item.save()
+
+        restaurant, _ = self.get(path)
+        self.assertEqual(restaurant['menu_items'][0]['price'], '12.00')
+        restaurants, _ = self.get('/api/v1/restaurants/')
+        self.assertEqual(restaurants[0]['menu_items'][0]['price'], '12.00')
+
+    def test_menu_edit_invalidates_cached_facets(self):
+        path = '/api/v1/menu_items/menu_categories/'
+        for data in ({'restaurant': self.restaurant.id}, None):
+            facets, _ = self.get(path, data)
+            self.assertEqual(
+                [facet['value'] for facet in facets['menu_categories']], ['MAIN']
+            )
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.menu_item.is_available = False
+            self.menu_item.save()
 
-# Create your tests here.
+        for data in ({'restaurant': self.restaurant.id}, None):
+            facets, _ = self.get(path, data)
+            self.assertEqual(facets['menu_categories'], [])
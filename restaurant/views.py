@@ -2,16 +2,27 @@ from rest_framework import generics, viewsets, status
 from rest_framework.response import Response
 from rest_framework.permissions import IsAuthenticated, AllowAny
 from rest_framework.decorators import action, api_view, permission_classes
-from django.db.models import Prefetch
+from rest_framework.exceptions import ValidationError
+from django.db.models import FloatField, Prefetch, Q
+from django.db.models.functions import Cast
 from django.contrib.auth import get_user_model
+from django.http import Http404
+from hungryBird.db_router import ReplicaReadMixin
+from hungryBird.fields import FieldSelection, expands
+from hungryBird.geo import GEOHASH_RANGE_END, bounding_box, geohash_cover, haversine_km
+from hungryBird.pagination import RankedPagination
 from hungryBird.permissions import IsRestaurantOwner
+from .cache import MenuCache
 from .models import Restaurant, MenuItem, AddOn
-from .serializers import RestaurantSerializer, MenuItemSerializer, AddOnSerializer
+from .search import MenuSearchResults
+from .serializers import (
+    RestaurantSerializer, MenuItemSerializer, AddOnSerializer, MenuItemSearchSerializer
+)
 
 User = get_user_model()
 
 # Create your views here.
-class RestaurantViewSet(viewsets.ModelViewSet):
+class RestaurantViewSet(ReplicaReadMixin, viewsets.ModelViewSet):
     serializer_class = RestaurantSerializer
 
     @property
@@ -39,16 +50,16 @@ class RestaurantViewSet(viewsets.ModelViewSet):
         - customer: sees all active restaurants (unauthenticated too)
         '''
 
-        # Optimize queryset to prevent N+1
-        base_queryset = Restaurant.objects.filter(is_active=True).select_related(
+        # Optimize queryset to prevent N+1, loading only what will be rendered
+        selection = FieldSelection.from_request(self.request)
+        base_queryset = Restaurant.menu_queryset(
+            menu_items=expands(selection, 'menu_items'),
+            add_ons=expands(selection, 'menu_items.add_ons'),
+        ).select_related(
             'owner'
-        ).prefetch_related(
-            Prefetch(
-                'menu_items',
-                MenuItem.objects.filter(is_active=True).prefetch_related('add_ons')
-            ),
-            'drivers'
         ).order_by('name')
+        if self.action == 'my_restaurants':
+            base_queryset = base_queryset.prefetch_related('drivers')
 
 
         user = self.request.user
@@ -64,6 +75,105 @@ class RestaurantViewSet(viewsets.ModelViewSet):
             return base_queryset
     
 
+    def uses_menu_cache(self):
+        # Owners and drivers see a filtered list; everyone else the public menus
+        return self.user_role not in (2, 3)
+
+    def list(self, request, *args, **kwargs):
+        if 'near' in request.query_params:
+            return self.list_nearby(request)
+        if not self.uses_menu_cache():
+            return super().list(request, *args, **kwargs)
+        selection = FieldSelection.from_request(request)
+        return Response([
+            RestaurantSerializer.select(menu, selection)
+            for menu in MenuCache.restaurants()
+        ])
+
+    def list_nearby(self, request):
+        """
+        ?near=<lat>,<lng>&radius_km=<km> (default 5, at most 50): restaurants
+        within the radius, nearest first, in numbered pages.
+        Candidates come from geohash prefix ranges on the index, trimmed to
+        the bounding box; only their coordinates are loaded to compute
+        exact distances.
+        """
+        try:
+            latitude, longitude = (
+                float(value) for value in request.query_params['near'].split(',')
+            )
+        except ValueError:
+            raise ValidationError({'near': 'Expected <latitude>,<longitude>.'})
+        if not (-90 <= latitude <= 90 and -180 <= longitude <= 180):
+            raise ValidationError({'near': 'Coordinates out of range.'})
+        try:
+            radius_km = float(request.query_params.get('radius_km', 5))
+        except ValueError:
+            raise ValidationError({'radius_km': 'Invalid radius.'})
+        if not 0 < radius_km <= 50:
+            raise ValidationError({'radius_km': 'Expected a radius between 0 and 50 km.'})
+
+        south, north, west, east = bounding_box(latitude, longitude, radius_km)
+        candidates = self.get_queryset().prefetch_related(None).order_by().filter(
+            latitude__range=(south, north), longitude__isnull=False
+        )
+        if -180 <= west and east <= 180:
+            candidates = candidates.filter(longitude__range=(west, east))
+        cells = geohash_cover(latitude, longitude, radius_km)
+        if cells:
+            in_cells = Q()
+            for cell in cells:
+                in_cells |= Q(geohash__gte=cell, geohash__lt=cell + GEOHASH_RANGE_END)
+            candidates = candidates.filter(in_cells)
+
+        rows = list(candidates.values_list(
+            'id', Cast('latitude', FloatField()), Cast('longitude', FloatField())
+        ))
+        distances = haversine_km(
+            latitude, longitude, [(row[1], row[2]) for row in rows]
+        )
+        nearby = sorted(
+            (distance, row[0])
+            for row, distance in zip(rows, distances)
+            if distance <= radius_km
+        )
+
+        paginator = RankedPagination()
+        page = paginator.paginate_queryset(nearby, request, view=self)
+        restaurant_ids = [restaurant_id for _, restaurant_id in page]
+        if self.uses_menu_cache():
+            selection = FieldSelection.from_request(request)
+            restaurants = {
+                restaurant_id: RestaurantSerializer.select(menu, selection)
+                for restaurant_id, menu in MenuCache.menus(restaurant_ids).items()
+            }
+        else:
+            restaurants = {
+                data['id']: data
+                for data in self.get_serializer(
+                    self.get_queryset().filter(id__in=restaurant_ids), many=True
+                ).data
+            }
+        return paginator.get_paginated_response([
+            {**restaurants[restaurant_id], 'distance_km': round(distance, 3)}
+            for distance, restaurant_id in page
+            if restaurant_id in restaurants
+        ])
+
+    def retrieve(self, request, *args, **kwargs):
+        if not self.uses_menu_cache():
+            return super().retrieve(request, *args, **kwargs)
+        try:
+            menu = MenuCache.restaurant(int(kwargs['pk']))
+        except ValueError:
+            menu = None
+        if menu is None:
+            raise Http404
+        return Response(
+            RestaurantSerializer.select(menu, FieldSelection.from_request(request))
+        )
+
+
     def perform_create(self,  serializer):
         serializer.save(owner=self.request.user)
     
@@ -165,8 +275,9 @@ class RestaurantViewSet(viewsets.ModelViewSet):
         )
 
 
-class MenuItemViewSet(viewsets.ModelViewSet):
+class MenuItemViewSet(ReplicaReadMixin, viewsets.ModelViewSet):
     serializer_class = MenuItemSerializer
+    replica_actions = ('list', 'retrieve', 'add_ons', 'menu_categories', 'search')
     
 
     @property
@@ -182,7 +293,7 @@ class MenuItemViewSet(viewsets.ModelViewSet):
         '''Allow any one for Read, Only restaurant owners can create/update/deleter'''
         if self.action in ['list', 'retrieve']:
             return [AllowAny()]
-        elif self.action in ['menu_categories', 'add_ons']:
+        elif self.action in ['menu_categories', 'add_ons', 'search']:
             return [AllowAny()]
         else:
             return [IsRestaurantOwner()]
@@ -199,12 +310,14 @@ class MenuItemViewSet(viewsets.ModelViewSet):
             is_active=True
         ).select_related(
             'restaurant'
-        ).prefetch_related(
-            Prefetch(
-                'add_ons',
-                AddOn.objects.filter(is_active=True)
-            )
         ).order_by('restaurant', 'name')
+        if expands(FieldSelection.from_request(self.request), 'add_ons'):
+            base_queryset = base_queryset.prefetch_related(
+                Prefetch(
+                    'add_ons',
+                    AddOn.objects.filter(is_active=True)
+                )
+            )
 
 
         user = self.request.user
@@ -321,16 +434,50 @@ class MenuItemViewSet(viewsets.ModelViewSet):
 
     @action(detail=False, methods=['get'])
     def menu_categories(self, request):
-        '''Get distinct menu categories'''
-        categories = MenuItem.objects.filter(is_active=True)\
-            .values_list('category', flat=True).distinct()\
-            .order_by('category')
-        
+        '''
+        Categories that have available items, with item counts and price
+        ranges, across all restaurants or for ?restaurant=<id>.
+        Served from MenuCache, refreshed whenever a menu changes.
+        '''
+        restaurant_id = request.query_params.get('restaurant')
+        if restaurant_id is not None:
+            try:
+                restaurant_id = int(restaurant_id)
+            except ValueError:
+                raise ValidationError({'restaurant': 'Invalid restaurant id.'})
+
         return Response({
-            'menu_categories': [
-                { 'value': category[0], 'label': category[1]}
-                for category in MenuItem.CATEGORY_CHOICES
-            ]
+            'menu_categories': MenuCache.facets(restaurant_id)
         })
     
 
+
+    @action(detail=False, methods=['get'])
+    def search(self, request):
+        """
+        Menu items of active restaurants matching ?q=<words>, best match
+        first, in numbered pages. Each word matches as a word prefix in the
+        item's name, description, category and add-ons or its restaurant's
+        name and address.
+        """
+        query = request.query_params.get('q', '').strip()
+        if not query:
+            raise ValidationError({'q': 'This parameter is required.'})
+
+        paginator = RankedPagination()
+        menu_item_ids = paginator.paginate_queryset(
+            MenuSearchResults(query), request, view=self
+        )
+        menu_items = MenuItem.objects.filter(id__in=menu_item_ids).select_related('restaurant')
+        if expands(FieldSelection.from_request(request), 'add_ons'):
+            menu_items = menu_items.prefetch_related(
+                Prefetch('add_ons', AddOn.objects.filter(is_active=True))
+            )
+        menu_items = menu_items.in_bulk()
+
+        return paginator.get_paginated_response(
+            MenuItemSearchSerializer(
+                [menu_items[pk] for pk in menu_item_ids if pk in menu_items],
+                many=True, context={'request': request}
+            ).data
+        )